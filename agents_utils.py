@@ -1,149 +1,741 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-from sf_utils import *
+import json
+import time
+import random
 import asyncio
-import snowflake.connector
-import streamlit as st
-from pydantic import BaseModel
-from typing import List, Dict
+import weakref
+from typing import List
+from pydantic import BaseModel, ValidationError
+import openai
+from openai.types.responses import ResponseCreatedEvent, ResponseTextDeltaEvent
+from agents import Agent, Runner, RunConfig, RunContextWrapper, trace, function_tool, WebSearchTool
+from agents.models.interface import Model, ModelProvider
+from agents.models.openai_provider import OpenAIProvider
+from sf_utils import QueryPrefetcher
+from sql_utils import explain_sql
+from chart_utils import chart_spec_errors
+from cache_utils import RESULT_CACHE_TTL, sql_cache_key
+from perf_utils import span
+from st_utils import partial_json_field
 
-from agents import Agent, Runner, trace, Tool, function_tool
+# --------------- MODEL CALLS --------------- #
 
-# --------------- SNOWFLAKE CONNECTION HELPERS --------------- #
+LLM_MAX_CONCURRENCY = 4     # model calls in flight per event loop
+LLM_MAX_RETRIES = 5         # retries of a rate-limited / failed model call
+LLM_BACKOFF_BASE = 1.0      # seconds, doubled on every retry (with full jitter)
+LLM_BACKOFF_MAX = 60.0
 
-# def init_snowflake_connection():
-#     return snowflake.connector.connect(
-#         user=st.secrets["SNOWFLAKE_USER"],
-#         password=st.secrets["SNOWFLAKE_PASSWORD"],
-#         account=st.secrets["SNOWFLAKE_ACCOUNT"],
-#         warehouse=st.secrets["SNOWFLAKE_WAREHOUSE"],
-#         database=st.secrets["SNOWFLAKE_DATABASE"],
-#         # schema=st.secrets["SNOWFLAKE_SCHEMA"],
-#     )
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
 
-# connection = init_snowflake_connection()
 
-@function_tool
-def query_snowflake(query: str) -> str:
-    cursor = connection.cursor()
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying: the server's Retry-After when given, else exponential backoff."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+    except ValueError:
+        pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
 
-    query = f"SELECT * FROM ({query.replace(';','')}) LIMIT 5"
 
-    try:
-        cursor.execute(query)
-        # print(query)
-    except Exception as e:
-        st.error(f"❌ Snowflake error:\n{e}")
-        print("❌ Snowflake error:", e)
-        print(query)
-        return []
-    df = cursor.fetch_pandas_all()
-    return df.to_json(orient="records")  # Return as JSON string (serializable)
+class BoundedModel(Model):
+    """Wraps a model: at most `max_concurrency` calls in flight and backoff on rate limits / transient errors.
 
-# --------------- AGENT OUTPUT MODELS --------------- #
+    The semaphores are per event loop (each asyncio.run of the app gets its own).
+    A stream is only retried when it failed before its first event.
+    """
+
+    def __init__(self, model, max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def get_response(self, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore():
+                try:
+                    return await self.model.get_response(*args, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = retry_delay(e, attempt)
+                    print(f"⏳ Model call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def stream_response(self, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            started = False
+            async with self._semaphore():
+                try:
+                    async for event in self.model.stream_response(*args, **kwargs):
+                        started = True
+                        yield event
+                    return
+                except RETRYABLE_ERRORS as e:
+                    if started or attempt == self.max_retries:
+                        raise
+                    delay = retry_delay(e, attempt)
+                    print(f"⏳ Model stream failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+class BoundedModelProvider(ModelProvider):
+    """OpenAI models wrapped in BoundedModel, one per model name."""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES, provider=None):
+        self.provider = provider or OpenAIProvider()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._models = {}
+
+    def get_model(self, model_name):
+        if model_name not in self._models:
+            self._models[model_name] = BoundedModel(self.provider.get_model(model_name), self.max_concurrency, self.max_retries)
+        return self._models[model_name]
+
+# --------------- MODEL ROUTING --------------- #
+
+DEFAULT_MODEL = "default"  # stands for the request's model (sidebar / service.model) in llm.routing
+
+
+class RoutedModel(Model):
+    """The model of one agent role, with a latency budget.
+
+    A call still unanswered after `timeout` seconds (a stream: not started yet) is abandoned
+    and made again on the `fallback` model. Every call is recorded in the request trace as
+    llm:<role>, with the model that answered it.
+    """
+
+    def __init__(self, role, name, model, timeout=None, fallback_name=None, fallback=None):
+        self.role = role
+        self.name = name
+        self.model = model
+        self.timeout = timeout
+        self.fallback_name = fallback_name
+        self.fallback = fallback
+
+    def _budgeted(self):
+        return self.fallback is not None and bool(self.timeout)
+
+    def _fall_back(self, attrs):
+        print(f"⏱️ {self.role} call on {self.name} took over {self.timeout:g}s, retrying on {self.fallback_name}")
+        attrs.update(model=self.fallback_name, fallback=True)
+
+    async def get_response(self, *args, **kwargs):
+        with span(f"llm:{self.role}", model=self.name) as attrs:
+            if not self._budgeted():
+                return await self.model.get_response(*args, **kwargs)
+            try:
+                return await asyncio.wait_for(self.model.get_response(*args, **kwargs), self.timeout)
+            except asyncio.TimeoutError:
+                self._fall_back(attrs)
+            return await self.fallback.get_response(*args, **kwargs)
+
+    async def stream_response(self, *args, **kwargs):
+        with span(f"llm:{self.role}", model=self.name) as attrs:
+            stream = self.model.stream_response(*args, **kwargs)
+            if self._budgeted():
+                try:
+                    first = await asyncio.wait_for(anext(stream), self.timeout)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    await stream.aclose()
+                    self._fall_back(attrs)
+                    stream = self.fallback.stream_response(*args, **kwargs)
+                else:
+                    yield first
+            async for event in stream:
+                yield event
+
+
+class ModelRouter:
+    """RoutedModel of each agent role, from the llm.routing section of config.yaml.
+
+    `routes` maps a role (manager, sql_generator, sql_review, chart, validator, followup) to
+    {"model", "timeout", "fallback"}; "default" and roles without a route use the request's
+    model. The models come from `provider`, so a BoundedModelProvider bounds them all.
+    """
+
+    def __init__(self, routes=None, provider=None):
+        self.routes = routes or {}
+        self.provider = provider or BoundedModelProvider()
+        self._models = {}  # (role, request model) -> RoutedModel
+
+    def model_name(self, role, default):
+        name = (self.routes.get(role) or {}).get("model")
+        return default if name in (None, DEFAULT_MODEL) else name
 
-class SQLOutput(BaseModel):
-    sql: str
+    def model(self, role, default):
+        key = (role, default)
+        if key not in self._models:
+            route = self.routes.get(role) or {}
+            name = self.model_name(role, default)
+            fallback = route.get("fallback")
+            fallback = default if fallback == DEFAULT_MODEL else fallback
+            if fallback == name:
+                fallback = None
+            self._models[key] = RoutedModel(role, name, self.provider.get_model(name), route.get("timeout"),
+                                            fallback, self.provider.get_model(fallback) if fallback else None)
+        return self._models[key]
 
-class DataOutput(BaseModel):
-    data: List[Dict]
+# --------------- REQUEST CONTEXT --------------- #
 
-class ChartOutput(BaseModel):
+class RequestContext:
+    """State of one question, passed to every tool as the agents SDK run context.
+
+    Holds the shared layers (connection pool, validator, result cache, model provider,
+    cost guard) and what the tools learn while answering: the probed result columns, the
+    local repairs, the cost checks and the full queries started in the background.
+    Full queries started for the question are registered in `tracker` so they can be cancelled.
+    With a `pushdown` (ChartPushdown), large row-level chart queries are grouped in Snowflake.
+    With a `router` (ModelRouter), each agent role runs on its own model.
+    """
+
+    def __init__(self, pool, validator, model, model_provider=None, result_cache=None, result_ttl=RESULT_CACHE_TTL,
+                 prefetch=True, explain=False, repair_stats=None, on_error=None, guard=None, tracker=None, pushdown=None,
+                 router=None):
+        self.pool = pool
+        self.validator = validator
+        self.model = model
+        self.model_provider = model_provider
+        self.result_cache = result_cache
+        self.result_ttl = result_ttl
+        self.prefetch = prefetch
+        self.explain = explain
+        self.repair_stats = repair_stats if repair_stats is not None else {"repaired": 0, "unrepaired": 0}
+        self.on_error = on_error or (lambda message: None)
+        self.guard = guard
+        self.tracker = tracker
+        self.pushdown = pushdown
+        self.router = router
+        self.prefetcher = QueryPrefetcher(pool, tracker)
+        self.probe_columns = {}  # sql_cache_key -> result columns of every probed query
+        self.repairs = []        # local repairs made while answering
+        self.guarded = {}        # sql_cache_key -> (query, error, note) of the cost guard
+
+    def run_config(self, role=None):
+        """RunConfig of an agent run: the role's routed model, or the request's model for every agent."""
+        if self.router is not None and role is not None:
+            return RunConfig(model=self.router.model(role, self.model))
+        if self.model_provider is None:
+            return RunConfig(model=self.model)
+        return RunConfig(model=self.model, model_provider=self.model_provider)
+
+    def repair_query(self, sql_query, errors):
+        """Local fix for a failing query (see SQLValidator.repair); returns the repaired SQL or None."""
+        repaired, fixes = self.validator.repair(sql_query, errors)
+        if repaired is None:
+            self.repair_stats["unrepaired"] += 1
+            return None
+        self.repair_stats["repaired"] += 1
+        self.repairs.extend(fixes)
+        print("🔧 Repaired query locally:", ", ".join(fixes))
+        return repaired
+
+    def execute_probe(self, full_query):
+        query = f"SELECT * FROM ({full_query}) LIMIT 5"
+
+        with self.pool.cursor() as cursor, span("snowflake_probe") as attrs:
+            try:
+                cursor.execute(query)
+                # print(query)
+            except Exception as e:
+                print("❌ Snowflake error:", e)
+                print(query)
+                attrs["error"] = str(e)
+                return None, str(e)
+            attrs["query_id"] = cursor.sfqid
+            return cursor.fetch_pandas_all(), None
+
+    def guard_query(self, query):
+        """(query, error, note) of the cost guard, checked once per distinct query.
+
+        Queries whose result is already cached are not checked: they won't reach the warehouse.
+        """
+        if self.guard is None:
+            return query, None, None
+        key = sql_cache_key(self.pool.database, query.strip().rstrip(';'))
+        if key not in self.guarded:
+            if self.result_cache is not None and self.result_cache.contains(self.pool.database, query, self.result_ttl):
+                return query, None, None
+            checked = self.guard.check(self.pool, query)
+            # A limited query is final: checking it again would only repeat the same EXPLAIN
+            self.guarded[key] = self.guarded[sql_cache_key(self.pool.database, checked[0])] = checked
+        return self.guarded[key]
+
+    def probe_query(self, query):
+        """Run the query wrapped in a LIMIT 5 and return (sample_df, error, sql).
+
+        The cost guard runs first and may add a LIMIT or reject the query. A query failing
+        on invalid identifiers / missing tables is repaired locally, guarded again and re-run
+        before giving up; `sql` is the query that actually ran. On failure `error` is a structured summary
+        (error + closest dictionary names) meant for the LLM retry.
+        """
+        full_query, error, _ = self.guard_query(query.replace(';',''))
+        if error:
+            return None, error, full_query
+        df, error = self.execute_probe(full_query)
+        if error:
+            repaired = self.repair_query(full_query, [error])
+            if repaired is not None:
+                # The query that failed may have passed the guard only because its EXPLAIN failed
+                repaired, guard_error, _ = self.guard_query(repaired)
+                if guard_error:
+                    return None, guard_error, repaired
+                repaired_df, repaired_error = self.execute_probe(repaired)
+                if repaired_error is None:
+                    full_query, df, error = repaired, repaired_df, None
+        if error:
+            return None, self.validator.error_summary(full_query, [error]), full_query
+        self.probe_columns[sql_cache_key(self.pool.database, full_query)] = list(df.columns)
+
+        # The agent usually settles on a query once it returns rows: start the full run now so it
+        # overlaps with the chart / validation agents instead of running again afterwards.
+        # Not for a query its chart will probably group in Snowflake instead (see pushdown_query).
+        cached = self.result_cache is not None and self.result_cache.contains(self.pool.database, full_query, self.result_ttl)
+        pushed_down = self.pushdown is not None and self.pushdown.candidate(full_query)
+        if self.prefetch and not df.empty and not cached and not pushed_down:
+            self.prefetcher.start(full_query)
+        return df, None, full_query
+
+    def pushdown_query(self, query, chart):
+        """(query, note): the query grouped in Snowflake for its chart (see ChartPushdown), or unchanged.
+
+        The grouped query goes through the cost guard; if the guard rejects it the row-level query is kept.
+        """
+        if self.pushdown is None:
+            return query, None
+        with span("chart_pushdown") as attrs:
+            grouped, note = self.pushdown.rewrite(self.validator, query, chart)
+            attrs["applied"] = grouped is not None
+        if grouped is None or self.guard_query(grouped)[1]:
+            return query, None
+        return grouped, note
+
+    def local_sql_errors(self, sql_query):
+        """Parse / resolve the SQL against the data dictionary, plus an optional EXPLAIN."""
+        errors = self.validator.errors(sql_query)
+        if not errors and self.explain:
+            error = explain_sql(self.pool, sql_query)
+            if error:
+                errors.append(error)
+        return errors
+
+# --------------- AGENT OUTPUT MODELS --------------- #
+
+class SQLValidationOutput(BaseModel):
+    comments: List[str]
+
+class ChartSpec(BaseModel):
     chart_type: str
-    chart_code: str
+    x: str
+    y: List[str]
+    series: str
+    aggregate: str
 
 class ValidationOutput(BaseModel):
     sql_valid: bool
     chart_valid: bool
     errors: List[str]
 
+class WebOutput(BaseModel):
+    web_summary: str
+
+class SQLGenerationOutput(BaseModel):
+    output_type: str
+    manager_msg: str
+    sql_query: str
+
 class FinalOutput(BaseModel):
-    query: str
-    chart_type: str
-    chart_code: str
+    output_type: str
+    manager_msg: str
+    sql_query: str
+    chart: ChartSpec
+
+class FollowUpOutput(BaseModel):
+    output_type: str
+    manager_msg: str
+    sql_query: str
+    chart: ChartSpec
+
+
+def message_output(text):
+    """FinalOutput of an answer that is only a message (no query, no chart)."""
+    return FinalOutput(output_type='msg', manager_msg=text, sql_query='', chart=ChartSpec(chart_type='', x='', y=[], series='', aggregate=''))
+
+
+def load_cached_output(cached):
+    """FinalOutput of an answer cache entry, or None when missing or written in an older answer format."""
+    try:
+        return FinalOutput(**cached) if cached else None
+    except ValidationError:
+        return None
 
 # --------------- AGENT DEFINITIONS --------------- #
 
-# 1. SQL Generation Agent
+# The model comes from the RunConfig of each run, so the agents are built once per process
+
+sql_generator_agent = Agent(
+    name="sql_generator_agent",
+    instructions=(
+        """You are specialized in Snowflake SQL. Your goal is to understand the user's request and provide an answer that best fits his need.
+        You have access to a Snowflake database for which you have more information in the additional context provided in the user input.
+
+        If the user's request is about the data you have access to, generate a parameterized Snowflake SQL query answering it and return:
+            output_type = 'sql'
+            manager_msg = <your comment>
+            sql_query   = <the query>
+        When using a table use the <schema_name>.<table_name> format. In your query the column names should always be uppercase.
+        Columns of the data dictionary may end with a profile in brackets (value range, values, null share): use it for filters,
+        date ranges and category spellings.
+        If a previous attempt failed, the errors are given at the end of the input: write a different query that fixes them.
+
+        If the user's request is not about the data or the data doesn't contain any relevant information then just answer the user with
+        output_type = 'msg', a 'manager_msg' and an empty sql_query.
+        """
+    ),
+    output_type=SQLGenerationOutput,
+)
+
 sql_agent = Agent(
     name="sql_agent",
     instructions=(
-        f"""Generate a parameterized Snowflake SQL query based on the user's request.
-        ### Additional context:
-        The following data dictionary is provided in CSV format to help you understand the schema:
-        """ #{data_dictionary}
+        """Validate that the Snowflake SQL query generated answers the user's request and that it respects the following:
+        - The tables are using the <schema_name>.<table_name> format.
+        - The column names are always uppercase.
+        - The query syntax is correct.
+        """
     ),
-    output_type=SQLOutput,
+    output_type=SQLValidationOutput,
 )
 
-# 2. Chart Selection Agent
 chart_agent = Agent(
     name="chart_agent",
     instructions=(
-        "Examine the JSON data and user's intent. Choose one of the following chart elements"
-        "st.line_chart, st.bar_chart, st.area_chart, or st.scatter_chart."
-        "Generate a minimal Streamlit code snippet to render it."
-        "Example: st.bar_chart(df, x='COUNTRY', y='TOTAL_SALES')"
+        """Examine the sample data and user's intent and choose how to chart the query result:
+            chart_type = line, bar, area or scatter
+            x          = the column on the x axis
+            y          = the numeric column(s) on the y axis
+            series     = a column whose values split a single y column into colored series, or ''
+            aggregate  = how y values combine when rows are grouped for the chart: sum (amounts, counts),
+                         avg (measurements such as prices, temperatures, rates), min, max or count
+        Example: {"chart_type": "bar", "x": "COUNTRY", "y": ["TOTAL_SALES"], "series": "", "aggregate": "sum"}
+        Note: Use the column names of the query result, always uppercase.
+        """
     ),
-    output_type=ChartOutput,
+    output_type=ChartSpec,
 )
 
-# 3. Validation Agent
 validator_agent = Agent(
     name="validator_agent",
     instructions=(
-        "Validate the SQL via EXPLAIN and check that the Streamlit code references valid columns."
+        "Validate the SQL query and check that the chart spec references valid columns."
+        # Validate the SQL via EXPLAIN
         # "Never validate the first time"
     ),
     output_type=ValidationOutput,
 )
 
-# 4. Manager Agent (Orchestrator)
+followup_agent = Agent(
+    name="followup_agent",
+    instructions=(
+        """You answer follow-up questions about the result of the previous answer. That result is loaded in a local DuckDB
+        table named previous_result; its columns, first rows and the query that produced it are given in the user input.
+
+        If the question can be answered from previous_result alone (filter, sort, top N, re-aggregate or compute from its columns), return:
+            output_type = 'local'
+            manager_msg = <your comment>
+            sql_query   = <one DuckDB SELECT reading only previous_result>
+            chart       = <chart_type (line, bar, area or scatter), x column, numeric y columns and series column or '' of the new result>
+        Keep the uppercase column names of previous_result for the output columns.
+
+        If it needs columns, rows or tables that are not in previous_result (for example rows filtered out before), return
+        output_type = 'warehouse' and empty other fields.
+        """
+    ),
+    output_type=FollowUpOutput,
+)
+
+web_agent = Agent(
+    name="validator_agent",
+    instructions=(
+        "You summarize a web research"
+    ),
+    tools=[WebSearchTool()],
+    output_type=WebOutput
+)
+
+# --------------- TOOLS --------------- #
+
+# Snowflake work runs in a thread so concurrent questions sharing the event loop are not blocked
+
+@function_tool
+async def query_snowflake(ctx: RunContextWrapper[RequestContext], query: str) -> str:
+    df, error, sql_query = await asyncio.to_thread(ctx.context.probe_query, query)
+    if error:
+        ctx.context.on_error(f"❌ Snowflake error:\n{error}")
+        return error
+    if sql_query != query.replace(';',''):
+        return f"The query was rewritten automatically, use this query from now on:\n{sql_query}\n\nSample rows:\n{df.to_csv()}"
+    return df.to_csv()
+
+# The validation tools check locally first and only ask their agent when something is wrong
+
+@function_tool
+async def validate_sql(ctx: RunContextWrapper[RequestContext], sql_query: str) -> str:
+    """Validate the Snowflake SQL generated"""
+    errors = await asyncio.to_thread(ctx.context.local_sql_errors, sql_query)
+    if not errors:
+        return "The SQL query is valid."
+    repaired = ctx.context.repair_query(sql_query, errors)
+    if repaired is not None and not await asyncio.to_thread(ctx.context.local_sql_errors, repaired):
+        return f"The SQL query had invalid identifiers that were fixed automatically, use this query from now on:\n{repaired}"
+    review = await Runner.run(sql_agent, ctx.context.validator.error_summary(sql_query, errors),
+                              context=ctx.context, run_config=ctx.context.run_config("sql_review"))
+    return SQLValidationOutput(comments=errors + review.final_output.comments).model_dump_json()
+
+@function_tool
+async def validate(ctx: RunContextWrapper[RequestContext], sql_query: str, chart: ChartSpec) -> str:
+    """Validate SQL and chart spec"""
+    errors = await asyncio.to_thread(ctx.context.local_sql_errors, sql_query)
+    columns = ctx.context.probe_columns.get(sql_cache_key(ctx.context.pool.database, sql_query.replace(';','')))
+    if columns is not None:
+        errors.extend(chart_spec_errors(chart.model_dump(), columns))
+    if not errors and columns is not None:
+        return ValidationOutput(sql_valid=True, chart_valid=True, errors=[]).model_dump_json()
+    review = await Runner.run(validator_agent,
+                              f"SQL query:\n{sql_query}\n\nChart spec:\n{chart.model_dump_json()}\n\nResult columns: {columns}\n\nProblems found:\n" + "\n".join(errors),
+                              context=ctx.context, run_config=ctx.context.run_config("validator"))
+    return review.final_output.model_dump_json()
+
+@function_tool(name_override="create_chart")
+async def create_chart(ctx: RunContextWrapper[RequestContext], input: str) -> str:
+    """Choose the chart (type, x, y, series) of the query result"""
+    # Same as chart_agent.as_tool, but run with the chart role's model and the request's provider
+    result = await Runner.run(chart_agent, input, context=ctx.context, run_config=ctx.context.run_config("chart"))
+    return result.final_output.model_dump_json()
+
 manager_agent = Agent(
     name="manager_agent",
     instructions=(
-        "You are the Manager Agent. Orchestrate the workflow by calling the tools in sequence:"
-        "1) generate_sql → 2) query_snowflake →  3) create_chart **(pass the JSON from step 2 as the first argument)** → 4) validate"
+        """You are the Manager Agent and are specialized in Snowflake SQL. Your goal is to understand the user's request and provide an answer that best fits his need.
+        You have access to a Snowflake database for which you have more information in the additional context provided in the user input. 
+        
+        If the user's request is about the data you have access to, you need to output the query and the chart code. 
+        To do so orchestrate the workflow by calling the tools in sequence:
+        1) Generate a parameterized Snowflake SQL query based on the user's request. When using a table use the <schema_name>.<table_name> format. In your query the column names should always be uppercase.
+           Columns of the data dictionary may end with a profile in brackets (value range, values, null share): use it for filters, date ranges and category spellings.
+        2) validate_sql
+        3) query_snowflake -> If it doesn't return anything go back to step one and try a different query (only try 3 times maximum)
+        4) create_chart **(pass the JSON from step 2 as the first argument)**
+        5) validate (provide bothe the sql_query and the chart for validation) **(only output the final result if the validation passes)**
+    
+        After you have called 'generate_sql', 'query_snowflake', 'create_chart',
+        and 'validate', return the result with:
+            output_type = 'sql'
+            manager_msg = <your comment>
+            sql_query   = <the query from the sql_agent>
+            chart       = <the chart from create_chart>
+        
+        If the user's request is not about the data or the data doesn't contain any relevant information then just answer the user by only outputting a 'mananager_msg'
+        If you just return a message then the output_type = 'msg'.
+        """
         # "If validation passes, return the full Streamlit snippet. Otherwise, return an error report."
     ),
     tools=[
-        sql_agent.as_tool(tool_name="generate_sql", tool_description="Generate Snowflake SQL"),
+        validate_sql,
         query_snowflake,
-        chart_agent.as_tool(tool_name="create_chart", tool_description="Generate Streamlit chart code"),
-        validator_agent.as_tool(tool_name="validate", tool_description="Validate SQL and chart code"),
+        create_chart,
+        validate,
     ],
     output_type=FinalOutput
 )
 
-async def run_query(manager_agent, request: str):
+async def run_query(manager_agent, request: str, context: RequestContext, view=None):
     """Single coroutine that calls the Agent stack and returns the result."""
     with trace("Snowflake-Streamlit Orchestration"):
-        return await Runner.run(manager_agent, request)
-
-# ── UI / orchestration ─────────────────────────────────────────────────────────
-# st.title("Snowflake-Streamlit LLM assistant")
-
-# user_request = st.text_input("Describe your data request:")
-# run_clicked  = st.button("Ask")
-
-# # Allocate a place in the sidebar for progress / results
-# placeholder = st.empty()
-
-# # 1️⃣  Launch the coroutine exactly once
-# if run_clicked and user_request:
-#     with st.spinner("Running Snowflake query…"):
-#         result = asyncio.run(run_query(manager_agent, user_request))
-#     st.subheader("Final output")
-#     st.write(result.final_output)
-
-# # 2️⃣  Check task state on every rerun
-# task = st.session_state.get("query_task")
-# if task:
-#     if task.done():
-#         result = task.result()
-#         placeholder.subheader("Final output")
-#         placeholder.write(result.final_output)
-#         del st.session_state["query_task"]    # cleanup
-#     else:
-#         placeholder.info("⏳ Working on it...")
\ No newline at end of file
+        if view is not None:
+            return await run_streamed(manager_agent, request, context, view, "manager")
+        return await Runner.run(manager_agent, request, context=context, run_config=context.run_config("manager"))
+
+# --------------- STREAMING --------------- #
+
+async def run_streamed(agent, request, context, view, role=None):
+    """Runner.run_streamed, forwarding tool calls and the partial manager_msg / sql_query to the view.
+
+    `view` is anything with stage(label), message(text) and sql(query) methods.
+    """
+    result = Runner.run_streamed(agent, request, context=context, run_config=context.run_config(role))
+    text = ""
+    async for event in result.stream_events():
+        if event.type == "raw_response_event":
+            if isinstance(event.data, ResponseCreatedEvent):
+                text = ""
+            elif isinstance(event.data, ResponseTextDeltaEvent):
+                text += event.data.delta
+                view.message(partial_json_field(text, "manager_msg"))
+                view.sql(partial_json_field(text, "sql_query"))
+        elif event.type == "run_item_stream_event" and event.name == "tool_called":
+            view.stage(f"Running {getattr(event.item.raw_item, 'name', 'tool')}…")
+            try:
+                arguments = json.loads(getattr(event.item.raw_item, "arguments", "") or "{}")
+            except ValueError:
+                arguments = {}
+            view.sql(arguments.get("query") or arguments.get("sql_query"))
+    return result
+
+# --------------- PARALLEL PIPELINE --------------- #
+
+PIPELINE_MAX_ATTEMPTS = 3
+
+async def timed(timings, stage, awaitable):
+    """Await and add the elapsed seconds to timings[stage]."""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+async def run_pipeline(request: str, prompt: str, context: RequestContext, view=None):
+    """Code-orchestrated alternative to the manager agent.
+
+    Generates the SQL once and validates it locally (parse, column resolution, optional
+    EXPLAIN), then runs the sample probe and the chart generation concurrently. The
+    validator agent is only called when a local check, the probe or the chart check fails,
+    and its findings are fed back into a new generation (3 attempts max).
+    With a StreamView the generated answer and SQL are streamed and each stage is reported.
+    Returns (FinalOutput, {stage: seconds}).
+    """
+    timings = {}
+    feedback = ""
+    stage = view.stage if view is not None else (lambda label: None)
+    with trace("Snowflake-Streamlit Pipeline"):
+        for attempt in range(PIPELINE_MAX_ATTEMPTS):
+            stage("Generating the SQL query…")
+            if view is not None:
+                generated = await timed(timings, "generate_sql", run_streamed(sql_generator_agent, request + feedback, context, view, "sql_generator"))
+            else:
+                generated = await timed(timings, "generate_sql", Runner.run(sql_generator_agent, request + feedback, context=context,
+                                                                            run_config=context.run_config("sql_generator")))
+            generated = generated.final_output
+            if generated.output_type != 'sql':
+                return message_output(generated.manager_msg), timings
+
+            # Exact checks run locally in milliseconds; only a failure costs a validator round trip
+            sql_query = generated.sql_query
+            stage("Checking the query against the data dictionary…")
+            errors = await timed(timings, "validate_sql", asyncio.to_thread(context.local_sql_errors, sql_query))
+            if errors:
+                repaired = context.repair_query(sql_query, errors)
+                if repaired is not None and not await asyncio.to_thread(context.local_sql_errors, repaired):
+                    sql_query, errors = repaired, []
+            sample, error, chart = None, None, None
+            if not errors:
+                stage("Running a sample and drafting the chart…")
+                start = time.perf_counter()
+                (sample, error, sql_query), chart = await asyncio.gather(
+                    timed(timings, "query_snowflake", asyncio.to_thread(context.probe_query, sql_query)),
+                    timed(timings, "create_chart", Runner.run(chart_agent, f"User request: {prompt}\n\nSQL query (the chart data is its result):\n{sql_query}", context=context, run_config=context.run_config("chart"))),
+                )
+                timings["parallel_stage"] = timings.get("parallel_stage", 0) + time.perf_counter() - start
+                chart = chart.final_output
+
+                if error:
+                    errors.append(error)
+                elif sample.empty:
+                    errors.append("The query returned no rows.")
+                else:
+                    errors.extend(chart_spec_errors(chart.model_dump(), sample.columns))
+
+            if not errors:
+                return FinalOutput(output_type='sql', manager_msg=generated.manager_msg, sql_query=sql_query, chart=chart), timings
+
+            sample_csv = sample.to_csv() if sample is not None else ""
+            chart_json = chart.model_dump_json() if chart is not None else ""
+            stage("Something failed, asking the validator…")
+            validation = await timed(timings, "validate", Runner.run(
+                validator_agent,
+                f"User request: {prompt}\n\nSQL query:\n{sql_query}\n\nChart spec:\n{chart_json}\n\n"
+                f"Sample result:\n{sample_csv}\n\nDetected problems:\n" + "\n".join(errors),
+                context=context, run_config=context.run_config("validator")))
+            validation = validation.final_output
+
+            # The query itself works, only the chart is off: redo the chart with the sample at hand
+            if sample is not None and not error and not sample.empty and validation.sql_valid:
+                chart = await timed(timings, "create_chart", Runner.run(
+                    chart_agent, f"User request: {prompt}\n\nSample data:\n{sample_csv}\n\nAvoid these problems:\n" + "\n".join(errors + validation.errors),
+                    context=context, run_config=context.run_config("chart")))
+                return FinalOutput(output_type='sql', manager_msg=generated.manager_msg, sql_query=sql_query,
+                                   chart=chart.final_output), timings
+
+            feedback = (f"\n\n### Attempt {attempt + 1} failed\nQuery:\n{sql_query}\nErrors:\n"
+                        + "\n".join(f"- {e}" for e in errors + validation.errors))
+
+    return message_output(f"I couldn't write a working query for this request.{feedback}"), timings
+
+async def answer_question(request: str, prompt: str, context: RequestContext, pipeline=False, view=None):
+    """(FinalOutput, {stage: seconds}) from the parallel pipeline or the manager agent."""
+    if pipeline:
+        return await run_pipeline(request, prompt, context, view)
+    start = time.perf_counter()
+    result = await run_query(manager_agent, request, context, view)
+    return result.final_output, {"manager_agent": time.perf_counter() - start}
+
+# --------------- FOLLOW-UPS --------------- #
+
+async def answer_followup(prompt: str, character: str, workspace, context: RequestContext):
+    """Answer a refinement of the previous result locally (see ResultWorkspace).
+
+    Returns (FinalOutput, DataFrame, {stage: seconds}); the output and the DataFrame are None when
+    the question needs the warehouse or the local SQL fails, and the regular pipeline answers it.
+    """
+    timings = {}
+    request = f"""{prompt}
+
+        ### Previous result:
+        {workspace.describe()}
+
+        ### Your personality (only use it for the manager_msg):
+        {character}
+        """
+    with trace("Snowflake-Streamlit Follow-up"):
+        result = await timed(timings, "followup", Runner.run(followup_agent, request, context=context, run_config=context.run_config("followup")))
+    output = result.final_output
+    if output.output_type != 'local' or not output.sql_query:
+        return None, None, timings
+    with span("followup_query") as attrs:
+        df, error = await timed(timings, "local_query", asyncio.to_thread(workspace.run, output.sql_query))
+        if error:
+            attrs["error"] = error
+    if error:
+        print("❌ Follow-up query error:", error)
+        print(output.sql_query)
+        return None, None, timings
+
+    # A chart on columns the local result doesn't have falls back to the previous chart, if that one still fits
+    chart = output.chart
+    if chart_spec_errors(chart.model_dump(), df.columns) and not chart_spec_errors(workspace.chart, df.columns):
+        chart = ChartSpec(**workspace.chart)
+    return FinalOutput(output_type='sql', manager_msg=output.manager_msg, sql_query=output.sql_query, chart=chart), df, timings
+
+
+def build_request(prompt, description, context_dictionary, character):
+    """The question with the dataset description, the (pruned) data dictionary and the persona."""
+    return f"""{prompt}
+
+        ### Additional context:
+        Dataset description: {description}
+        The following data dictionary is provided to help you understand the schema:\n{context_dictionary}
+
+        ### Your personality (only use it for the final manager_msg):
+        {character}
+        """
@@ -0,0 +1,806 @@
+"""End-to-end benchmark of the app without OpenAI or Snowflake access.
+
+Runs sql_agent_app.py headless (streamlit.testing AppTest) with two stand-ins:
+- a local DuckDB warehouse loaded with generated TPC-H-like data, mirroring the
+  SNOWFLAKE_SAMPLE_DATA.TPCH_SF10 schema of config.yaml, served through a
+  connector-compatible connection (Snowflake SQL is transpiled with sqlglot)
+- a scripted model provider that answers every agent with a replayed answer for
+  the sidebar `prompts` of config.yaml, with a configurable latency per call
+
+Each worker is one chat session replaying the prompts, in its own process (AppTest
+drives Streamlit's process-wide runtime and secrets, so sessions cannot share one);
+workers start together and run concurrently. The report gives end-to-end latency
+percentiles, throughput and, per stage of the request traces (perf_utils), p50/p95
+latency and the peak RSS of a session process seen while the stage ran. The app
+runs in a scratch directory, so its caches, traces and data dictionary never mix
+with the real ones.
+
+    python bench_pipeline.py --concurrency 4 --rounds 2
+    python bench_pipeline.py --save baseline.json
+    python bench_pipeline.py --compare baseline.json    # exit code 1 on a p50/p95 regression
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import duckdb
+import sqlglot
+import yaml
+import snowflake.connector
+from streamlit.testing.v1 import AppTest
+from openai.types.responses import (Response, ResponseCompletedEvent, ResponseCreatedEvent, ResponseFunctionToolCall,
+                                    ResponseOutputMessage, ResponseOutputText, ResponseTextDeltaEvent, ResponseUsage)
+from agents.items import ModelResponse
+from agents.usage import Usage
+from agents.models.interface import Model
+from agents.models.openai_provider import OpenAIProvider
+from agents.tracing import response_span, set_trace_processors
+from perf_utils import read_traces, stage_percentiles, flush_traces
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql_agent_app.py")
+DATASET = "TPC_H_BUSINESS_SAMPLE"
+PASSWORD = "bench"
+SECRETS = {"APP_PW": PASSWORD, "OPENAI_API_KEY": "sk-bench", "SNOWFLAKE_USER": "bench",
+           "SNOWFLAKE_PASSWORD": "bench", "SNOWFLAKE_ACCOUNT": "bench", "SNOWFLAKE_WAREHOUSE": "bench"}
+
+# --------------- LOCAL TPC-H WAREHOUSE --------------- #
+
+REGIONS = ["AFRICA", "AMERICA", "ASIA", "EUROPE", "MIDDLE EAST"]
+NATIONS = [
+    ("ALGERIA", 0), ("ARGENTINA", 1), ("BRAZIL", 1), ("CANADA", 1), ("EGYPT", 4), ("ETHIOPIA", 0),
+    ("FRANCE", 3), ("GERMANY", 3), ("INDIA", 2), ("INDONESIA", 2), ("IRAN", 4), ("IRAQ", 4),
+    ("JAPAN", 2), ("JORDAN", 4), ("KENYA", 0), ("MOROCCO", 0), ("MOZAMBIQUE", 0), ("PERU", 1),
+    ("CHINA", 2), ("ROMANIA", 3), ("SAUDI ARABIA", 4), ("VIETNAM", 2), ("RUSSIA", 3),
+    ("UNITED KINGDOM", 3), ("UNITED STATES", 1),
+]
+SEGMENTS = ["AUTOMOBILE", "BUILDING", "FURNITURE", "HOUSEHOLD", "MACHINERY"]
+PRIORITIES = ["1-URGENT", "2-HIGH", "3-MEDIUM", "4-NOT SPECIFIED", "5-LOW"]
+SHIP_MODES = ["AIR", "FOB", "MAIL", "RAIL", "REG AIR", "SHIP", "TRUCK"]
+SHIP_INSTRUCTIONS = ["COLLECT COD", "DELIVER IN PERSON", "NONE", "TAKE BACK RETURN"]
+CONTAINERS = ["SM CASE", "SM BOX", "MED BAG", "MED PKG", "LG CASE", "LG BOX", "JUMBO PACK", "WRAP JAR"]
+TYPES = ["STANDARD", "SMALL", "MEDIUM", "LARGE", "ECONOMY", "PROMO"]
+FINISHES = ["ANODIZED", "BURNISHED", "PLATED", "POLISHED", "BRUSHED"]
+MATERIALS = ["TIN", "NICKEL", "BRASS", "STEEL", "COPPER"]
+COLORS = ["almond", "antique", "aquamarine", "azure", "beige", "blush", "chartreuse", "coral", "cream",
+          "forest", "goldenrod", "ivory", "lavender", "linen", "maroon", "navy", "olive", "orchid", "peru", "salmon"]
+COMMENTS = ["carefully final deposits", "quickly regular packages", "furiously express accounts",
+            "blithely ironic requests", "slyly pending theodolites", "even foxes haggle"]
+CURRENT_DATE = np.datetime64("1995-06-17")
+
+
+def generate_tpch(scale=0.01, seed=42):
+    """TPC-H-like tables (column names, types and key relationships of the spec) as DataFrames.
+
+    `scale` follows the TPC-H scale factor: 1.0 is 150k customers and ~6M line items.
+    """
+    rng = np.random.default_rng(seed)
+    n_customers, n_suppliers, n_parts = max(int(150_000 * scale), 100), max(int(10_000 * scale), 20), max(int(200_000 * scale), 100)
+    n_orders = n_customers * 10
+
+    def pick(values, n):
+        return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+    def money(low, high, n):
+        return np.round(rng.uniform(low, high, n), 2)
+
+    def phones(nation_keys):
+        return [f"{10 + k}-{a}-{b}-{c}" for k, a, b, c in zip(nation_keys, rng.integers(100, 999, len(nation_keys)),
+                                                               rng.integers(100, 999, len(nation_keys)), rng.integers(1000, 9999, len(nation_keys)))]
+
+    region = pd.DataFrame({"R_REGIONKEY": np.arange(5), "R_NAME": REGIONS, "R_COMMENT": pick(COMMENTS, 5)})
+    nation = pd.DataFrame({"N_NATIONKEY": np.arange(len(NATIONS)), "N_NAME": [n for n, _ in NATIONS],
+                           "N_REGIONKEY": [r for _, r in NATIONS], "N_COMMENT": pick(COMMENTS, len(NATIONS))})
+
+    keys = np.arange(1, n_customers + 1)
+    nation_keys = rng.integers(0, len(NATIONS), n_customers)
+    customer = pd.DataFrame({
+        "C_CUSTKEY": keys, "C_NAME": [f"Customer#{k:09d}" for k in keys], "C_ADDRESS": pick(COMMENTS, n_customers),
+        "C_NATIONKEY": nation_keys, "C_PHONE": phones(nation_keys), "C_ACCTBAL": money(-999.99, 9999.99, n_customers),
+        "C_MKTSEGMENT": pick(SEGMENTS, n_customers), "C_COMMENT": pick(COMMENTS, n_customers),
+    })
+
+    keys = np.arange(1, n_suppliers + 1)
+    nation_keys = rng.integers(0, len(NATIONS), n_suppliers)
+    supplier = pd.DataFrame({
+        "S_SUPPKEY": keys, "S_NAME": [f"Supplier#{k:09d}" for k in keys], "S_ADDRESS": pick(COMMENTS, n_suppliers),
+        "S_NATIONKEY": nation_keys, "S_PHONE": phones(nation_keys), "S_ACCTBAL": money(-999.99, 9999.99, n_suppliers),
+        "S_COMMENT": pick(COMMENTS, n_suppliers),
+    })
+
+    keys = np.arange(1, n_parts + 1)
+    brands = rng.integers(1, 6, n_parts)
+    part = pd.DataFrame({
+        "P_PARTKEY": keys,
+        "P_NAME": [" ".join(c) for c in zip(*(pick(COLORS, n_parts) for _ in range(5)))],
+        "P_MFGR": [f"Manufacturer#{b}" for b in brands],
+        "P_BRAND": [f"Brand#{b}{m}" for b, m in zip(brands, rng.integers(1, 6, n_parts))],
+        "P_TYPE": [" ".join(t) for t in zip(pick(TYPES, n_parts), pick(FINISHES, n_parts), pick(MATERIALS, n_parts))],
+        "P_SIZE": rng.integers(1, 51, n_parts), "P_CONTAINER": pick(CONTAINERS, n_parts),
+        "P_RETAILPRICE": np.round((90000 + ((keys // 10) % 20001) + 100 * (keys % 1000)) / 100, 2),
+        "P_COMMENT": pick(COMMENTS, n_parts),
+    })
+
+    ps_parts = np.repeat(keys, 4)
+    ps_offsets = np.tile(np.arange(4), n_parts)
+    partsupp = pd.DataFrame({
+        "PS_PARTKEY": ps_parts,
+        "PS_SUPPKEY": (ps_parts + ps_offsets * (n_suppliers // 4 + (ps_parts - 1) // n_suppliers)) % n_suppliers + 1,
+        "PS_AVAILQTY": rng.integers(1, 10000, len(ps_parts)), "PS_SUPPLYCOST": money(1.0, 1000.0, len(ps_parts)),
+        "PS_COMMENT": pick(COMMENTS, len(ps_parts)),
+    })
+
+    order_keys = np.arange(1, n_orders + 1)
+    order_dates = np.datetime64("1992-01-01") + rng.integers(0, 2405, n_orders).astype("timedelta64[D]")
+    lines_per_order = rng.integers(1, 8, n_orders)
+    l_orders = np.repeat(order_keys, lines_per_order)
+    l_dates = np.repeat(order_dates, lines_per_order)
+    n_lines = len(l_orders)
+    l_parts = rng.integers(1, n_parts + 1, n_lines)
+    quantity = rng.integers(1, 51, n_lines)
+    extended = np.round(quantity * part["P_RETAILPRICE"].to_numpy()[l_parts - 1], 2)
+    discount = np.round(rng.integers(0, 11, n_lines) / 100, 2)
+    tax = np.round(rng.integers(0, 9, n_lines) / 100, 2)
+    ship = l_dates + rng.integers(1, 122, n_lines).astype("timedelta64[D]")
+    receipt = ship + rng.integers(1, 31, n_lines).astype("timedelta64[D]")
+    lineitem = pd.DataFrame({
+        "L_ORDERKEY": l_orders, "L_PARTKEY": l_parts,
+        "L_SUPPKEY": (l_parts + rng.integers(0, 4, n_lines) * (n_suppliers // 4)) % n_suppliers + 1,
+        "L_LINENUMBER": np.arange(n_lines) - np.repeat(np.cumsum(lines_per_order) - lines_per_order, lines_per_order) + 1,
+        "L_QUANTITY": quantity, "L_EXTENDEDPRICE": extended, "L_DISCOUNT": discount, "L_TAX": tax,
+        "L_RETURNFLAG": np.where(receipt <= CURRENT_DATE, np.where(rng.random(n_lines) < 0.5, "R", "A"), "N"),
+        "L_LINESTATUS": np.where(ship <= CURRENT_DATE, "F", "O"),
+        "L_SHIPDATE": ship, "L_COMMITDATE": l_dates + rng.integers(30, 91, n_lines).astype("timedelta64[D]"),
+        "L_RECEIPTDATE": receipt, "L_SHIPINSTRUCT": pick(SHIP_INSTRUCTIONS, n_lines),
+        "L_SHIPMODE": pick(SHIP_MODES, n_lines), "L_COMMENT": pick(COMMENTS, n_lines),
+    })
+
+    # like TPC-H, a third of the customers never order
+    ordering_customers = customer["C_CUSTKEY"].to_numpy()[customer["C_CUSTKEY"].to_numpy() % 3 != 0]
+    totals = (lineitem["L_EXTENDEDPRICE"] * (1 + lineitem["L_TAX"]) * (1 - lineitem["L_DISCOUNT"])).groupby(lineitem["L_ORDERKEY"]).sum()
+    orders = pd.DataFrame({
+        "O_ORDERKEY": order_keys,
+        "O_CUSTKEY": rng.choice(ordering_customers, n_orders),
+        "O_ORDERSTATUS": pick(["F", "O", "P"], n_orders), "O_TOTALPRICE": np.round(totals.to_numpy(), 2),
+        "O_ORDERDATE": order_dates, "O_ORDERPRIORITY": pick(PRIORITIES, n_orders),
+        "O_CLERK": [f"Clerk#{c:09d}" for c in rng.integers(1, max(int(1000 * scale), 10) + 1, n_orders)],
+        "O_SHIPPRIORITY": np.zeros(n_orders, dtype=int), "O_COMMENT": pick(COMMENTS, n_orders),
+    })
+    return {"REGION": region, "NATION": nation, "CUSTOMER": customer, "SUPPLIER": supplier, "PART": part,
+            "PARTSUPP": partsupp, "ORDERS": orders, "LINEITEM": lineitem}
+
+
+def dictionary_type(dtype):
+    """Snowflake INFORMATION_SCHEMA type of a generated column: (DATA_TYPE, precision, scale)."""
+    if pd.api.types.is_integer_dtype(dtype):
+        return "NUMBER", 38, 0
+    if pd.api.types.is_float_dtype(dtype):
+        return "NUMBER", 12, 2
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "DATE", None, None
+    return "TEXT", None, None
+
+
+# Warehouse errors in the wording of Snowflake, which the app's local repair parses
+DUCKDB_ERRORS = [
+    (re.compile(r'Referenced column "?(\w+)"? not found', re.I), "SQL compilation error: invalid identifier '{0}'"),
+    (re.compile(r'Table with name "?([\w.]+)"? does not exist', re.I), "SQL compilation error: Object '{0}' does not exist or not authorized."),
+]
+
+
+class LocalWarehouse:
+    """In-process DuckDB standing in for one Snowflake database.
+
+    Queries are transpiled from the Snowflake dialect; INFORMATION_SCHEMA lookups of
+    the data dictionary and QUERY_HISTORY are answered from the generated schema.
+    `latency` seconds are added to every statement to model the warehouse round trip.
+    The last `RESULTS_KEPT` results can be read back with RESULT_SCAN.
+    """
+
+    RESULTS_KEPT = 64
+
+    def __init__(self, database, schema, tables, latency=0.0):
+        self.database = database
+        self.schema = schema
+        self.latency = latency
+        self.con = duckdb.connect()
+        self.con.execute(f"ATTACH ':memory:' AS {database}")
+        self.con.execute(f"USE {database}")
+        self.con.execute(f"CREATE SCHEMA {schema}")
+        records = []
+        self.table_bytes = {}  # table -> in-memory size, standing in for the compressed size of EXPLAIN
+        for name, df in tables.items():
+            self.table_bytes[name] = int(df.memory_usage(deep=True).sum())
+            dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+            replace = f" REPLACE ({', '.join(f'CAST({c} AS DATE) AS {c}' for c in dates)})" if dates else ""
+            self.con.register("generated", df)
+            self.con.execute(f"CREATE TABLE {schema}.{name} AS SELECT *{replace} FROM generated")
+            self.con.unregister("generated")
+            for position, column in enumerate(df.columns, 1):
+                data_type, precision, scale = dictionary_type(df[column].dtype)
+                records.append({
+                    "TABLE_SCHEMA": schema, "TABLE_NAME": name, "COLUMN_NAME": column, "ORDINAL_POSITION": position,
+                    "COLUMN_DEFAULT": None, "IS_NULLABLE": "NO", "DATA_TYPE": data_type,
+                    "CHARACTER_MAXIMUM_LENGTH": 16777216 if data_type == "TEXT" else None,
+                    "CHARACTER_OCTET_LENGTH": 16777216 if data_type == "TEXT" else None,
+                    "NUMERIC_PRECISION": precision, "NUMERIC_PRECISION_RADIX": 10 if precision else None,
+                    "NUMERIC_SCALE": scale, "DATETIME_PRECISION": None, "IS_IDENTITY": "NO", "COMMENT": None,
+                })
+        self.dictionary = pd.DataFrame(records).sort_values(["TABLE_NAME", "ORDINAL_POSITION"], ignore_index=True)
+        self._async = {}  # query id -> Future of the Arrow result
+        self._results = {}  # query id -> Arrow result, for RESULT_SCAN
+        self._lock = threading.Lock()
+
+    def connect(self, **kwargs):
+        """Drop-in for snowflake.connector.connect."""
+        return LocalConnection(self)
+
+    def run(self, sql):
+        time.sleep(self.latency)
+        scan = re.fullmatch(r"SELECT \* FROM TABLE\(RESULT_SCAN\('(\w+)'\)\)", sql.strip())
+        if scan:
+            with self._lock:
+                if scan.group(1) not in self._results:
+                    raise RuntimeError(f"Statement {scan.group(1)} not found")
+                return self._results[scan.group(1)]
+        if 'INFORMATION_SCHEMA."COLUMNS"' in sql:
+            return pa_table(self.dictionary)
+        if 'INFORMATION_SCHEMA."TABLES"' in sql and "TABLE_TYPE" in sql:
+            # Table list of the profiles (profile_utils); other databases have no tables to profile
+            tables = list(self.table_bytes) if self.database in sql else []
+            return pa_table(pd.DataFrame({"TABLE_NAME": tables, "TABLE_TYPE": ["BASE TABLE"] * len(tables),
+                                          "LAST_ALTERED": ["2025-01-01 00:00:00.000"] * len(tables)}, dtype=object))
+        if 'INFORMATION_SCHEMA."TABLES"' in sql:
+            return pa_table(pd.DataFrame({"LAST_ALTERED": ["2025-01-01 00:00:00.000"]}))
+        if "QUERY_HISTORY" in sql:
+            return pa_table(pd.DataFrame({"QUERY_ID": [], "BYTES_SCANNED": [], "ROWS_PRODUCED": []}))
+        if "SYSTEM$CANCEL_QUERY" in sql:
+            return pa_table(pd.DataFrame({"STATUS": ["query cancelled"]}))
+        explain = re.match(r"\s*EXPLAIN USING (TEXT|JSON)", sql, re.I)
+        if explain:
+            sql = sql[explain.end():]
+        try:
+            query = sqlglot.transpile(sql, read="snowflake", write="duckdb")[0]
+            cursor = self.con.cursor()
+            try:
+                cursor.execute(f"USE {self.database}")
+                result = cursor.execute(("EXPLAIN " if explain else "") + query).arrow()
+                result = result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+            finally:
+                cursor.close()
+            if explain and explain.group(1).upper() == "JSON":
+                return pa_table(pd.DataFrame({"content": [self.explain_json(sql, result)]}))
+            return result
+        except Exception as e:
+            for pattern, message in DUCKDB_ERRORS:
+                match = pattern.search(str(e))
+                if match:
+                    raise RuntimeError(message.format(match.group(1).upper())) from e
+            raise RuntimeError(f"SQL compilation error: {e}") from e
+
+    def explain_json(self, sql, plan):
+        """Snowflake-shaped EXPLAIN USING JSON: every referenced table is scanned in full (no pruning)."""
+        tables = {t.name.upper() for t in sqlglot.parse_one(sql, read="snowflake").find_all(sqlglot.exp.Table)}
+        scanned = sum(size for name, size in self.table_bytes.items() if name in tables)
+        partitions = -(-scanned // (16 * 1024 ** 2))
+        cartesian = "CROSS_PRODUCT" in " ".join(str(v) for v in plan.to_pydict().get("explain_value", []))
+        operations = [[{"operation": "CartesianJoin"}]] if cartesian else [[{"operation": "TableScan"}]]
+        return json.dumps({"GlobalStats": {"partitionsTotal": partitions, "partitionsAssigned": partitions,
+                                           "bytesAssigned": scanned}, "Operations": operations})
+
+    def status(self, query_id):
+        """Connector-style query status; raises the error of a failed query."""
+        with self._lock:
+            future = self._async[query_id]
+        if not future.done():
+            return "RUNNING"
+        future.result()
+        return "SUCCESS"
+
+    def submit(self, sql):
+        query_id = uuid.uuid4().hex
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self.run(sql))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        with self._lock:
+            self._async[query_id] = future
+        return query_id
+
+    def result(self, query_id):
+        with self._lock:
+            future = self._async.pop(query_id)
+        return future.result()
+
+    def keep(self, query_id, table):
+        with self._lock:
+            self._results[query_id] = table
+            while len(self._results) > self.RESULTS_KEPT:
+                del self._results[next(iter(self._results))]
+
+
+def pa_table(df):
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class ResultMetadata:
+    def __init__(self, name):
+        self.name = name
+        self.type_code = None  # results come out of Arrow already typed, nothing to normalize
+        self.precision = None
+        self.scale = None
+
+
+class LocalCursor:
+    """The subset of SnowflakeCursor the app uses, backed by a LocalWarehouse."""
+
+    BATCH_ROWS = 10_000
+
+    def __init__(self, warehouse, connection=None):
+        self.warehouse = warehouse
+        self.connection = connection
+        self.sfqid = None
+        self.description = None
+        self.rowcount = None
+        self._table = None
+
+    def _set(self, table):
+        self._table = table
+        self.description = [ResultMetadata(name) for name in table.column_names]
+        self.rowcount = table.num_rows
+
+    def execute(self, sql):
+        self.sfqid = uuid.uuid4().hex
+        self._set(self.warehouse.run(sql))
+        self.warehouse.keep(self.sfqid, self._table)
+        return self
+
+    def execute_async(self, sql):
+        self.sfqid = self.warehouse.submit(sql)
+        return self
+
+    def get_results_from_sfqid(self, query_id):
+        self.sfqid = query_id
+        self._set(self.warehouse.result(query_id))
+        self.warehouse.keep(query_id, self._table)
+
+    def fetch_pandas_batches(self):
+        for batch in self._table.combine_chunks().to_batches(max_chunksize=self.BATCH_ROWS):
+            yield batch.to_pandas()
+
+    def fetch_arrow_batches(self):
+        yield from (pa.Table.from_batches([batch]) for batch in self._table.to_batches(max_chunksize=self.BATCH_ROWS))
+
+    def fetch_pandas_all(self):
+        return self._table.to_pandas()
+
+    def fetchall(self):
+        return list(zip(*(column.to_pylist() for column in self._table.columns)))
+
+    def fetchone(self):
+        rows = self.fetchall()
+        return rows[0] if rows else None
+
+    def close(self):
+        self._table = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalConnection:
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self._closed = False
+
+    def cursor(self):
+        return LocalCursor(self.warehouse, self)
+
+    def get_query_status_throw_if_error(self, query_id):
+        return self.warehouse.status(query_id)
+
+    @staticmethod
+    def is_still_running(status):
+        return status == "RUNNING"
+
+    def is_closed(self):
+        return self._closed
+
+    def close(self):
+        self._closed = True
+
+# --------------- SCRIPTED MODEL --------------- #
+
+# Replayed answer (SQL + chart) for each sample prompt of config.yaml, written against TPCH_SF10.
+# Prompts without an entry are answered with a plain message.
+SCRIPT = {
+    "Who is my best customer?": (
+        "SELECT C.C_NAME, SUM(O.O_TOTALPRICE) AS TOTAL_SPENT FROM TPCH_SF10.CUSTOMER C JOIN TPCH_SF10.ORDERS O ON C.C_CUSTKEY = O.O_CUSTKEY GROUP BY C.C_NAME ORDER BY TOTAL_SPENT DESC LIMIT 1",
+        {"chart_type": "bar", "x": "C_NAME", "y": ["TOTAL_SPENT"], "series": "", "aggregate": "sum"}),
+    "Who are the top 10 customers?": (
+        "SELECT C.C_NAME, SUM(O.O_TOTALPRICE) AS TOTAL_SPENT FROM TPCH_SF10.CUSTOMER C JOIN TPCH_SF10.ORDERS O ON C.C_CUSTKEY = O.O_CUSTKEY GROUP BY C.C_NAME ORDER BY TOTAL_SPENT DESC LIMIT 10",
+        {"chart_type": "bar", "x": "C_NAME", "y": ["TOTAL_SPENT"], "series": "", "aggregate": "sum"}),
+    "What is the average delivery delay?": (
+        "SELECT DATE_TRUNC('month', L_SHIPDATE) AS SHIP_MONTH, AVG(DATEDIFF(day, L_COMMITDATE, L_RECEIPTDATE)) AS AVG_DELAY_DAYS FROM TPCH_SF10.LINEITEM GROUP BY SHIP_MONTH ORDER BY SHIP_MONTH",
+        {"chart_type": "line", "x": "SHIP_MONTH", "y": ["AVG_DELAY_DAYS"], "series": "", "aggregate": "avg"}),
+    "Which market segments generate the most revenue?": (
+        "SELECT C.C_MKTSEGMENT, SUM(O.O_TOTALPRICE) AS REVENUE FROM TPCH_SF10.CUSTOMER C JOIN TPCH_SF10.ORDERS O ON C.C_CUSTKEY = O.O_CUSTKEY GROUP BY C.C_MKTSEGMENT ORDER BY REVENUE DESC",
+        {"chart_type": "bar", "x": "C_MKTSEGMENT", "y": ["REVENUE"], "series": "", "aggregate": "sum"}),
+    "Which suppliers offer the lowest average supply cost for high-demand parts?": (
+        "WITH DEMAND AS (SELECT L_PARTKEY, SUM(L_QUANTITY) AS QUANTITY FROM TPCH_SF10.LINEITEM GROUP BY L_PARTKEY ORDER BY QUANTITY DESC LIMIT 100) "
+        "SELECT S.S_NAME, AVG(PS.PS_SUPPLYCOST) AS AVG_SUPPLY_COST FROM DEMAND D JOIN TPCH_SF10.PARTSUPP PS ON PS.PS_PARTKEY = D.L_PARTKEY "
+        "JOIN TPCH_SF10.SUPPLIER S ON S.S_SUPPKEY = PS.PS_SUPPKEY GROUP BY S.S_NAME ORDER BY AVG_SUPPLY_COST LIMIT 10",
+        {"chart_type": "bar", "x": "S_NAME", "y": ["AVG_SUPPLY_COST"], "series": "", "aggregate": "avg"}),
+    "What are the most common reasons for order returns?": (
+        "SELECT L_SHIPMODE, COUNT(*) AS RETURNED_LINES FROM TPCH_SF10.LINEITEM WHERE L_RETURNFLAG = 'R' GROUP BY L_SHIPMODE ORDER BY RETURNED_LINES DESC",
+        {"chart_type": "bar", "x": "L_SHIPMODE", "y": ["RETURNED_LINES"], "series": "", "aggregate": "sum"}),
+    "How does order volume and total sales vary over time?": (
+        "SELECT DATE_TRUNC('month', O_ORDERDATE) AS ORDER_MONTH, COUNT(*) AS ORDER_COUNT, SUM(O_TOTALPRICE) AS TOTAL_SALES FROM TPCH_SF10.ORDERS GROUP BY ORDER_MONTH ORDER BY ORDER_MONTH",
+        {"chart_type": "line", "x": "ORDER_MONTH", "y": ["TOTAL_SALES"], "series": "", "aggregate": "sum"}),
+    "In which country do I have the most sales?": (
+        "SELECT N.N_NAME AS COUNTRY, SUM(O.O_TOTALPRICE) AS TOTAL_SALES FROM TPCH_SF10.NATION N JOIN TPCH_SF10.CUSTOMER C ON C.C_NATIONKEY = N.N_NATIONKEY "
+        "JOIN TPCH_SF10.ORDERS O ON O.O_CUSTKEY = C.C_CUSTKEY GROUP BY N.N_NAME ORDER BY TOTAL_SALES DESC",
+        {"chart_type": "bar", "x": "COUNTRY", "y": ["TOTAL_SALES"], "series": "", "aggregate": "sum"}),
+}
+
+# With --row-level the trend prompt gets row-level SQL that its chart has to group (see ChartPushdown)
+ROW_LEVEL_SCRIPT = {
+    "How does order volume and total sales vary over time?": (
+        "SELECT O_ORDERDATE, O_TOTALPRICE FROM TPCH_SF10.ORDERS ORDER BY O_ORDERDATE",
+        {"chart_type": "line", "x": "O_ORDERDATE", "y": ["O_TOTALPRICE"], "series": "", "aggregate": "sum"}),
+}
+
+# Chart of the answers without one
+NO_CHART = {"chart_type": "", "x": "", "y": [], "series": "", "aggregate": ""}
+
+# Asked after every prompt with --followups; the scripted follow-up agent answers it over the previous result
+FOLLOWUP_PROMPT = "Now only keep the first 3 rows"
+
+# Order in which the scripted manager agent calls its tools
+MANAGER_STEPS = ["validate_sql", "query_snowflake", "create_chart", "validate"]
+
+
+def input_text(input):
+    if isinstance(input, str):
+        return input
+    return "\n".join(item["content"] for item in input if item.get("role") == "user" and isinstance(item.get("content"), str))
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class ScriptedModel(Model):
+    """agents SDK Model answering from SCRIPT, picked by the agent's output type.
+
+    Each call waits `latency` seconds plus the output tokens at `tokens_per_second`, and
+    reports token usage on a response span like the OpenAI models do. Streaming splits
+    the same answer into text deltas paced at that rate.
+    """
+
+    def __init__(self, script, latency=0.5, tokens_per_second=100):
+        self.script = script
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+
+    def _answer(self, prompt, output_type, input):
+        """(final JSON text, None) or (None, (tool name, arguments)) for the next manager tool call."""
+        question, scripted = next(((p, v) for p, v in self.script.items() if p in prompt), (prompt, None))
+        sql_query, chart = scripted or ("", NO_CHART)
+        if output_type == "SQLGenerationOutput":
+            if scripted is None:
+                return json.dumps({"output_type": "msg", "manager_msg": "I can only answer questions about the selected dataset.", "sql_query": ""}), None
+            return json.dumps({"output_type": "sql", "manager_msg": "Here is what I found.", "sql_query": sql_query}), None
+        if output_type == "FollowUpOutput":
+            if FOLLOWUP_PROMPT in prompt:
+                return json.dumps({"output_type": "local", "manager_msg": "Here are the first 3 rows.",
+                                   "sql_query": "SELECT * FROM previous_result LIMIT 3", "chart": NO_CHART}), None
+            return json.dumps({"output_type": "warehouse", "manager_msg": "", "sql_query": "", "chart": NO_CHART}), None
+        if output_type == "ChartSpec":
+            return json.dumps(chart), None
+        if output_type == "ValidationOutput":
+            return json.dumps({"sql_valid": True, "chart_valid": True, "errors": []}), None
+        if output_type == "SQLValidationOutput":
+            return json.dumps({"comments": []}), None
+        if output_type == "FinalOutput":
+            if scripted is None:
+                return json.dumps({"output_type": "msg", "manager_msg": "I can only answer questions about the selected dataset.",
+                                   "sql_query": "", "chart": NO_CHART}), None
+            called = [item["name"] for item in input if isinstance(item, dict) and item.get("type") == "function_call"] if not isinstance(input, str) else []
+            for step in MANAGER_STEPS:
+                if step not in called:
+                    arguments = {"validate_sql": {"sql_query": sql_query}, "query_snowflake": {"query": sql_query},
+                                 "create_chart": {"input": f"User request: {question}\n\nSQL query:\n{sql_query}"},
+                                 "validate": {"sql_query": sql_query, "chart": chart}}[step]
+                    return None, (step, arguments)
+            return json.dumps({"output_type": "sql", "manager_msg": "Here is what I found.", "sql_query": sql_query,
+                               "chart": chart}), None
+        return "Done.", None
+
+    def _response(self, system_instructions, input, output_schema):
+        prompt = input_text(input)
+        output_type = output_schema.output_type.__name__ if output_schema is not None else "str"
+        text, call = self._answer(prompt, output_type, input)
+        if call is not None:
+            name, arguments = call
+            item = ResponseFunctionToolCall(id=f"fc_{uuid.uuid4().hex}", call_id=f"call_{uuid.uuid4().hex}", name=name,
+                                            arguments=json.dumps(arguments), type="function_call", status="completed")
+            output_tokens = estimate_tokens(item.arguments)
+        else:
+            item = ResponseOutputMessage(id=f"msg_{uuid.uuid4().hex}", role="assistant", status="completed", type="message",
+                                         content=[ResponseOutputText(text=text, type="output_text", annotations=[])])
+            output_tokens = estimate_tokens(text)
+        input_tokens = estimate_tokens((system_instructions or "") + json.dumps(input, default=str))
+        usage = ResponseUsage.model_construct(input_tokens=input_tokens, output_tokens=output_tokens,
+                                              total_tokens=input_tokens + output_tokens)
+        response = Response.model_construct(id=f"resp_{uuid.uuid4().hex}", created_at=time.time(), model="scripted",
+                                            object="response", output=[item], usage=usage)
+        return response, text
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs,
+                           tracing, *, previous_response_id=None):
+        with response_span(disabled=tracing.is_disabled()) as span:
+            response, _ = self._response(system_instructions, input, output_schema)
+            await asyncio.sleep(self.latency + response.usage.output_tokens / self.tokens_per_second)
+            span.span_data.response = response
+        usage = response.usage
+        return ModelResponse(output=response.output, response_id=response.id,
+                             usage=Usage(requests=1, input_tokens=usage.input_tokens, output_tokens=usage.output_tokens,
+                                         total_tokens=usage.total_tokens))
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs,
+                              tracing, *, previous_response_id=None):
+        with response_span(disabled=tracing.is_disabled()) as span:
+            response, text = self._response(system_instructions, input, output_schema)
+            yield ResponseCreatedEvent.model_construct(type="response.created", response=response)
+            await asyncio.sleep(self.latency)
+            if text is not None:
+                chunk = 16  # ~4 tokens per delta
+                for i in range(0, len(text), chunk):
+                    await asyncio.sleep(estimate_tokens(text[i:i + chunk]) / self.tokens_per_second)
+                    yield ResponseTextDeltaEvent.model_construct(type="response.output_text.delta", delta=text[i:i + chunk],
+                                                                 item_id=response.output[0].id, output_index=0, content_index=0)
+            else:
+                await asyncio.sleep(response.usage.output_tokens / self.tokens_per_second)
+            span.span_data.response = response
+            yield ResponseCompletedEvent.model_construct(type="response.completed", response=response)
+
+# --------------- DRIVER --------------- #
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class MemorySampler:
+    """Samples the process RSS every `interval` seconds; peak() gives the max within a time window."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.samples = []  # (time.time(), rss bytes)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append((time.time(), rss_bytes()))
+            time.sleep(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def peak(self, start, end):
+        """Max RSS sampled within [start, end], or the last sample before `end` for shorter windows."""
+        values = [rss for t, rss in self.samples if start <= t <= end]
+        if not values:
+            values = [rss for t, rss in self.samples if t <= end][-1:]
+        return max(values) if values else None
+
+
+def set_toggle(at, label_start, value):
+    for toggle in at.toggle:
+        if toggle.label.startswith(label_start):
+            toggle.set_value(value)
+
+
+def install_stand_ins(config, args):
+    """Replace Snowflake and OpenAI with the local warehouse and the scripted model (in this process)."""
+    ds = config["sf_datasets"][DATASET]
+    warehouse = LocalWarehouse(ds["database"], ds["schema"], generate_tpch(args.scale), args.sf_latency)
+    snowflake.connector.connect = warehouse.connect
+    model = ScriptedModel({**SCRIPT, **ROW_LEVEL_SCRIPT} if args.row_level else SCRIPT, args.llm_latency, args.llm_tps)
+    OpenAIProvider.get_model = lambda self, model_name: model
+    # The app's own trace processor is the only one left
+    set_trace_processors([])
+
+
+def session_process(worker, prompts, config, args, barrier):
+    """Worker process: sets up its stand-ins and session, waits for the other sessions, then replays the prompts.
+
+    Returns the session's latencies and RSS samples; its traces are written before it returns.
+    """
+    start = time.perf_counter()
+    install_stand_ins(config, args)
+    if worker == 0:
+        print(f"Generated TPC-H scale {args.scale} in {time.perf_counter() - start:.1f}s")
+    at = open_session(args)
+    sampler = MemorySampler().start()
+    barrier.wait(args.timeout)
+    try:
+        return run_session(worker, at, prompts), sampler.samples
+    finally:
+        flush_traces()
+        sampler.stop()
+
+
+def open_session(args):
+    """A chat session logged in, with the dataset and the app settings of `args` selected."""
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.secrets.update(SECRETS)
+    at.run()
+    at.text_input[0].set_value(PASSWORD).run()
+    at.selectbox[0].set_value(DATASET).run()
+    at.radio[0].set_value("Parallel pipeline" if args.pipeline else "Manager agent")
+    set_toggle(at, "Stream the answer", not args.no_stream)
+    set_toggle(at, "Reuse answers", args.reuse)
+    set_toggle(at, "Reuse results", args.reuse)
+    set_toggle(at, "Group large chart queries", not args.no_pushdown)
+    at.run()
+    return at
+
+
+def run_session(worker, at, prompts):
+    """Replays the prompts in the session; returns the end-to-end seconds of each prompt."""
+    latencies = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        at.chat_input[0].set_value(prompt).run()
+        latencies.append(time.perf_counter() - start)
+        if at.exception:
+            print(f"worker {worker}: {prompt!r} raised {at.exception[0].message}")
+    return latencies
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": values[-1]}
+
+
+def report(latencies, wall, traces, sampler):
+    summary = {"requests": len(latencies), "throughput_rpm": 60 * len(latencies) / wall,
+               "end_to_end": percentiles(latencies), "stages": {}}
+    peaks = {}
+    for trace in traces:
+        for span in trace["spans"]:
+            if "end" in span:
+                end = trace["ts"] + span["end"]
+                peak = sampler.peak(end - span["seconds"], end)
+                if peak is not None:
+                    peaks[span["stage"]] = max(peaks.get(span["stage"], 0), peak)
+    for stage, p in stage_percentiles(traces).items():
+        summary["stages"][stage] = {**p, "peak_rss_mb": peaks[stage] / 1024 ** 2 if stage in peaks else None}
+
+    e2e = summary["end_to_end"]
+    print(f"\n{summary['requests']} requests, {summary['throughput_rpm']:.1f} requests/min, "
+          f"end-to-end p50 {e2e['p50']:.2f}s  p95 {e2e['p95']:.2f}s  max {e2e['max']:.2f}s\n")
+    print(f"{'stage':<36}{'n':>5}{'p50 (s)':>10}{'p95 (s)':>10}{'peak RSS (MB)':>15}")
+    for stage, s in summary["stages"].items():
+        rss = f"{s['peak_rss_mb']:.0f}" if s["peak_rss_mb"] is not None else "-"
+        print(f"{stage:<36}{s['count']:>5}{s['p50']:>10.3f}{s['p95']:>10.3f}{rss:>15}")
+    return summary
+
+
+# Slowdowns below this many seconds are scheduling noise, whatever the relative change
+NOISE_FLOOR = 0.05
+
+
+def compare(summary, baseline, tolerance):
+    """Names of the end-to-end / stage percentiles more than `tolerance` slower than the baseline."""
+    regressions = []
+    checks = [("end_to_end", summary["end_to_end"], baseline["end_to_end"])]
+    checks += [(stage, s, baseline["stages"][stage]) for stage, s in summary["stages"].items() if stage in baseline["stages"]]
+    for name, current, before in checks:
+        for q in ("p50", "p95"):
+            if current[q] > before[q] * (1 + tolerance) and current[q] - before[q] > NOISE_FLOOR:
+                regressions.append(f"{name} {q}: {before[q]:.3f}s -> {current[q]:.3f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale", type=float, default=0.01, help="TPC-H scale factor of the generated data")
+    parser.add_argument("--concurrency", type=int, default=2, help="chat sessions running at the same time")
+    parser.add_argument("--rounds", type=int, default=1, help="times each session replays the prompts")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before a scripted model call answers")
+    parser.add_argument("--llm-tps", type=float, default=100, help="output tokens per second of the scripted model")
+    parser.add_argument("--sf-latency", type=float, default=0.1, help="seconds added to every warehouse statement")
+    parser.add_argument("--pipeline", action="store_true", help="use the parallel pipeline instead of the manager agent")
+    parser.add_argument("--no-stream", action="store_true", help="do not stream the answer")
+    parser.add_argument("--reuse", action="store_true", help="keep the answer / result caches on")
+    parser.add_argument("--followups", action="store_true", help=f"ask {FOLLOWUP_PROMPT!r} after every prompt")
+    parser.add_argument("--row-level", action="store_true", help="answer the trend prompt with row-level SQL (chart pushdown)")
+    parser.add_argument("--no-pushdown", action="store_true", help="do not group large chart queries in the warehouse")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed for one prompt")
+    parser.add_argument("--save", help="write the summary to this JSON file")
+    parser.add_argument("--compare", help="baseline summary JSON; exit 1 when a percentile regresses")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+    save, baseline = (os.path.abspath(p) if p else None for p in (args.save, args.compare))
+
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    # Scratch working directory: the app's .cache (answers, results, dictionary, traces) starts empty
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    shutil.copy("config.yaml", workdir)
+    os.symlink(os.path.abspath("images"), os.path.join(workdir, "images"))
+    os.chdir(workdir)
+
+    prompts = [p for q in config["prompts"] for p in ([q, FOLLOWUP_PROMPT] if args.followups else [q])] * args.rounds
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Manager() as manager, ProcessPoolExecutor(args.concurrency, mp_context=context) as pool:
+            barrier = manager.Barrier(args.concurrency + 1)
+            futures = [pool.submit(session_process, w, prompts, config, args, barrier) for w in range(args.concurrency)]
+            try:
+                barrier.wait(args.timeout)  # every session is set up
+            except threading.BrokenBarrierError:
+                for future in futures:
+                    if future.done():
+                        future.result()  # raise the worker's own error
+                raise
+            start = time.perf_counter()
+            results = [future.result() for future in futures]
+            wall = time.perf_counter() - start
+        sessions = [latencies for latencies, _ in results]
+        sampler = MemorySampler()
+        sampler.samples = sorted(sample for _, samples in results for sample in samples)
+        traces = read_traces(config["tracing"]["path"], limit=len(prompts) * args.concurrency)
+    finally:
+        os.chdir(os.path.dirname(APP_PATH))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = report([l for s in sessions for l in s], wall, traces, sampler)
+    if args.followups:
+        summary["followups"] = percentiles([l for s in sessions for l in s[1::2]])
+        print(f"\nfollow-ups end-to-end p50 {summary['followups']['p50']:.2f}s  p95 {summary['followups']['p95']:.2f}s")
+    summary["args"] = vars(args)
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against", baseline)
+            print("\n".join(f"- {r}" for r in regressions))
+            sys.exit(1)
+        print("\nNo regression against", baseline)
+
+
+if __name__ == "__main__":
+    main()
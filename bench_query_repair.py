@@ -0,0 +1,85 @@
+"""How many LLM retries does the local query repair save?
+
+Replays typical generation mistakes (wrong case in quoted identifiers, missing
+schema, pluralized tables, misspelled columns, hallucinated columns) on a
+reference query for every TPC-H sample prompt in config.yaml, and counts how
+many are fixed by SQLValidator.repair without going back to the model. The
+data dictionary is read from the app's on-disk cache (.cache/data_dictionary),
+so run the app once on TPC_H_BUSINESS_SAMPLE first.
+
+    python bench_query_repair.py
+"""
+import time
+import yaml
+from sf_utils import DataDictionaryCache
+from sql_utils import SQLValidator
+from st_utils import CONFIG_PATH
+
+DATASET = "TPC_H_BUSINESS_SAMPLE"
+
+# Each sample prompt with the kind of broken queries the agents produce for it. Queries built
+# on a concept the schema does not have (e.g. L_RETURN_REASON) cannot be repaired locally.
+BROKEN_QUERIES = {
+    "Who is my best customer?": [
+        'SELECT "c_name", SUM(O_TOTALPRICE) AS TOTAL FROM TPCH_SF10.CUSTOMER JOIN TPCH_SF10.ORDERS ON C_CUSTKEY = O_CUSTKEY GROUP BY "c_name" ORDER BY TOTAL DESC LIMIT 1',
+        "SELECT C_NAME, SUM(O_TOTALPRICE) AS TOTAL FROM CUSTOMER JOIN ORDERS ON C_CUSTKEY = O_CUSTKEY GROUP BY C_NAME ORDER BY TOTAL DESC LIMIT 1",
+    ],
+    "Who are the top 10 customers?": [
+        "SELECT C_NAME, SUM(O_TOTALPRICE) AS TOTAL FROM TPCH_SF10.CUSTOMERS JOIN TPCH_SF10.ORDERS ON C_CUSTKEY = O_CUSTKEY GROUP BY C_NAME ORDER BY TOTAL DESC LIMIT 10",
+        "SELECT C_NAME, SUM(O_TOTAL_PRICE) AS TOTAL FROM TPCH_SF10.CUSTOMER JOIN TPCH_SF10.ORDERS ON C_CUSTKEY = O_CUSTKEY GROUP BY C_NAME ORDER BY TOTAL DESC LIMIT 10",
+    ],
+    "What is the average delivery delay?": [
+        "SELECT AVG(DATEDIFF(day, L_COMMIT_DATE, L_RECEIPT_DATE)) AS AVG_DELAY FROM TPCH_SF10.LINEITEM",
+        "SELECT AVG(L_DELIVERY_DELAY) AS AVG_DELAY FROM TPCH_SF10.LINEITEM",
+    ],
+    "Which market segments generate the most revenue?": [
+        "SELECT C_MKT_SEGMENT, SUM(O_TOTALPRICE) AS REVENUE FROM TPCH_SF10.CUSTOMER JOIN TPCH_SF10.ORDERS ON C_CUSTKEY = O_CUSTKEY GROUP BY C_MKT_SEGMENT ORDER BY REVENUE DESC",
+        'SELECT "c_mktsegment", SUM(O_TOTALPRICE) AS REVENUE FROM TPCH_SF10.CUSTOMER JOIN TPCH_SF10.ORDER ON C_CUSTKEY = O_CUSTKEY GROUP BY 1 ORDER BY REVENUE DESC',
+    ],
+    "Which suppliers offer the lowest average supply cost for high-demand parts?": [
+        "SELECT S_NAME, AVG(PS_SUPPLY_COST) AS AVG_COST FROM TPCH_SF10.SUPPLIERS JOIN TPCH_SF10.PARTSUPP ON S_SUPPKEY = PS_SUPPKEY GROUP BY S_NAME ORDER BY AVG_COST LIMIT 10",
+        "SELECT S_NAME, AVG(PS_SUPPLYCOST) AS AVG_COST FROM TPCH_SF10.SUPPLIER JOIN TPCH_SF10.PARTSUPP ON S_SUPPKEY = PS_SUPPKEY WHERE PS_DEMAND > 100 GROUP BY S_NAME",
+    ],
+    "What are the most common reasons for order returns?": [
+        "SELECT L_RETURN_FLAG, COUNT(*) AS N FROM TPCH_SF10.LINEITEMS GROUP BY L_RETURN_FLAG ORDER BY N DESC",
+        "SELECT L_RETURN_REASON, COUNT(*) AS N FROM TPCH_SF10.LINEITEM GROUP BY L_RETURN_REASON ORDER BY N DESC",
+    ],
+    "How does order volume and total sales vary over time?": [
+        "SELECT DATE_TRUNC('month', O_ORDER_DATE) AS MONTH, COUNT(*) AS ORDERS, SUM(O_TOTALPRICE) AS SALES FROM TPCH_SF10.ORDERS GROUP BY MONTH ORDER BY MONTH",
+        "SELECT DATE_TRUNC('month', O_ORDERDATE) AS MONTH, COUNT(*) AS ORDERS, SUM(O_SALES_AMOUNT) AS SALES FROM TPCH_SF10.ORDERS GROUP BY MONTH",
+    ],
+    "In which country do I have the most sales?": [
+        "SELECT N_NAME, SUM(O_TOTALPRICE) AS SALES FROM TPCH_SF10.NATIONS JOIN TPCH_SF10.CUSTOMER ON N_NATIONKEY = C_NATIONKEY JOIN TPCH_SF10.ORDERS ON C_CUSTKEY = O_CUSTKEY GROUP BY N_NAME ORDER BY SALES DESC",
+        "SELECT C_COUNTRY, SUM(O_TOTALPRICE) AS SALES FROM TPCH_SF10.CUSTOMER JOIN TPCH_SF10.ORDERS ON C_CUSTKEY = O_CUSTKEY GROUP BY C_COUNTRY ORDER BY SALES DESC",
+    ],
+}
+
+
+def main():
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    ds = config["sf_datasets"][DATASET]
+    entry = DataDictionaryCache().peek(ds["database"], ds["schema"])
+    if entry is None:
+        print(f"{DATASET}: no cached data dictionary, run the app on this dataset first")
+        return
+    validator = SQLValidator.from_dataframe(entry.df, ds["database"])
+
+    broken = saved = 0
+    for prompt in config["prompts"]:
+        for sql in BROKEN_QUERIES.get(prompt, []):
+            errors = validator.errors(sql)
+            if not errors:
+                continue
+            broken += 1
+            start = time.perf_counter()
+            repaired, fixes = validator.repair(sql, errors)
+            elapsed = (time.perf_counter() - start) * 1000
+            status = f"repaired in {elapsed:.1f} ms: {', '.join(fixes)}" if repaired else "left to the LLM"
+            saved += repaired is not None
+            print(f"{prompt[:50]:<50} {status}")
+    print(f"\n{saved}/{broken} failing queries repaired locally -> {saved} LLM retries saved")
+
+
+if __name__ == "__main__":
+    main()
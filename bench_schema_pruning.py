@@ -0,0 +1,88 @@
+"""Prompt-size / latency benchmark for question-relevant schema pruning.
+
+Compares the full markdown data dictionary with the pruned SchemaIndex context
+for every sample prompt in config.yaml, and the size the column profiles add to
+it. Dictionaries and profiles are read from the on-disk caches written by the app
+(.cache/data_dictionary, .cache/profiles), so run the app once per dataset first.
+
+    python bench_schema_pruning.py                 # token counts only, offline
+    python bench_schema_pruning.py --live          # + SQL-generation latency (needs OPENAI_API_KEY)
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import yaml
+from schema_utils import SchemaIndex, estimate_tokens
+from sf_utils import DataDictionaryCache
+from profile_utils import ProfileStore
+from st_utils import CONFIG_PATH
+
+LIVE_INSTRUCTIONS = """Write one Snowflake SQL query answering the user's request using the data dictionary provided.
+When using a table use the <schema_name>.<table_name> format. Only output the SQL."""
+
+
+async def time_generation(model, request):
+    from agents import Agent, Runner
+    agent = Agent(name="sql_agent", model=model, instructions=LIVE_INSTRUCTIONS)
+    start = time.perf_counter()
+    await Runner.run(agent, request)
+    return time.perf_counter() - start
+
+
+def request_for(prompt, description, dictionary):
+    return f"""{prompt}
+
+    ### Additional context:
+    Dataset description: {description}
+    The following data dictionary is provided to help you understand the schema:\n{dictionary}
+    """
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="also time one SQL generation per prompt and context")
+    parser.add_argument("--model", default="gpt-4.1-mini")
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    index_cfg = config["schema_index"]
+    dd_cache = DataDictionaryCache()
+    profile_store = ProfileStore()
+
+    for name, ds in config["sf_datasets"].items():
+        entry = dd_cache.peek(ds["database"], ds["schema"])
+        if entry is None:
+            print(f"{name}: no cached data dictionary, run the app on this dataset first\n")
+            continue
+        index = SchemaIndex.from_dataframe(entry.df, index_cfg.get("synonyms"))
+        profile = profile_store.peek(ds["database"], ds["schema"])
+        full_tokens = estimate_tokens(entry.markdown)
+
+        print(f"## {name} ({ds['database']}.{ds['schema']}) — full dictionary: {full_tokens} tokens")
+        reductions, full_times, pruned_times = [], [], []
+        for prompt in config["prompts"]:
+            pruned = index.context_for(prompt, index_cfg["top_k_tables"], index_cfg["top_k_columns"])
+            pruned_tokens = estimate_tokens(pruned)
+            reduction = 1 - pruned_tokens / full_tokens
+            reductions.append(reduction)
+            line = f"{prompt:<80} {pruned_tokens:>7} tokens  -{reduction:6.1%}"
+            if profile is not None:
+                profiled = index.context_for(prompt, index_cfg["top_k_tables"], index_cfg["top_k_columns"], profile)
+                line += f"  +{estimate_tokens(profiled) - pruned_tokens:>5} with profiles"
+            if args.live:
+                full_t = asyncio.run(time_generation(args.model, request_for(prompt, ds["description"], entry.markdown)))
+                pruned_t = asyncio.run(time_generation(args.model, request_for(prompt, ds["description"], pruned)))
+                full_times.append(full_t)
+                pruned_times.append(pruned_t)
+                line += f"  {full_t:6.2f}s -> {pruned_t:6.2f}s"
+            print(line)
+        print(f"median token reduction: {statistics.median(reductions):.1%}")
+        if args.live:
+            print(f"median latency: {statistics.median(full_times):.2f}s -> {statistics.median(pruned_times):.2f}s")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import os
+import re
+import json
+import time
+import hashlib
+import difflib
+import sqlite3
+import threading
+from collections import OrderedDict
+import pyarrow as pa
+import streamlit as st
+
+CACHE_DIR = ".cache"
+
+# --------------- QUESTION NORMALIZATION --------------- #
+
+# Filler words that never change what is being asked. Words like "top", "most", "least"
+# or numbers are kept on purpose: "top 5" and "top 10" are different questions.
+FILLER_WORDS = {
+    "a", "an", "the", "please", "can", "could", "would", "you", "me", "tell", "show", "give",
+    "what", "who", "which", "list", "is", "are", "was", "my", "i", "we", "our", "do", "does", "have",
+    "there", "of", "for", "to", "in",
+}
+
+
+def normalize_question(question):
+    words = []
+    for word in re.findall(r"[a-z0-9]+", question.lower()):
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+def question_similarity(a, b):
+    """Word-order similarity of two normalized questions; 0 unless they have the same words.
+
+    Filler words are already gone, so every remaining word (entity, number, measure) must be
+    in both questions: "... in France ..." never matches "... in Germany ...". The score only
+    tolerates word-order differences ("customers top 10 by revenue" / "top 10 customers by
+    revenue"), while swapped roles ("revenue by region" / "region by revenue") score low.
+    """
+    ta, tb = a.split(), b.split()
+    if set(ta) != set(tb):
+        return 0.0
+    if not ta:
+        return 1.0
+    return difflib.SequenceMatcher(None, ta, tb, autojunk=False).ratio()
+
+# --------------- ANSWER CACHE --------------- #
+
+ANSWER_CACHE_TTL = 7 * 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 2000
+ANSWER_CACHE_SIMILARITY = 0.8
+
+
+class AnswerCache:
+    """Question -> agent answer (FinalOutput fields) cache, keyed by dataset, model and persona.
+
+    Entries live in a SQLite file so every session and process of the app
+    shares them, with a small in-memory LRU in front. Lookups try the exact
+    normalized question first, then a cached question of the same
+    dataset/model/persona with the same words in a similar order (see
+    question_similarity) above `similarity`.
+    """
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "answers.sqlite"), ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, similarity=ANSWER_CACHE_SIMILARITY, memory_entries=256):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS answers (
+            dataset TEXT, model TEXT, persona TEXT, question TEXT,
+            output TEXT, created_at REAL, last_used REAL,
+            PRIMARY KEY (dataset, model, persona, question))""")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, dataset, model, persona, question):
+        """Cached output dict for the question, or None."""
+        norm = normalize_question(question)
+        key = (dataset, model, persona, norm)
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None and now - hit[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+
+            rows = self._db.execute(
+                "SELECT question, output, created_at FROM answers WHERE dataset=? AND model=? AND persona=? AND created_at>=?",
+                (dataset, model, persona, now - self.ttl)).fetchall()
+            best, best_score = None, 0.0
+            for cached_question, output, created_at in rows:
+                score = 1.0 if cached_question == norm else question_similarity(norm, cached_question)
+                if score > best_score:
+                    best, best_score = (cached_question, output, created_at), score
+            if best is None or best_score < self.similarity:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE answers SET last_used=? WHERE dataset=? AND model=? AND persona=? AND question=?",
+                             (now, dataset, model, persona, best[0]))
+            output = json.loads(best[1])
+            self._remember(key, output, best[2])
+            self.hits += 1
+            return output
+
+    def put(self, dataset, model, persona, question, output):
+        norm = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (dataset, model, persona, norm, json.dumps(output), now, now))
+            self._remember((dataset, model, persona, norm), output, now)
+            self._evict(now)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM answers")
+
+    def _remember(self, key, output, created_at):
+        self._memory[key] = (output, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM answers WHERE created_at<?", (now - self.ttl,))
+        self._db.execute("""DELETE FROM answers WHERE rowid IN (
+            SELECT rowid FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+
+
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache()
+
+# --------------- RESULT CACHE --------------- #
+
+RESULT_CACHE_TTL = 3600                         # default seconds, overridden per dataset (result_ttl)
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3          # total size of the cached result files
+RESULT_CACHE_MAX_ENTRY_BYTES = 256 * 1024 ** 2  # larger results are not cached
+
+
+def normalize_sql(query):
+    r"""Strip comments, trailing semicolons and whitespace/case differences outside literals and quoted identifiers.
+
+    >>> normalize_sql("select id from t where name = 'O\\'Brien' -- it's him ;")
+    "SELECT ID FROM T WHERE NAME = 'O\\'Brien'"
+    >>> normalize_sql("select 'a\\'--b', $$x -- y$$ , c  from t;")
+    "SELECT 'a\\'--b', $$x -- y$$ , C FROM T"
+    """
+    # One left-to-right pass: whichever of literal, quoted identifier or comment starts first wins,
+    # so "--" inside 'a--b' stays part of the literal and a quote inside a comment is ignored.
+    # Literals: 'it''s', 'O\'Brien' (backslash escapes) and $$dollar-quoted$$
+    parts = re.split(r"('(?:[^'\\]|\\.|'')*'|\$\$.*?\$\$|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/)", query, flags=re.S)
+    normalized, code = [], []
+    for i, part in enumerate(parts):
+        if i % 2 == 0 or part.startswith(("--", "/*")):
+            code.append(part if i % 2 == 0 else " ")
+            continue
+        normalized.append(re.sub(r"\s+", " ", "".join(code)).upper())
+        normalized.append(part)
+        code = []
+    normalized.append(re.sub(r"\s+", " ", "".join(code)).upper())
+    return "".join(normalized).strip().rstrip(";").strip()
+
+
+def sql_cache_key(database, query):
+    return hashlib.sha256(f"{database}\n{normalize_sql(query)}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Executed-query results stored as Arrow IPC files and read back memory-mapped.
+
+    Keyed by a hash of the database and the normalized SQL text. An SQLite
+    index (shared across sessions/processes) tracks sizes and last use so the
+    directory is kept under `max_bytes` with LRU eviction; each lookup passes
+    the dataset's TTL.
+    """
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, "results"), max_bytes=RESULT_CACHE_MAX_BYTES,
+                 max_entry_bytes=RESULT_CACHE_MAX_ENTRY_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY, database TEXT, bytes INTEGER, created_at REAL, last_used REAL)""")
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".arrow")
+
+    def get(self, database, query, ttl=RESULT_CACHE_TTL):
+        """Cached result as a DataFrame, or None."""
+        key = sql_cache_key(database, query)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT created_at FROM results WHERE key=?", (key,)).fetchone()
+            if row is None or now - row[0] > ttl or not os.path.exists(self._path(key)):
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE results SET last_used=? WHERE key=?", (now, key))
+        try:
+            with pa.memory_map(self._path(key), "r") as source:
+                table = pa.ipc.open_file(source).read_all()
+            df = table.to_pandas()
+        except Exception as e:
+            print("❌ Result cache read error:", e)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return df
+
+    def contains(self, database, query, ttl=RESULT_CACHE_TTL):
+        key = sql_cache_key(database, query)
+        with self._lock:
+            row = self._db.execute("SELECT created_at FROM results WHERE key=?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] <= ttl and os.path.exists(self._path(key))
+
+    def put(self, database, query, df):
+        key = sql_cache_key(database, query)
+        path = self._path(key)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if table.nbytes > self.max_entry_bytes:
+                return
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  # sessions/processes may store the same query at once
+            with pa.OSFile(tmp, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp, path)
+        except Exception as e:
+            print("❌ Result cache write error:", e)
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                             (key, database, os.path.getsize(path), now, now))
+            self._evict()
+
+    def invalidate(self, database=None):
+        with self._lock:
+            if database is None:
+                rows = self._db.execute("SELECT key FROM results").fetchall()
+            else:
+                rows = self._db.execute("SELECT key FROM results WHERE database=?", (database,)).fetchall()
+            for (key,) in rows:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def _remove(self, key):
+        self._db.execute("DELETE FROM results WHERE key=?", (key,))
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, bytes FROM results ORDER BY last_used").fetchall():
+            self._remove(key)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
@@ -0,0 +1,179 @@
+import datetime
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# --------------- CHART SPEC --------------- #
+
+CHART_TYPES = ("line", "bar", "area", "scatter")
+CHART_AGGREGATES = {"sum": "sum", "avg": "mean", "min": "min", "max": "max", "count": "count"}  # -> pandas
+CHART_MAX_POINTS = 2000          # points per chart sent to the browser
+CHART_POINTS_COLUMN = "_POINTS"  # rows behind each point of a binned scatter chart (its size), see points_column
+
+
+def resolve_chart(spec, columns):
+    """(spec with the exact column names, errors) of a chart spec {"chart_type", "x", "y", "series", "aggregate"}.
+
+    Column names are matched case-insensitively; the spec is unusable when errors is not empty.
+    A missing or unknown aggregate is "sum".
+    """
+    by_name = {str(c).upper(): c for c in columns}
+    errors = []
+    if not spec or spec.get("chart_type") not in CHART_TYPES:
+        return None, [f"The chart type must be one of {', '.join(CHART_TYPES)}."]
+    resolved = {"chart_type": spec["chart_type"], "x": by_name.get(str(spec.get("x") or "").upper()),
+                "y": [by_name.get(str(y).upper()) for y in spec.get("y") or []],
+                "series": by_name.get(str(spec.get("series") or "").upper(), "") if spec.get("series") else "",
+                "aggregate": spec.get("aggregate") if spec.get("aggregate") in CHART_AGGREGATES else "sum"}
+    missing = [spec.get("x") or "x"] if resolved["x"] is None else []
+    missing += [y for y, found in zip(spec.get("y") or [], resolved["y"]) if found is None]
+    if spec.get("series") and not resolved["series"]:
+        missing.append(spec["series"])
+    if missing:
+        errors.append(f"The chart references columns that are not in the result: {', '.join(map(str, missing))}")
+    if not resolved["y"]:
+        errors.append("The chart needs at least one y column.")
+    if resolved["series"] and len(resolved["y"]) > 1:
+        resolved["y"] = resolved["y"][:1]  # Streamlit colors either several y columns or one split by series
+    return (None if errors else resolved), errors
+
+
+def chart_spec_errors(spec, columns):
+    return resolve_chart(spec, columns)[1]
+
+# --------------- DOWNSAMPLING --------------- #
+
+def _axis_values(values):
+    """(float positions, ordered) of an axis: numbers and dates by value, categories by their order."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").to_numpy(dtype=float), True
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float), True
+    return np.arange(len(values), dtype=float), False
+
+
+def lttb_indices(x, y, threshold):
+    """Indices of the `threshold` points kept by Largest-Triangle-Three-Buckets (x sorted).
+
+    The first and last points are kept; each bucket in between keeps the point forming the
+    largest triangle with the previous kept point and the average of the next bucket, which
+    preserves peaks and dips that plain striding or averaging would flatten.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def _lttb(frame, x, ys, budget):
+    """Rows kept by LTTB for every y column, with the budget shared between the y columns."""
+    frame = frame.sort_values(x, kind="stable", ignore_index=True)
+    positions, _ = _axis_values(frame[x])
+    keep = set()
+    for y in ys:
+        values = frame[y].interpolate(limit_direction="both").fillna(0).to_numpy(dtype=float)
+        keep.update(lttb_indices(positions, values, max(3, budget // len(ys))).tolist())
+    return frame.iloc[sorted(keep)]
+
+
+def points_column(spec):
+    """Name of the point-size column of a binned scatter chart: CHART_POINTS_COLUMN unless a charted column has it."""
+    charted = {spec["x"], *spec["y"], spec["series"]}
+    name = CHART_POINTS_COLUMN
+    while charted & {name, f"{name}_X", f"{name}_Y"}:  # _X / _Y: grid cells while binning
+        name += "_"
+    return name
+
+
+def _bin_scatter(frame, x, y, series, budget, size):
+    """One point per occupied cell of a grid over x / y (per series): the cell mean, sized by its rows (`size`)."""
+    cells = max(2, int(np.sqrt(budget)))
+    binned = frame.copy()
+    keys = [series] if series else []
+    x_cell, y_cell = f"{size}_X", f"{size}_Y"
+    for axis, cell in ((x, x_cell), (y, y_cell)):
+        values, _ = _axis_values(binned[axis])
+        low, high = np.nanmin(values), np.nanmax(values)
+        binned[cell] = np.floor((values - low) / ((high - low) or 1) * (cells - 1))
+        keys.append(cell)
+    reduced = binned.groupby(keys, sort=False, dropna=False).agg(
+        **{x: (x, "mean"), y: (y, "mean"), size: (y, "size")}).reset_index()
+    return reduced.drop(columns=[x_cell, y_cell])
+
+
+def reduce_chart_frame(spec, df, max_points=CHART_MAX_POINTS):
+    """(frame, note): only the charted columns, reduced to about `max_points` points when larger.
+
+    Line / area charts (and bar charts over numbers or dates) keep the LTTB points of every
+    series, scatter charts are binned on a grid and bar charts over categories are aggregated
+    per bar (the spec's aggregate), keeping the largest bars. `note` says what was reduced, or is None.
+    """
+    x, ys, series = spec["x"], spec["y"], spec["series"]
+    frame = df[list(dict.fromkeys([x, *ys] + ([series] if series else [])))].copy()
+    for y in ys:
+        if not pd.api.types.is_numeric_dtype(frame[y]):
+            frame[y] = pd.to_numeric(frame[y], errors="coerce")
+    # Snowflake DATE columns arrive as datetime.date objects
+    first = frame[x].dropna().head(1)
+    if frame[x].dtype == object and len(first) and isinstance(first.iloc[0], datetime.date):
+        frame[x] = pd.to_datetime(frame[x], errors="coerce")
+    frame = frame.dropna(subset=[x]).dropna(subset=ys, how="all")
+    rows = len(frame)
+    if rows <= max_points:
+        return frame, None
+
+    chart_type = spec["chart_type"]
+    _, ordered = _axis_values(frame[x])
+    if chart_type == "scatter" and ordered:
+        reduced = _bin_scatter(frame.dropna(subset=ys[:1]), x, ys[0], series, max_points, points_column(spec))
+        return reduced, f"{rows:,} rows binned into {len(reduced):,} points"
+    if chart_type == "bar" and not ordered:
+        # The chart stacks the rows of a bar anyway: combine them here, then keep the largest bars
+        function = CHART_AGGREGATES[spec.get("aggregate", "sum")]
+        combined = frame.groupby([x] + ([series] if series else []), sort=False, as_index=False)[ys].agg(function)
+        largest = combined.groupby(x, sort=False)[ys[0]].sum().nlargest(max_points).index
+        reduced = combined[combined[x].isin(largest)]
+        bars = combined[x].nunique()
+        verb = "summed" if function == "sum" else f"aggregated ({spec.get('aggregate')})"
+        return reduced, f"{rows:,} rows {verb} into {len(largest):,} bars" + (f" (largest of {bars:,})" if bars > len(largest) else "")
+    if series:
+        groups = frame.groupby(series, sort=False)
+        budget = max(3, max_points // groups.ngroups)
+        reduced = pd.concat([_lttb(group, x, ys, budget) for _, group in groups], ignore_index=True)
+    else:
+        reduced = _lttb(frame, x, ys, max_points)
+    return reduced, f"{rows:,} rows downsampled to {len(reduced):,} points (LTTB)"
+
+# --------------- RENDERING --------------- #
+
+def prepare_chart(spec, df, max_points=CHART_MAX_POINTS):
+    """(resolved spec, reduced frame, note) ready for render_chart; raises ValueError on an unusable spec."""
+    resolved, errors = resolve_chart(spec, df.columns)
+    if errors:
+        raise ValueError(" ".join(errors))
+    frame, note = reduce_chart_frame(resolved, df, max_points)
+    return resolved, frame, note
+
+
+def render_chart(spec, frame, note=None):
+    """Draw a prepared chart with the matching st.*_chart element."""
+    chart = {"line": st.line_chart, "bar": st.bar_chart, "area": st.area_chart, "scatter": st.scatter_chart}[spec["chart_type"]]
+    kwargs = {"x": spec["x"], "y": spec["y"][0] if len(spec["y"]) == 1 else spec["y"]}
+    if spec["series"]:
+        kwargs["color"] = spec["series"]
+    if spec["chart_type"] == "scatter" and points_column(spec) in frame.columns:
+        kwargs["size"] = points_column(spec)
+    chart(frame, **kwargs)
+    if note:
+        st.caption(f"📉 {note}")
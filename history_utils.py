@@ -0,0 +1,219 @@
+import os
+import re
+import time
+import uuid
+import shutil
+from collections import OrderedDict
+import duckdb
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from cache_utils import CACHE_DIR, FILLER_WORDS
+from sql_utils import READ_ONLY_STATEMENTS
+
+# --------------- CHAT HISTORY STORE --------------- #
+
+HISTORY_DIR = os.path.join(CACHE_DIR, "history")
+HISTORY_PREVIEW_ROWS = 50
+HISTORY_MEMORY_BUDGET = 64 * 1024 ** 2   # bytes of full results kept loaded per session
+HISTORY_MAX_AGE = 2 * 24 * 3600          # spilled sessions older than this are deleted
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+class ChatHistoryStore:
+    """Per-session store for the result tables of the chat history.
+
+    Only a small preview of each result stays in the message itself; the full
+    table is spilled to a zstd-compressed Parquet file and loaded back on
+    demand. Loaded tables are kept in an LRU bounded by `memory_budget` bytes.
+    """
+
+    def __init__(self, root=HISTORY_DIR, memory_budget=HISTORY_MEMORY_BUDGET, preview_rows=HISTORY_PREVIEW_ROWS):
+        self.session_id = uuid.uuid4().hex
+        self.dir = os.path.join(root, self.session_id)
+        self.memory_budget = memory_budget
+        self.preview_rows = preview_rows
+        self._loaded = OrderedDict()  # table_id -> DataFrame
+        self._loaded_bytes = 0
+        os.makedirs(self.dir, exist_ok=True)
+        cleanup_history(root)
+
+    def add(self, df):
+        """Spill the table and return the compact fields to store in the chat message."""
+        table_id = uuid.uuid4().hex
+        try:
+            self._touch()
+            df.to_parquet(self._path(table_id), compression="zstd", index=False)
+        except Exception as e:
+            print("❌ History spill error:", e)
+            table_id = None
+        if table_id is not None:
+            self._remember(table_id, df)
+        return {
+            "table_id": table_id,
+            "preview": df.head(self.preview_rows),
+            "rows": len(df),
+            "truncated": bool(df.attrs.get("truncated")),
+        }
+
+    def load(self, table_id):
+        """Full table, from memory when still loaded, otherwise from disk.
+
+        Raises FileNotFoundError when the spilled file is gone.
+        """
+        self._touch()
+        if table_id in self._loaded:
+            self._loaded.move_to_end(table_id)
+            return self._loaded[table_id]
+        df = pd.read_parquet(self._path(table_id))
+        self._remember(table_id, df)
+        return df
+
+    def clear(self):
+        self._loaded.clear()
+        self._loaded_bytes = 0
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, table_id):
+        return os.path.join(self.dir, table_id + ".parquet")
+
+    def _touch(self):
+        """Mark the session as active: cleanup_history goes by the directory's mtime."""
+        os.makedirs(self.dir, exist_ok=True)
+        try:
+            os.utime(self.dir)
+        except OSError:
+            pass
+
+    def _remember(self, table_id, df):
+        self._loaded[table_id] = df
+        self._loaded_bytes += frame_bytes(df)
+        while self._loaded_bytes > self.memory_budget and len(self._loaded) > 1:
+            _, evicted = self._loaded.popitem(last=False)
+            self._loaded_bytes -= frame_bytes(evicted)
+
+
+def cleanup_history(root=HISTORY_DIR, max_age=HISTORY_MAX_AGE):
+    """Delete spilled history of sessions that have not saved or loaded anything for `max_age` seconds."""
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and now - os.path.getmtime(path) > max_age:
+            shutil.rmtree(path, ignore_errors=True)
+
+# --------------- FOLLOW-UP WORKSPACE --------------- #
+
+FOLLOWUP_TABLE = "previous_result"
+FOLLOWUP_SAMPLE_ROWS = 5     # rows of the previous result shown to the follow-up agent
+FOLLOWUP_VALUE_ROWS = 1000   # rows of the previous result whose text values a follow-up may name
+# Explicit refinements of the previous answer ("now only show Germany", "sort by revenue", "top 3 of these")
+FOLLOWUP_REFINEMENTS = re.compile(r"\b(only|filter|exclude|excluding|except|remove|keep|sort|sorted|order by|ascending|"
+                                  r"descending|reverse|top \d+ of (these|those|them|it))\b", re.I)
+# Words pointing back at it ("split that by year", "the same for 2023"): only with a column or value of the result
+FOLLOWUP_REFERENCES = re.compile(r"\b(it|that|those|these|them|same|above|previous|instead|just|without)\b", re.I)
+
+
+class ResultWorkspace:
+    """Last result of a chat session, registered in an in-process DuckDB for follow-up questions.
+
+    Refinements of the previous answer (filter, sort, top N, re-aggregation) are answered with SQL
+    over the `previous_result` table in milliseconds instead of a new warehouse query. The SQL is
+    model-written, so only a single SELECT over that table runs, on a connection without file or
+    network access.
+    """
+
+    def __init__(self):
+        self.con = duckdb.connect(config={"enable_external_access": False})
+        self.df = None
+        self.clear()
+
+    def set(self, dataset, df, query, chart, local=False):
+        """Register the result just shown. `query` is the Snowflake query, or the DuckDB one when `local`."""
+        if local:
+            self.steps.append(query)
+        else:
+            self.source_query, self.steps = query, []
+        self.dataset = dataset
+        self.df = df
+        self.chart = chart  # chart spec dict of the answer
+        self.truncated = bool(df.attrs.get("truncated"))
+        self.words = None
+        self.con.register(FOLLOWUP_TABLE, df)
+
+    def clear(self):
+        if self.df is not None:
+            self.con.unregister(FOLLOWUP_TABLE)
+        self.dataset = None
+        self.df = None
+        self.source_query = None
+        self.steps = []
+        self.chart = None
+        self.truncated = False
+        self.words = None
+
+    def is_followup(self, dataset, question):
+        """Cheap check before any model call: a complete previous result of this dataset and a
+        question that explicitly refines it, or points back at it and names one of its columns or values.
+
+        A false positive costs a follow-up model call and skips the answer cache, so a bare "it"
+        ("What is it?") or a temporal "now" is not enough.
+        """
+        if self.df is None or self.dataset != dataset or self.truncated:
+            return False
+        if FOLLOWUP_REFINEMENTS.search(question):
+            return True
+        return bool(FOLLOWUP_REFERENCES.search(question) and set(re.findall(r"\w+", question.upper())) & self.result_words())
+
+    def result_words(self):
+        """Words of the column names and text values of the previous result (3+ letters, no filler words)."""
+        if self.words is None:
+            names = [str(c) for c in self.df.columns]
+            values = [v for c in self.df.select_dtypes(include=["object", "string"]).columns
+                      for v in self.df[c].head(FOLLOWUP_VALUE_ROWS).dropna().unique() if isinstance(v, str)]
+            words = {w for text in names + values for w in re.findall(r"[A-Za-z0-9]+", text.upper())}
+            self.words = {w for w in words if len(w) >= 3 and w.lower() not in FILLER_WORDS}
+        return self.words
+
+    def describe(self):
+        """Columns, types, first rows and origin of the previous result, for the follow-up agent."""
+        columns = self.con.execute(f"DESCRIBE {FOLLOWUP_TABLE}").fetchall()
+        return (f"Table {FOLLOWUP_TABLE} ({len(self.df):,} rows):\n"
+                + "\n".join(f"- {name} {data_type}" for name, data_type, *_ in columns)
+                + f"\nFirst rows:\n{self.df.head(FOLLOWUP_SAMPLE_ROWS).to_csv(index=False)}{self.origin()}")
+
+    def origin(self):
+        """How the previous result was produced, for a follow-up that goes back to the warehouse."""
+        refined = "".join(f"\nthen refined locally (DuckDB) with:\n{step}" for step in self.steps)
+        return f"It was produced by this Snowflake query:\n{self.source_query}{refined}"
+
+    def errors(self, sql):
+        """Reasons the SQL can't run locally: not a single SELECT, or tables other than the previous result."""
+        try:
+            statements = sqlglot.parse(sql.strip().rstrip(";"), read="duckdb")
+        except ParseError as e:
+            return [f"Parse error: {e}"]
+        if len(statements) != 1 or not isinstance(statements[0], READ_ONLY_STATEMENTS):
+            return ["Only a single SELECT statement can run on the previous result."]
+        ctes = {cte.alias_or_name.lower() for cte in statements[0].find_all(exp.CTE)}
+        # Table functions (read_csv(...)) have no name
+        tables = {t.name.lower() or t.sql("duckdb") for t in statements[0].find_all(exp.Table)} - ctes - {FOLLOWUP_TABLE}
+        if tables:
+            return [f"Tables not in the previous result: {', '.join(sorted(tables))}"]
+        return []
+
+    def run(self, sql):
+        """(DataFrame, None) of the SQL over the previous result, or (None, error)."""
+        errors = self.errors(sql)
+        if errors:
+            return None, "; ".join(errors)
+        try:
+            return self.con.execute(sql.strip().rstrip(";")).df(), None
+        except duckdb.Error as e:
+            return None, str(e)
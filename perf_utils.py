@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from datetime import datetime
+from contextlib import contextmanager
+from cache_utils import CACHE_DIR
+
+# --------------- REQUEST TRACES --------------- #
+
+TRACE_PATH = os.path.join(CACHE_DIR, "traces.jsonl")
+
+_current = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """Timed spans of one user request, appended as a single JSON line once finished."""
+
+    def __init__(self, **attrs):
+        self.request_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.attrs = attrs
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, **attrs):
+        """Record a span that just ended; `end` is its offset in seconds from the start of the request."""
+        record = {"stage": stage, "seconds": round(seconds, 4), "end": round(time.time() - self.started_at, 4), **attrs}
+        with self._lock:
+            self.spans.append(record)
+        return record
+
+    def to_json(self):
+        with self._lock:
+            spans = list(self.spans)
+        return json.dumps({"request_id": self.request_id, "ts": self.started_at, **self.attrs, "spans": spans}, default=str)
+
+
+def start_trace(**attrs):
+    """Make a new trace current for this thread / task (copied into asyncio.to_thread workers)."""
+    trace = RequestTrace(**attrs)
+    _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Time a block into the current trace (no-op without one). Yields a dict for extra attributes."""
+    extra = dict(attrs)
+    start = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        trace = _current.get()
+        if trace is not None:
+            trace.add(stage, time.perf_counter() - start, **extra)
+
+
+def write_trace(trace, path=TRACE_PATH, enrich=None):
+    """Append the trace to the JSONL sink from a background thread.
+
+    `enrich(trace)` runs first in that thread, e.g. to look up warehouse statistics
+    that only become available a few seconds after the query.
+    """
+    def write():
+        if enrich is not None:
+            try:
+                enrich(trace)
+            except Exception as e:
+                print("❌ Trace enrichment error:", e)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        line = trace.to_json()
+        with _write_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            _writers.discard(threading.current_thread())
+
+    writer = threading.Thread(target=write, daemon=True)
+    with _write_lock:
+        _writers.add(writer)
+    writer.start()
+
+
+def flush_traces(timeout=30):
+    """Wait for the pending trace writes, e.g. before a script exits."""
+    with _write_lock:
+        writers = list(_writers)
+    for writer in writers:
+        writer.join(timeout)
+
+
+_write_lock = threading.Lock()
+_writers = set()
+
+
+def read_traces(path=TRACE_PATH, limit=500):
+    """Last `limit` traces of the sink."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()[-limit:]
+    traces = []
+    for line in lines:
+        try:
+            traces.append(json.loads(line))
+        except ValueError:
+            continue
+    return traces
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def stage_percentiles(traces):
+    """{stage: {"count", "p50", "p95"}} over every span of the traces (seconds, summed per request)."""
+    per_stage = {}
+    for trace in traces:
+        totals = {}
+        for s in trace.get("spans", []):
+            totals[s["stage"]] = totals.get(s["stage"], 0) + s["seconds"]
+        for stage, seconds in totals.items():
+            per_stage.setdefault(stage, []).append(seconds)
+    return {stage: {"count": len(v), "p50": percentile(v, 0.5), "p95": percentile(v, 0.95)}
+            for stage, v in sorted(per_stage.items())}
+
+# --------------- AGENTS SDK SPANS --------------- #
+
+def _seconds(span):
+    if not span.started_at or not span.ended_at:
+        return 0.0
+    return (datetime.fromisoformat(span.ended_at) - datetime.fromisoformat(span.started_at)).total_seconds()
+
+
+class AgentSpanRecorder:
+    """agents SDK TracingProcessor copying agent / tool spans (with token usage) into the current trace.
+
+    Span callbacks run synchronously in the code that starts/ends the span, so the
+    current RequestTrace is the one of the request being answered.
+    """
+
+    def __init__(self):
+        self._tokens = {}  # agent span id -> [input tokens, output tokens]
+        self._lock = threading.Lock()
+
+    def on_trace_start(self, trace):
+        pass
+
+    def on_trace_end(self, trace):
+        pass
+
+    def on_span_start(self, span):
+        if span.span_data.type == "agent":
+            with self._lock:
+                self._tokens[span.span_id] = [0, 0]
+
+    def on_span_end(self, span):
+        data = span.span_data
+        if data.type == "response":
+            usage = getattr(getattr(data, "response", None), "usage", None)
+            if usage is not None:
+                with self._lock:
+                    tokens = self._tokens.get(span.parent_id)
+                    if tokens is not None:
+                        tokens[0] += usage.input_tokens
+                        tokens[1] += usage.output_tokens
+            return
+        trace = _current.get()
+        if data.type == "agent":
+            with self._lock:
+                input_tokens, output_tokens = self._tokens.pop(span.span_id, (0, 0))
+            if trace is not None:
+                trace.add(f"agent:{data.name}", _seconds(span), input_tokens=input_tokens, output_tokens=output_tokens)
+        elif data.type == "function" and trace is not None:
+            trace.add(f"tool:{data.name}", _seconds(span))
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self):
+        pass
@@ -0,0 +1,302 @@
+"""Column profiles of the configured datasets: row counts, null fractions, value ranges,
+approximate distinct counts and most frequent values, stored in .cache/profiles.
+
+The app shows them to the agents next to the data dictionary (see render_column / SchemaIndex),
+so the model knows the date ranges and category spellings without probing the data first.
+Profiles are refreshed incrementally: a table is only profiled again once its LAST_ALTERED
+moved or its profile is older than the TTL.
+
+    python profile_utils.py                          # every dataset of config.yaml
+    python profile_utils.py TPC_H_BUSINESS_SAMPLE --force
+"""
+import os
+import json
+import time
+import argparse
+import datetime
+import threading
+from decimal import Decimal
+import streamlit as st
+from cache_utils import CACHE_DIR
+from perf_utils import span
+
+# --------------- PROFILING --------------- #
+
+PROFILE_TOP_K = 10              # most frequent values kept per text column
+PROFILE_SAMPLE_ROWS = 1_000_000 # tables larger than this get the approximate aggregates on a block sample
+PROFILE_TTL = 7 * 24 * 3600     # seconds before an unchanged table is profiled again
+PROFILE_CHECK_INTERVAL = 3600   # seconds between LAST_ALTERED checks from the app (in the background)
+
+RANGE_TYPES = ("NUMBER", "FLOAT", "DATE", "TIMESTAMP", "TIME")   # MIN / MAX (answered from metadata)
+VALUE_TYPES = ("TEXT", "BOOLEAN")                                # most frequent values
+
+PROFILE_TABLES_QUERY = """SELECT TABLE_NAME, TABLE_TYPE, TO_VARCHAR(LAST_ALTERED)
+FROM {database}.INFORMATION_SCHEMA."TABLES"
+WHERE TABLE_SCHEMA = '{schema}' AND TABLE_TYPE IN ('BASE TABLE', 'VIEW')"""
+
+
+def _plain(value):
+    """JSON-friendly version of a value returned by the connector."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _top_values(value):
+    """APPROX_TOP_K result as [[value, count]]: Snowflake returns JSON pairs, other engines a plain list."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return [[_plain(v[0]), v[1]] if isinstance(v, (list, tuple)) else [_plain(v), None] for v in value or []]
+
+
+def profile_table(pool, database, schema, table, columns, top_k=PROFILE_TOP_K, sample_rows=PROFILE_SAMPLE_ROWS, view=False):
+    """{"row_count", "sample_percent", "limited", "columns": {column: stats}} of one table or view.
+
+    `columns` is [(name, data_type)] from the data dictionary. For a table, counts and MIN / MAX
+    run on the whole table (Snowflake answers them from micro-partition metadata); distinct
+    counts and top values use APPROX_COUNT_DISTINCT / APPROX_TOP_K, on a block sample of large
+    tables. A view has no such metadata and can't be block sampled, so every statistic comes
+    from its first `sample_rows` rows (LIMIT stops the scan there): `limited` is then set and
+    `row_count` is only a lower bound.
+    """
+    name = f'{database}.{schema}."{table}"'
+    if view:
+        name = f"(SELECT * FROM {name} LIMIT {sample_rows})"
+    ranged = [c for c, t in columns if t.upper().startswith(RANGE_TYPES)]
+    valued = [c for c, t in columns if t.upper().startswith(VALUE_TYPES)]
+    profiled = [c for c, t in columns if t.upper().startswith(RANGE_TYPES + VALUE_TYPES)]
+
+    exact = ["COUNT(*)"] + [f'COUNT("{c}")' for c in profiled] + [f'MIN("{c}"), MAX("{c}")' for c in ranged]
+    with pool.cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(exact)} FROM {name}")
+        row = list(cursor.fetchone())
+    row_count = row.pop(0) or 0
+    limited = view and row_count >= sample_rows
+    stats = {c: {"nulls": round(1 - (row.pop(0) or 0) / row_count, 4) if row_count else 0.0} for c in profiled}
+    for c in ranged:
+        stats[c]["min"], stats[c]["max"] = _plain(row.pop(0)), _plain(row.pop(0))
+
+    sample_percent = None
+    if row_count > sample_rows:
+        sample_percent = max(0.01, round(100 * sample_rows / row_count, 4))
+    approx = ["COUNT(*)"] + [f'APPROX_COUNT_DISTINCT("{c}")' for c in profiled] + [f'APPROX_TOP_K("{c}", {top_k})' for c in valued]
+    if row_count and len(approx) > 1:
+        sample = f" SAMPLE SYSTEM ({sample_percent})" if sample_percent else ""
+        with pool.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(approx)} FROM {name}{sample}")
+            row = list(cursor.fetchone())
+        sampled = row.pop(0) or 0
+        for c in profiled:
+            distinct = min(row.pop(0) or 0, sampled)  # HyperLogLog can overshoot on small tables
+            # A sample only bounds the distinct count from below once most of it is distinct values
+            stats[c]["distinct"] = distinct if not (sample_percent or limited) or distinct < sampled / 2 else None
+        for c in valued:
+            stats[c]["top"] = _top_values(row.pop(0))
+    return {"row_count": row_count, "sample_percent": sample_percent, "limited": limited, "columns": stats}
+
+# --------------- PROFILE STORE --------------- #
+
+class SchemaProfile:
+    def __init__(self, database, schema, tables, checked_at):
+        self.database = database
+        self.schema = schema
+        self.tables = tables  # table -> {"row_count", "last_altered", "profiled_at", "sample_percent", "limited", "columns"}
+        self.checked_at = checked_at
+
+    def column(self, table, column):
+        return self.tables.get(table, {}).get("columns", {}).get(column)
+
+    def row_count(self, table):
+        return self.tables.get(table, {}).get("row_count")
+
+    def row_count_text(self, table):
+        """"1,500 rows", "1,000,000+ rows" for a view profiled on its first rows, or None."""
+        rows = self.row_count(table)
+        if rows is None:
+            return None
+        return f"{rows:,}{'+' if self.tables[table].get('limited') else ''} rows"
+
+
+class ProfileStore:
+    """SchemaProfile per (database, schema), in memory and on disk (.cache/profiles).
+
+    Reads never query Snowflake. `refresh` (offline CLI or, with `auto_refresh`, a background
+    thread of the app) lists the schema's tables and only profiles the new ones, those whose
+    LAST_ALTERED moved and those older than `ttl`; the file is rewritten after every table.
+    Views are only profiled by the CLI: they read data on the warehouse the app queries with.
+    """
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, "profiles"), ttl=PROFILE_TTL,
+                 check_interval=PROFILE_CHECK_INTERVAL, top_k=PROFILE_TOP_K, sample_rows=PROFILE_SAMPLE_ROWS,
+                 auto_refresh=True):
+        self.cache_dir = cache_dir
+        self.auto_refresh = auto_refresh
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.top_k = top_k
+        self.sample_rows = sample_rows
+        self._profiles = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def peek(self, database, schema):
+        """Profile from memory or disk, or None; never queries Snowflake."""
+        with self._lock:
+            profile = self._profiles.get((database, schema))
+        if profile is None:
+            profile = self._load(database, schema)
+            if profile is not None:
+                with self._lock:
+                    self._profiles[(database, schema)] = profile
+        return profile
+
+    def get(self, pool, dd):
+        """Current profile of the dictionary's schema (None until the first one is built).
+
+        With `auto_refresh`, profiles missing or not checked for `check_interval` seconds are
+        refreshed in the background (tables only).
+        """
+        profile = self.peek(dd.database, dd.schema)
+        if self.auto_refresh and (profile is None or time.time() - profile.checked_at > self.check_interval):
+            self._refresh_in_background(pool, dd)
+        return profile
+
+    def refresh(self, pool, dd, force=False, views=False):
+        """Profile the tables (and with `views`, the views) of the dictionary's schema that changed; returns the updated profile."""
+        database, schema = dd.database, dd.schema
+        previous = self.peek(database, schema)
+        tables = dict(previous.tables) if previous is not None else {}
+        columns = {}
+        for r in dd.df.to_dict(orient="records"):
+            columns.setdefault(r["TABLE_NAME"], []).append((r["COLUMN_NAME"], r.get("DATA_TYPE") or ""))
+
+        with pool.cursor() as cursor:
+            cursor.execute(PROFILE_TABLES_QUERY.format(database=database, schema=schema))
+            listed = {table: (table_type, last_altered) for table, table_type, last_altered in cursor.fetchall()}
+        tables = {t: p for t, p in tables.items() if t in listed}
+        profile = SchemaProfile(database, schema, tables, time.time())
+        for table, (table_type, last_altered) in sorted(listed.items()):
+            known = tables.get(table)
+            if not force and known is not None and known["last_altered"] == last_altered \
+                    and time.time() - known["profiled_at"] < self.ttl:
+                continue
+            if table not in columns or (table_type == "VIEW" and not views):
+                continue
+            try:
+                with span("table_profile", table=table):
+                    stats = profile_table(pool, database, schema, table, columns[table], self.top_k, self.sample_rows,
+                                          view=table_type == "VIEW")
+            except Exception as e:
+                print(f"❌ Profile error ({table}):", e)
+                continue
+            tables[table] = {**stats, "last_altered": last_altered, "profiled_at": time.time()}
+            self._save(profile)
+        profile.checked_at = time.time()
+        self._save(profile)
+        with self._lock:
+            self._profiles[(database, schema)] = profile
+        return profile
+
+    def _refresh_in_background(self, pool, dd):
+        key = (dd.database, dd.schema)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.refresh(pool, dd)
+            except Exception as e:
+                print("❌ Profile refresh error:", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _path(self, database, schema):
+        return os.path.join(self.cache_dir, f"{database}__{schema}.json")
+
+    def _save(self, profile):
+        path = self._path(profile.database, profile.schema)
+        try:
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  # other app processes may save at once
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"tables": profile.tables, "checked_at": profile.checked_at}, f, default=str)
+            os.replace(tmp, path)
+        except Exception as e:
+            print("❌ Profile cache write error:", e)
+
+    def _load(self, database, schema):
+        path = self._path(database, schema)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print("❌ Profile cache read error:", e)
+            return None
+        return SchemaProfile(database, schema, data["tables"], data["checked_at"])
+
+
+@st.cache_resource
+def get_profile_store(top_k=PROFILE_TOP_K, sample_rows=PROFILE_SAMPLE_ROWS, ttl=PROFILE_TTL, auto_refresh=True):
+    return ProfileStore(ttl=ttl, top_k=top_k, sample_rows=sample_rows, auto_refresh=auto_refresh)
+
+# --------------- PROMPT SUMMARY --------------- #
+
+PROFILE_MAX_VALUES = 10         # categorical columns with at most this many distinct values list them all
+PROFILE_VALUE_CHARS = 40        # longer values are cut in the summary
+
+
+def _short(value):
+    value = str(value)
+    return value if len(value) <= PROFILE_VALUE_CHARS else value[:PROFILE_VALUE_CHARS] + "…"
+
+
+def render_column(stats):
+    """Compact profile of a column for the prompt, e.g. "1992-01-01..1998-08-02" or "values: A, B"."""
+    if not stats:
+        return ""
+    parts = []
+    if stats.get("min") is not None:
+        parts.append(f"{_short(stats['min'])}..{_short(stats['max'])}")
+    top = [v for v, _ in stats.get("top") or [] if v is not None]
+    distinct = stats.get("distinct")
+    if top and distinct is not None and distinct <= PROFILE_MAX_VALUES:
+        parts.append("values: " + ", ".join(_short(v) for v in top))
+    elif top:
+        parts.append(f"{f'~{distinct:,} distinct, ' if distinct else ''}e.g. {_short(top[0])}")
+    if stats.get("nulls"):
+        parts.append(f"{stats['nulls']:.0%} null")
+    return "; ".join(parts)
+
+
+def main():
+    from st_utils import load_config
+    from sf_utils import get_connection_pool, load_data_dictionary
+    config = load_config()
+    parser = argparse.ArgumentParser(description="Profile the tables of the configured datasets.")
+    parser.add_argument("datasets", nargs="*", help="datasets of config.yaml (default: all)")
+    parser.add_argument("--force", action="store_true", help="profile every table again, changed or not")
+    parser.add_argument("--no-views", action="store_true", help="profile base tables only")
+    args = parser.parse_args()
+
+    settings = config["profiles"]
+    store = get_profile_store(settings["top_k"], settings["sample_rows"], settings["ttl_days"] * 24 * 3600)
+    for name in args.datasets or list(config["sf_datasets"]):
+        dataset = config["sf_datasets"][name]
+        pool = get_connection_pool(dataset["database"])
+        dd = load_data_dictionary(pool, dataset["database"], dataset["schema"])
+        start = time.perf_counter()
+        profile = store.refresh(pool, dd, args.force, not args.no_views)
+        print(f"{name}: {len(profile.tables)} tables profiled in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import math
+import re
+from collections import Counter, defaultdict
+from profile_utils import render_column
+
+# --------------- SCHEMA INDEX --------------- #
+
+TOP_K_TABLES = 5
+TOP_K_COLUMNS = 12
+MIN_COLUMNS = 3  # leading columns always kept per table (usually ids / dates)
+PRIMARY_SCORE_RATIO = 0.25  # tables scoring below this fraction of the best one only fill leftover slots
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+EXPANSION_WEIGHT = 0.5  # weight of vocabulary terms reached through a prefix / synonym match
+
+# Business vocabulary -> column vocabulary; extended by `schema_index.synonyms` in config.yaml
+SYNONYMS = {
+    "country": ["nation"],
+    "sale": ["price", "revenue", "amount"],
+    "revenue": ["price", "sale", "amount"],
+    "time": ["date", "hour", "day"],
+    "volume": ["quantity", "count"],
+    "delivery": ["ship", "receipt", "commit"],
+    "delay": ["date"],
+    "weather": ["temperature", "precipitation", "wind"],
+}
+
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "and", "or", "is", "are", "was", "were",
+    "what", "which", "who", "how", "do", "does", "i", "my", "me", "we", "our", "most", "top", "show",
+    "give", "list", "per", "with", "from", "that", "this", "it", "be", "have", "has", "vary", "over",
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens with a naive plural stem; splits on underscores too."""
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", str(text or "").lower().replace("_", " ")):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def _key_suffix(column_name):
+    """TPC-H style prefixed keys share a suffix across tables (C_CUSTKEY / O_CUSTKEY)."""
+    return column_name.split("_", 1)[1] if "_" in column_name else column_name
+
+
+class SchemaColumn:
+    def __init__(self, schema, table, name, data_type, comment, position):
+        self.schema = schema
+        self.table = table
+        self.name = name
+        self.data_type = data_type
+        self.comment = comment
+        self.position = position
+
+
+class SchemaIndex:
+    """Offline BM25 index over a data dictionary (INFORMATION_SCHEMA.COLUMNS rows).
+
+    Each column is a document made of its table name, column name and comment.
+    A question selects the top-K tables (by the sum of their best column
+    scores), the best-scoring columns of each, and any key columns shared
+    between the selected tables so the model can still write the joins.
+    """
+
+    def __init__(self, records, synonyms=None):
+        self.synonyms = {**SYNONYMS, **(synonyms or {})}
+        self.columns = []
+        for r in records:
+            self.columns.append(SchemaColumn(
+                schema=r["TABLE_SCHEMA"],
+                table=r["TABLE_NAME"],
+                name=r["COLUMN_NAME"],
+                data_type=r.get("DATA_TYPE") or "",
+                comment=r.get("COMMENT") or "",
+                position=int(r.get("ORDINAL_POSITION") or 0),
+            ))
+        self.tables = defaultdict(list)
+        for col in self.columns:
+            self.tables[col.table].append(col)
+
+        self._docs = [Counter(tokenize(c.table) + tokenize(c.name) * 2 + tokenize(c.comment)) for c in self.columns]
+        self._doc_len = [sum(d.values()) for d in self._docs]
+        self._avg_len = (sum(self._doc_len) / len(self._docs)) if self._docs else 0
+        df = Counter()
+        for d in self._docs:
+            df.update(d.keys())
+        n = len(self._docs)
+        self._idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    @classmethod
+    def from_dataframe(cls, dd_df, synonyms=None):
+        return cls(dd_df.to_dict(orient="records"), synonyms)
+
+    def _expand(self, term):
+        """Map a question term onto index terms: exact, synonyms, and shared-prefix / substring
+        matches so that 'customer' reaches C_CUSTKEY and 'segment' reaches C_MKTSEGMENT."""
+        weights = {}
+        if term in self._idf:
+            weights[term] = 1.0
+        candidates = [term] + [t for syn in self.synonyms.get(term, []) for t in tokenize(syn)]
+        for cand in candidates:
+            if len(cand) < 4:
+                continue
+            for v in self._idf:
+                if v != term and (cand in v or (len(v) >= 4 and v in cand) or v[:4] == cand[:4]):
+                    weights.setdefault(v, EXPANSION_WEIGHT)
+        return weights
+
+    def score(self, question):
+        weights = Counter()
+        for t in tokenize(question):
+            for v, w in self._expand(t).items():
+                weights[v] = max(weights[v], w)
+        scores = []
+        for doc, length in zip(self._docs, self._doc_len):
+            s = 0.0
+            for t, w in weights.items():
+                tf = doc.get(t)
+                if not tf:
+                    continue
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / self._avg_len))
+                s += w * self._idf[t] * norm
+            scores.append(s)
+        return scores
+
+    def select(self, question, top_k_tables=TOP_K_TABLES, top_k_columns=TOP_K_COLUMNS):
+        """Return {table: [SchemaColumn]} relevant to the question, or None when nothing matched."""
+        scores = self.score(question)
+        by_table = defaultdict(list)
+        for col, s in zip(self.columns, scores):
+            by_table[col.table].append((s, col))
+
+        table_scores = {}
+        for table, scored in by_table.items():
+            best = sorted((s for s, _ in scored), reverse=True)[:top_k_columns]
+            table_scores[table] = sum(best)
+        ranked = [t for t in sorted(table_scores, key=table_scores.get, reverse=True) if table_scores[t] > 0]
+        if not ranked:
+            return None
+        best = table_scores[ranked[0]]
+        tables = [t for t in ranked if table_scores[t] >= PRIMARY_SCORE_RATIO * best][:top_k_tables]
+        # Fill the remaining slots with tables joinable to the matched ones (e.g. ORDERS for CUSTOMER)
+        # so aggregate questions still see the path between them, then with weaker matches.
+        for table in self._neighbours(tables) + ranked:
+            if len(tables) >= top_k_tables:
+                break
+            if table not in tables:
+                tables.append(table)
+
+        suffixes = defaultdict(set)
+        for table in tables:
+            for col in self.tables[table]:
+                suffixes[_key_suffix(col.name)].add(table)
+        join_suffixes = {s for s, ts in suffixes.items() if len(ts) > 1}
+
+        selected = {}
+        for table in tables:
+            scored = sorted(by_table[table], key=lambda x: x[0], reverse=True)
+            keep = {c.name for s, c in scored[:top_k_columns] if s > 0}
+            keep |= {c.name for c in self.tables[table] if c.position <= MIN_COLUMNS}
+            keep |= {c.name for c in self.tables[table] if _key_suffix(c.name) in join_suffixes}
+            selected[table] = [c for c in self.tables[table] if c.name in keep]
+        return selected
+
+    def _neighbours(self, tables):
+        keys = {_key_suffix(c.name) for t in tables for c in self.tables[t] if c.name.endswith(("KEY", "_ID"))}
+        shared = Counter()
+        for table, cols in self.tables.items():
+            if table not in tables:
+                shared[table] = len(keys & {_key_suffix(c.name) for c in cols})
+        return [t for t, n in shared.most_common() if n > 0]
+
+    def render(self, selected, profile=None):
+        """One line per column; with a SchemaProfile, row counts and value ranges / frequent values in [ ]."""
+        lines = []
+        for table, cols in selected.items():
+            rows = profile.row_count_text(table) if profile is not None else None
+            lines.append(f"Table {cols[0].schema}.{table}" + (f" ({rows}):" if rows is not None else ":"))
+            for c in cols:
+                comment = f" -- {c.comment}" if c.comment else ""
+                hint = render_column(profile.column(table, c.name)) if profile is not None else ""
+                lines.append(f"- {c.name} {c.data_type}{comment}" + (f" [{hint}]" if hint else ""))
+        return "\n".join(lines)
+
+    def context_for(self, question, top_k_tables=TOP_K_TABLES, top_k_columns=TOP_K_COLUMNS, profile=None):
+        """Compact data dictionary for the question; falls back to every table when nothing matches."""
+        selected = self.select(question, top_k_tables, top_k_columns)
+        if selected is None:
+            selected = dict(self.tables)
+        return self.render(selected, profile)
+
+
+def estimate_tokens(text):
+    """Token count with tiktoken when installed, otherwise the ~4 chars/token rule of thumb."""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except ImportError:
+        return math.ceil(len(text) / 4)
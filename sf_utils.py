@@ -0,0 +1,676 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import streamlit as st
+from cache_utils import CACHE_DIR, RESULT_CACHE_TTL, sql_cache_key
+from sql_utils import add_row_limit
+from perf_utils import span, current_trace
+
+# --------------- CONNECTION POOL --------------- #
+
+POOL_MAX_SIZE = 4               # max open connections per database
+POOL_IDLE_TIMEOUT = 15 * 60     # seconds before an unused connection is closed
+POOL_HEALTH_CHECK_AFTER = 60    # seconds idle before a connection is pinged on checkout
+POOL_CHECKOUT_TIMEOUT = 30      # seconds to wait for a free connection when the pool is full
+
+
+class SnowflakeConnectionPool:
+    """Thread-safe pool of Snowflake connections for a single database.
+
+    Connections are handed out one at a time, pinged before reuse when they
+    have been idle for a while, and closed once they sit unused longer than
+    `idle_timeout`. At most `max_size` connections are open at once.
+    """
+
+    def __init__(self, connect, database=None, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER, checkout_timeout=POOL_CHECKOUT_TIMEOUT):
+        self._connect = connect
+        self.database = database
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self._idle = []  # [(connection, last_used)], most recently used last
+        self._open = 0
+        self._lock = threading.Condition()
+
+    def _evict_idle(self, now):
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                self._close(conn)
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def _close(self, conn):
+        self._open -= 1
+        try:
+            conn.close()
+        except Exception as e:
+            print("❌ Snowflake close error:", e)
+
+    def _is_healthy(self, conn, last_used, now):
+        if conn.is_closed():
+            return False
+        if now - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    conn, last_used = None, now
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise TimeoutError(f"No Snowflake connection available after {self.checkout_timeout}s")
+                self._lock.wait(remaining)
+
+        if conn is not None and self._is_healthy(conn, last_used, now):
+            return conn
+        if conn is not None:
+            with self._lock:
+                self._close(conn)
+                self._open += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, conn):
+        with self._lock:
+            if conn.is_closed():
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def cursor(self):
+        """Borrow a connection and yield a fresh cursor on it."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def close_all(self):
+        with self._lock:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+
+@st.cache_resource
+def get_connection_pool(database, max_size=POOL_MAX_SIZE, statement_timeout=None):
+    """One pool per database, shared by every session of the app process.
+
+    `statement_timeout` (seconds) is set on every session, so Snowflake itself cancels
+    a runaway statement, asynchronous ones included.
+    """
+    session_parameters = {"STATEMENT_TIMEOUT_IN_SECONDS": int(statement_timeout)} if statement_timeout else None
+    def connect():
+        import snowflake.connector  # imported on the first connection, not at app start
+        return snowflake.connector.connect(
+            user=st.secrets["SNOWFLAKE_USER"],
+            password=st.secrets["SNOWFLAKE_PASSWORD"],
+            account=st.secrets["SNOWFLAKE_ACCOUNT"],
+            warehouse=st.secrets["SNOWFLAKE_WAREHOUSE"],
+            database=database,
+            client_session_keep_alive=True,
+            session_parameters=session_parameters,
+        )
+    return SnowflakeConnectionPool(connect, database, max_size)
+
+# --------------- QUERIES --------------- #
+
+FETCH_MAX_ROWS = 200_000
+FETCH_MAX_BYTES = 256 * 1024 ** 2
+
+
+NUMERIC_FIELD_TYPES = {"FIXED", "REAL", "DECFLOAT"}
+
+
+def normalize_dtypes(df, description):
+    """Cast NUMBER/DECIMAL columns that arrive as Decimal objects to native numeric dtypes.
+
+    Driven by the cursor's result metadata rather than by inspecting values, so empty
+    frames and columns starting with NULL are handled. Integers (scale 0) that fit into
+    int64 become nullable Int64, everything else float64.
+    """
+    from snowflake.connector.constants import FIELD_ID_TO_NAME
+    for meta in description or []:
+        if meta.name not in df.columns or df[meta.name].dtype != object:
+            continue
+        if FIELD_ID_TO_NAME.get(meta.type_code) not in NUMERIC_FIELD_TYPES:
+            continue
+        if meta.scale == 0 and meta.precision is not None and meta.precision <= 18:
+            # Straight from the Decimal values: through float64 integers above 2**53 would lose digits
+            df[meta.name] = pd.array([None if pd.isna(v) else int(v) for v in df[meta.name]], dtype="Int64")
+        else:
+            df[meta.name] = pd.to_numeric(df[meta.name], errors="coerce").astype("float64")
+    return df
+
+
+def fetch_pandas_limited(cursor, max_rows=None, max_bytes=None, on_batch=None):
+    """Fetch an executed cursor batch by batch, stopping once `max_rows` / `max_bytes` is reached.
+
+    The batch that reaches a budget is cut so the frame stays within both of them.
+    `on_batch` is called with every batch as it arrives so the caller can render progressively.
+    Batches are type-normalized (normalize_dtypes) before anything sees them. The returned
+    frame has `attrs["truncated"]` set when rows were left on the server, and the Snowflake
+    `attrs["query_id"]` whose full result RESULT_SCAN can read back (see export_utils).
+    """
+    max_rows = max_rows or FETCH_MAX_ROWS
+    max_bytes = max_bytes or FETCH_MAX_BYTES
+    batches, rows, size = [], 0, 0
+    for batch in cursor.fetch_pandas_batches():
+        batch = normalize_dtypes(batch, cursor.description)
+        if rows + len(batch) > max_rows:
+            batch = batch.iloc[:max_rows - rows]
+        batch_bytes = int(batch.memory_usage(deep=True).sum())
+        over_budget = size + batch_bytes >= max_bytes
+        while size + batch_bytes > max_bytes and len(batch):
+            # Only the rows that fit the remaining byte budget, cut at the batch's average row size
+            batch = batch.iloc[:int((max_bytes - size) * len(batch) / batch_bytes)]
+            batch_bytes = int(batch.memory_usage(deep=True).sum())
+        batches.append(batch)
+        rows += len(batch)
+        size += batch_bytes
+        if on_batch is not None and len(batch):
+            on_batch(batch)
+        if rows >= max_rows or over_budget:
+            # Closing the cursor afterwards stops the connector from downloading the remaining chunks
+            break
+    if batches:
+        df = pd.concat(batches, ignore_index=True)
+    else:
+        df = normalize_dtypes(cursor.fetch_pandas_all(), cursor.description)
+    total = cursor.rowcount
+    df.attrs["truncated"] = total is not None and total > rows
+    df.attrs["total_rows"] = total
+    df.attrs["query_id"] = cursor.sfqid
+    return df
+
+class QueryPrefetcher:
+    """Starts the full version of a probed query asynchronously (execute_async) so it runs in the
+    warehouse while the remaining agents work, then collects the result by query ID instead of
+    executing the same SQL a second time. One query runs at a time: starting another version
+    cancels the previous one, which the agent has moved on from."""
+
+    def __init__(self, pool, tracker=None):
+        self.pool = pool
+        self.tracker = tracker
+        self._pending = {}  # sql_cache_key -> query id (at most one)
+        self._lock = threading.Lock()
+
+    def start(self, query):
+        key = sql_cache_key(self.pool.database, query)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute_async(query)
+                query_id = cursor.sfqid
+        except Exception as e:
+            print("❌ Snowflake prefetch error:", e)
+            return None
+        with self._lock:
+            abandoned, self._pending = list(self._pending.values()), {key: query_id}
+        if self.tracker is not None:
+            self.tracker.add(self.pool, query_id)
+        self._cancel(abandoned)
+        return query_id
+
+    def fetch(self, query, max_rows=None, max_bytes=None, on_batch=None):
+        """Result of a prefetched query (waits for it to finish), or None if it was never started."""
+        key = sql_cache_key(self.pool.database, query)
+        with self._lock:
+            query_id = self._pending.pop(key, None)
+        if query_id is None:
+            return None
+        try:
+            with self.pool.cursor() as cursor, span("snowflake_fetch", query_id=query_id, prefetched=True) as attrs:
+                cursor.get_results_from_sfqid(query_id)
+                df = fetch_pandas_limited(cursor, max_rows, max_bytes, on_batch)
+                attrs["rows"] = len(df)
+                return df
+        except Exception as e:
+            print("❌ Snowflake prefetch error:", e)
+            return None
+        finally:
+            if self.tracker is not None:
+                self.tracker.discard(query_id)
+
+    def cancel_all(self):
+        """Cancel prefetched queries the agent abandoned (e.g. after a retry with different SQL)."""
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        self._cancel(pending)
+
+    def _cancel(self, query_ids):
+        for query_id in query_ids:
+            cancel_query(self.pool, query_id)
+            if self.tracker is not None:
+                self.tracker.discard(query_id)
+
+
+def cancel_query(pool, query_id):
+    try:
+        with pool.cursor() as cursor:
+            cursor.execute(f"SELECT SYSTEM$CANCEL_QUERY('{query_id}')")
+    except Exception as e:
+        print("❌ Snowflake cancel error:", e)
+
+
+class QueryTracker:
+    """Snowflake queries of one session (or request) that may still be running.
+
+    Queries are registered by ID when submitted and dropped once their result is in, so
+    whatever is left behind by an interrupted run (new prompt, cleared history) can be
+    cancelled instead of keeping the warehouse busy until the statement timeout.
+    """
+
+    def __init__(self):
+        self._running = {}  # query id -> pool
+        self._lock = threading.Lock()
+
+    def add(self, pool, query_id):
+        with self._lock:
+            self._running[query_id] = pool
+
+    def discard(self, query_id):
+        with self._lock:
+            self._running.pop(query_id, None)
+
+    def cancel(self, query_id):
+        with self._lock:
+            pool = self._running.pop(query_id, None)
+        if pool is not None:
+            cancel_query(pool, query_id)
+
+    def cancel_all(self):
+        """Cancel every query still registered; returns how many there were."""
+        with self._lock:
+            running, self._running = self._running, {}
+        for query_id, pool in running.items():
+            cancel_query(pool, query_id)
+        return len(running)
+
+
+QUERY_POLL_MIN = 0.05   # seconds between the first status checks of a tracked query
+QUERY_POLL_MAX = 0.5    # ... growing up to this for long-running ones
+
+
+def execute_tracked(pool, cursor, query, tracker=None, on_wait=None):
+    """Execute the query on the cursor, registered in `tracker` by query ID while it runs.
+
+    Without a tracker this is a plain cursor.execute. With one the query is submitted
+    asynchronously and polled; `on_wait(seconds)` is called between polls. In the app it
+    updates the UI, which is also where Streamlit interrupts a run the user replaced by a
+    new prompt: the query is then cancelled right away instead of running to completion.
+    """
+    if tracker is None:
+        cursor.execute(query)
+        return
+    cursor.execute_async(query)
+    query_id = cursor.sfqid
+    tracker.add(pool, query_id)
+    try:
+        start, interval = time.monotonic(), QUERY_POLL_MIN
+        connection = cursor.connection
+        while connection.is_still_running(connection.get_query_status_throw_if_error(query_id)):
+            if on_wait is not None:
+                on_wait(time.monotonic() - start)
+            time.sleep(interval)
+            interval = min(interval * 1.5, QUERY_POLL_MAX)
+        cursor.get_results_from_sfqid(query_id)
+    except Exception:
+        tracker.discard(query_id)   # failed in the warehouse, nothing left to cancel
+        raise
+    except BaseException:
+        tracker.cancel(query_id)    # interrupted (Streamlit rerun / stop)
+        raise
+    tracker.discard(query_id)
+
+
+QUERY_STATS_QUERY = """SELECT QUERY_ID, BYTES_SCANNED, ROWS_PRODUCED
+FROM TABLE({database}.INFORMATION_SCHEMA.QUERY_HISTORY(RESULT_LIMIT => 1000))
+WHERE QUERY_ID IN ({ids})"""
+
+
+def add_query_stats(pool, trace):
+    """Add BYTES_SCANNED / ROWS_PRODUCED from QUERY_HISTORY to the trace's Snowflake spans.
+
+    Meant to run just before the trace is written (perf_utils.write_trace enrich hook),
+    off the request path: the statistics only show up once the query is finished.
+    """
+    spans = [s for s in trace.spans if s.get("query_id")]
+    if not spans:
+        return
+    ids = ", ".join(sorted({f"'{s['query_id']}'" for s in spans}))
+    with pool.cursor() as cursor:
+        cursor.execute(QUERY_STATS_QUERY.format(database=pool.database, ids=ids))
+        stats = {query_id: (scanned, produced) for query_id, scanned, produced in cursor.fetchall()}
+    for s in spans:
+        if s["query_id"] in stats:
+            s["bytes_scanned"], s["rows_produced"] = stats[s["query_id"]]
+
+
+def query_sf(pool, query, result_cache=None, ttl=RESULT_CACHE_TTL, prefetcher=None,
+             max_rows=None, max_bytes=None, on_batch=None, tracker=None, on_wait=None):
+    """Run a query on a pooled connection. Identical SQL is served from the result cache when one
+    is given, and a query already started by the prefetcher is collected rather than re-run.
+    Results are fetched in batches within the row / byte budget (see fetch_pandas_limited).
+    With a tracker the query can be cancelled while it runs (see execute_tracked). A query that
+    fails (error, statement timeout, cancellation) returns an empty frame with `attrs["error"]`."""
+    if result_cache is not None:
+        df = result_cache.get(pool.database, query, ttl)
+        if df is not None:
+            if prefetcher is not None:
+                prefetcher.cancel_all()
+            current = current_trace()
+            if current is not None:
+                current.add("snowflake_fetch", 0.0, cached=True, rows=len(df))
+            return df
+    if prefetcher is not None:
+        df = prefetcher.fetch(query, max_rows, max_bytes, on_batch)
+        prefetcher.cancel_all()
+        if df is not None:
+            if result_cache is not None and not df.attrs.get("truncated"):
+                result_cache.put(pool.database, query, df)
+            return df
+    with pool.cursor() as cursor:
+        with span("snowflake_execute") as attrs:
+            try:
+                execute_tracked(pool, cursor, query, tracker, on_wait)
+            except Exception as e:
+                st.error(f"❌ Snowflake error:\n{e}")
+                print("❌ Snowflake error:", e)
+                print(query)
+                attrs.update(error=str(e), query_id=cursor.sfqid)
+                # Nothing to fetch from the failed cursor, nor to cache
+                df = pd.DataFrame()
+                df.attrs["error"] = str(e)
+                return df
+            attrs["query_id"] = cursor.sfqid
+        with span("snowflake_fetch", query_id=cursor.sfqid) as attrs:
+            df = fetch_pandas_limited(cursor, max_rows, max_bytes, on_batch)
+            attrs["rows"] = len(df)
+    if result_cache is not None and not df.attrs.get("truncated"):
+        result_cache.put(pool.database, query, df)
+    return df
+
+# --------------- COST GUARD --------------- #
+
+class QueryEstimate:
+    """Compile-time cost of a query from EXPLAIN USING JSON (no warehouse needed)."""
+
+    def __init__(self, partitions_total, partitions_assigned, bytes_assigned, cartesian):
+        self.partitions_total = partitions_total
+        self.partitions_assigned = partitions_assigned
+        self.bytes_assigned = bytes_assigned
+        self.cartesian = cartesian  # the plan joins without a join condition
+
+
+def estimate_query(pool, query):
+    with pool.cursor() as cursor:
+        cursor.execute(f"EXPLAIN USING JSON {query.strip().rstrip(';')}")
+        plan = json.loads(cursor.fetchone()[0])
+    stats = plan.get("GlobalStats", {})
+    operations = [op for step in plan.get("Operations", []) for op in step]
+    return QueryEstimate(stats.get("partitionsTotal", 0), stats.get("partitionsAssigned", 0),
+                         stats.get("bytesAssigned", 0), any(op.get("operation") == "CartesianJoin" for op in operations))
+
+
+class CostGuard:
+    """Checks a query's EXPLAIN estimate against the dataset's budget before it runs.
+
+    Queries within `max_scan_gb` / `max_partitions` run unchanged. Above it, a row-level
+    query gets a LIMIT of `auto_limit` rows (Snowflake stops scanning once it has them);
+    anything else, and every cartesian join, is rejected with a reason the agents can
+    act on (filter, aggregate, add the join condition).
+    """
+
+    def __init__(self, max_scan_gb=None, max_partitions=None, auto_limit=10_000, reject_cartesian=True):
+        self.max_bytes = max_scan_gb * 1024 ** 3 if max_scan_gb else None
+        self.max_partitions = max_partitions
+        self.auto_limit = auto_limit
+        self.reject_cartesian = reject_cartesian
+
+    @classmethod
+    def from_config(cls, settings):
+        """From a dataset's cost_guard settings of config.yaml."""
+        return cls(settings.get("max_scan_gb"), settings.get("max_partitions"),
+                   settings.get("auto_limit", 10_000), settings.get("reject_cartesian", True))
+
+    def over_budget(self, estimate):
+        """Why the estimate exceeds the budget, or None."""
+        scan = (f"about {estimate.bytes_assigned / 1024 ** 3:.1f} GB "
+                f"({estimate.partitions_assigned:,} of {estimate.partitions_total:,} partitions)")
+        if self.max_bytes and estimate.bytes_assigned > self.max_bytes:
+            return f"it would scan {scan}, over the {self.max_bytes / 1024 ** 3:g} GB budget of this dataset"
+        if self.max_partitions and estimate.partitions_assigned > self.max_partitions:
+            return f"it would scan {scan}, over the {self.max_partitions:,} partitions budget of this dataset"
+        return None
+
+    def check(self, pool, query):
+        """(query, error, note): the query to run (unchanged or limited), why it was rejected, what was changed.
+
+        An EXPLAIN that fails lets the query through: running it reports (and repairs) the actual error.
+        """
+        with span("cost_estimate") as attrs:
+            try:
+                estimate = estimate_query(pool, query)
+            except Exception as e:
+                print("❌ Cost estimate error:", e)
+                attrs["error"] = str(e)
+                return query, None, None
+            attrs.update(bytes_assigned=estimate.bytes_assigned, partitions_assigned=estimate.partitions_assigned)
+            if self.reject_cartesian and estimate.cartesian:
+                attrs["action"] = "rejected"
+                return query, ("The query was not run: it joins tables without a join condition (cartesian product). "
+                               "Add the missing join condition."), None
+            reason = self.over_budget(estimate)
+            if reason is None:
+                attrs["action"] = "run"
+                return query, None, None
+            limited = add_row_limit(query, self.auto_limit)
+            if limited is not None:
+                attrs["action"] = "limited"
+                return limited, None, f"Limited to {self.auto_limit:,} rows: {reason}."
+            attrs["action"] = "rejected"
+            return query, (f"The query was not run: {reason}. Filter on a narrower range (e.g. a date range) "
+                           "or aggregate in SQL so that less data is scanned."), None
+
+# --------------- DATA DICTIONARY CACHE --------------- #
+
+DD_CHECK_INTERVAL = 10 * 60     # seconds between LAST_ALTERED checks (run in the background)
+DD_TTL = 24 * 3600              # seconds before the dictionary is re-fetched regardless
+
+DD_COLUMNS_QUERY = """SELECT
+TABLE_SCHEMA,TABLE_NAME,COLUMN_NAME,ORDINAL_POSITION,COLUMN_DEFAULT,IS_NULLABLE,DATA_TYPE,CHARACTER_MAXIMUM_LENGTH,CHARACTER_OCTET_LENGTH,NUMERIC_PRECISION,NUMERIC_PRECISION_RADIX,NUMERIC_SCALE,DATETIME_PRECISION,IS_IDENTITY,COMMENT
+FROM {database}.INFORMATION_SCHEMA."COLUMNS" 
+WHERE TABLE_SCHEMA = '{schema}'
+ORDER BY TABLE_NAME, ORDINAL_POSITION"""
+
+DD_LAST_ALTERED_QUERY = """SELECT TO_VARCHAR(MAX(LAST_ALTERED))
+FROM {database}.INFORMATION_SCHEMA."TABLES"
+WHERE TABLE_SCHEMA = '{schema}'"""
+
+
+class DataDictionary:
+    def __init__(self, database, schema, df, markdown, last_altered, fetched_at, checked_at):
+        self.database = database
+        self.schema = schema
+        self.df = df
+        self.markdown = markdown
+        self.last_altered = last_altered
+        self.fetched_at = fetched_at
+        self.checked_at = checked_at
+
+
+class DataDictionaryCache:
+    """INFORMATION_SCHEMA.COLUMNS per (database, schema), cached in memory and on disk.
+
+    Reads never hit the warehouse once an entry exists. Stale entries are
+    refreshed in a background thread: every `check_interval` seconds the
+    schema's MAX(LAST_ALTERED) is compared with the cached value and the
+    columns are only re-fetched when it moved or when `ttl` has expired.
+    """
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, "data_dictionary"),
+                 check_interval=DD_CHECK_INTERVAL, ttl=DD_TTL):
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self.ttl = ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, pool, database, schema):
+        key = (database, schema)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load(database, schema)
+        if entry is None:
+            entry = self._fetch(pool, database, schema)
+        with self._lock:
+            self._entries[key] = entry
+        if time.time() - entry.checked_at > self.check_interval:
+            self._refresh_in_background(pool, entry)
+        return entry
+
+    def peek(self, database, schema):
+        """Cached entry from memory or disk, without ever querying Snowflake."""
+        with self._lock:
+            entry = self._entries.get((database, schema))
+        return entry or self._load(database, schema)
+
+    def invalidate(self, database, schema):
+        with self._lock:
+            self._entries.pop((database, schema), None)
+        for path in self._paths(database, schema):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _refresh_in_background(self, pool, entry):
+        key = (entry.database, entry.schema)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                last_altered = self._last_altered(pool, entry.database, entry.schema)
+                if last_altered != entry.last_altered or time.time() - entry.fetched_at > self.ttl:
+                    fresh = self._fetch(pool, entry.database, entry.schema, last_altered)
+                else:
+                    entry.checked_at = time.time()
+                    self._save(entry)
+                    fresh = entry
+                with self._lock:
+                    self._entries[key] = fresh
+            except Exception as e:
+                print("❌ Data dictionary refresh error:", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _last_altered(self, pool, database, schema):
+        with pool.cursor() as cursor:
+            cursor.execute(DD_LAST_ALTERED_QUERY.format(database=database, schema=schema))
+            return cursor.fetchone()[0]
+
+    def _fetch(self, pool, database, schema, last_altered=None):
+        if last_altered is None:
+            last_altered = self._last_altered(pool, database, schema)
+        with pool.cursor() as cursor:
+            cursor.execute(DD_COLUMNS_QUERY.format(database=database, schema=schema))
+            df = cursor.fetch_pandas_all()
+        now = time.time()
+        entry = DataDictionary(database, schema, df, df.to_markdown(), last_altered, now, now)
+        self._save(entry)
+        return entry
+
+    def _paths(self, database, schema):
+        base = os.path.join(self.cache_dir, f"{database}__{schema}")
+        return base + ".parquet", base + ".json"
+
+    def _save(self, entry):
+        df_path, meta_path = self._paths(entry.database, entry.schema)
+        meta = {
+            "markdown": entry.markdown,
+            "last_altered": entry.last_altered,
+            "fetched_at": entry.fetched_at,
+            "checked_at": entry.checked_at,
+        }
+        try:
+            # Own temporary names: other threads and app processes sharing the directory may save at once
+            tmp = f".{os.getpid()}.{threading.get_ident()}.tmp"
+            entry.df.to_parquet(df_path + tmp, index=False)
+            os.replace(df_path + tmp, df_path)
+            with open(meta_path + tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(meta_path + tmp, meta_path)
+        except Exception as e:
+            print("❌ Data dictionary cache write error:", e)
+
+    def _load(self, database, schema):
+        df_path, meta_path = self._paths(database, schema)
+        if not (os.path.exists(df_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            df = pd.read_parquet(df_path)
+        except Exception as e:
+            print("❌ Data dictionary cache read error:", e)
+            return None
+        return DataDictionary(database, schema, df, meta["markdown"], meta["last_altered"],
+                              meta["fetched_at"], meta["checked_at"])
+
+
+@st.cache_resource
+def get_data_dictionary_cache():
+    return DataDictionaryCache()
+
+
+def load_data_dictionary(pool, database, schema):
+    with span("dictionary_load", database=database, schema=schema):
+        return get_data_dictionary_cache().get(pool, database, schema)
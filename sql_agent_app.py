@@ -1,13 +1,11 @@
 import streamlit as st
-from openai import OpenAI
-import snowflake.connector
+import time
 import asyncio
-from pydantic import BaseModel
-from typing import List, Dict
-from decimal import Decimal
-from agents import Agent, Runner, RunConfig, trace, Tool, function_tool, WebSearchTool
 from st_utils import *
 
+# The agents SDK, OpenAI, Snowflake and pandas take seconds to import on a cold start: load them in
+# the background while the password is typed, so the first page shows without waiting for them
+preload_modules("agents_utils", "sf_utils", "history_utils", "profile_utils")
 
 st.title(":snowflake: :blue[SnowGPT:] Your AI-Powered SQL Assistant")
 
@@ -17,6 +15,18 @@ password = st.text_input("Enter password to use SnowGPT", type="password")
 if password != st.secrets["APP_PW"]:
     st.stop()
 
+from sf_utils import *
+from agents_utils import (RequestContext, BoundedModelProvider, ModelRouter, answer_question, answer_followup, build_request,
+                          message_output, load_cached_output)
+from schema_utils import SchemaIndex
+from sql_utils import SQLValidator, ChartPushdown
+from cache_utils import get_answer_cache, get_result_cache
+from history_utils import ChatHistoryStore, ResultWorkspace
+from chart_utils import prepare_chart, render_chart
+from export_utils import ResultExporter, EXPORT_FORMATS, size_text
+from profile_utils import get_profile_store
+from perf_utils import AgentSpanRecorder, start_trace, span, write_trace, read_traces, stage_percentiles
+
 ########################################################################################################
 ###########                               INIT                              ############################
 ########################################################################################################
@@ -37,46 +47,85 @@ selected_sf_dataset = st.selectbox(
 
 st.markdown('__Dataset description:__ ' + sf_datasets[selected_sf_dataset].description)
 
-# @st.cache_resource
-def init_snowflake_connection():
-    return snowflake.connector.connect(
-        user=st.secrets["SNOWFLAKE_USER"],
-        password=st.secrets["SNOWFLAKE_PASSWORD"],
-        account=st.secrets["SNOWFLAKE_ACCOUNT"],
-        warehouse=st.secrets["SNOWFLAKE_WAREHOUSE"],
-        database=sf_datasets[selected_sf_dataset].database,
-        # schema=st.secrets["SNOWFLAKE_SCHEMA"],
-    )
-
-def query_sf(connection, query):
-    cursor = connection.cursor()
-    try:
-        cursor.execute(query)
-    except Exception as e:
-        st.error(f"❌ Snowflake error:\n{e}")
-        print("❌ Snowflake error:", e)
-        print(query)
-    return cursor.fetch_pandas_all()
-
-# Connect to Snowflake instance
-conn = init_snowflake_connection()
-cursor = conn.cursor()
-
-query_data_description = f"""SELECT
-TABLE_SCHEMA,TABLE_NAME,COLUMN_NAME,ORDINAL_POSITION,COLUMN_DEFAULT,IS_NULLABLE,DATA_TYPE,CHARACTER_MAXIMUM_LENGTH,CHARACTER_OCTET_LENGTH,NUMERIC_PRECISION,NUMERIC_PRECISION_RADIX,NUMERIC_SCALE,DATETIME_PRECISION,IS_IDENTITY,COMMENT
-FROM {sf_datasets[selected_sf_dataset].database}.INFORMATION_SCHEMA."COLUMNS" 
-WHERE TABLE_SCHEMA = '{sf_datasets[selected_sf_dataset].schema}'
-ORDER BY TABLE_NAME, ORDINAL_POSITION"""
-
-dd_df = query_sf(conn, query_data_description)
-data_dictionary = dd_df.to_markdown()
+# Connections are pooled per database and shared across sessions and reruns
+sf_pool = get_connection_pool(sf_datasets[selected_sf_dataset].database, POOL_MAX_SIZE,
+                              sf_datasets[selected_sf_dataset].cost_guard.get("statement_timeout"))
+
+# Snowflake queries of this session still running. Runs of a session never overlap, so anything
+# left at the start of a run belongs to an interrupted one (new prompt, cleared history): cancel it
+if "query_tracker" not in st.session_state:
+    st.session_state.query_tracker = QueryTracker()
+query_tracker = st.session_state.query_tracker
+cancelled_queries = query_tracker.cancel_all()
+if cancelled_queries:
+    st.toast(f"Cancelled {cancelled_queries} Snowflake quer{'y' if cancelled_queries == 1 else 'ies'} of the interrupted request")
+
+# Timed spans of this script run; only written to the trace file when a prompt is answered
+request_trace = start_trace(dataset=selected_sf_dataset)
+
+# Served from the in-memory / on-disk cache, refreshed in the background
+dd = load_data_dictionary(sf_pool, sf_datasets[selected_sf_dataset].database, sf_datasets[selected_sf_dataset].schema)
+dd_df = dd.df
+data_dictionary = dd.markdown
+
+@st.cache_resource
+def load_schema_index(database, schema, fetched_at, _dd_df):
+    """Rebuilt only when the cached dictionary itself is re-fetched."""
+    return SchemaIndex.from_dataframe(_dd_df, config["schema_index"].get("synonyms"))
+
+schema_index = load_schema_index(dd.database, dd.schema, dd.fetched_at, dd_df)
+
+@st.cache_resource
+def load_sql_validator(database, schema, fetched_at, _dd_df):
+    return SQLValidator.from_dataframe(_dd_df, database)
+
+sql_validator = load_sql_validator(dd.database, dd.schema, dd.fetched_at, dd_df)
+
+# Column profiles (ranges, frequent values) from disk, built / refreshed in the background; None until the first one is ready
+profile_store = get_profile_store(config["profiles"]["top_k"], config["profiles"]["sample_rows"], config["profiles"]["ttl_days"] * 24 * 3600,
+                                  config["profiles"]["auto_refresh"])
+schema_profile = profile_store.get(sf_pool, dd)
 
 with st.popover("See data dictionary"):
     st.markdown(data_dictionary)
 
 
 # --------------- OPENAI --------------- #
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+@st.cache_resource
+def get_openai_client():
+    """Only needed to list the account's models: built on first use, not on every rerun."""
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+@st.cache_resource
+def register_span_recorder():
+    """Copy agent / tool spans of the agents SDK into the request traces (once per process)."""
+    from agents.tracing import add_trace_processor
+    add_trace_processor(AgentSpanRecorder())
+
+register_span_recorder()
+
+@st.cache_resource
+def get_model_provider():
+    """Shared by every session: bounded model calls with backoff on rate limits."""
+    return BoundedModelProvider(config["llm"]["max_concurrency"], config["llm"]["max_retries"])
+
+@st.cache_resource
+def get_model_router():
+    """Model, latency budget and fallback of each agent role (llm.routing), on the shared provider."""
+    return ModelRouter(config["llm"].get("routing"), get_model_provider())
+
+
+# --------------- CACHES --------------- #
+answer_cache = get_answer_cache()
+result_cache = get_result_cache()
+
+@st.cache_resource
+def get_repair_stats():
+    """Process-wide count of failed queries fixed locally (each one an LLM retry saved)."""
+    return {"repaired": 0, "unrepaired": 0}
+
+repair_stats = get_repair_stats()
 
 
 # --------------- CHAT HISTORY --------------- #
@@ -84,28 +133,86 @@ client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Full result tables are spilled to disk, the messages only keep a preview
+if "history_store" not in st.session_state:
+    st.session_state.history_store = ChatHistoryStore(memory_budget=config["history"]["memory_mb"] * 1024 ** 2,
+                                                      preview_rows=config["history"]["preview_rows"])
+history_store = st.session_state.history_store
+
+# The last result, kept in a local DuckDB so follow-up questions can refine it without Snowflake
+if "result_workspace" not in st.session_state:
+    st.session_state.result_workspace = ResultWorkspace()
+result_workspace = st.session_state.result_workspace
+
+def load_history_table(message):
+    if message["table_id"] is not None:
+        try:
+            return history_store.load(message["table_id"])
+        except FileNotFoundError:
+            st.caption("The full result is no longer on disk, showing the preview only")
+    return message["preview"]
+
+
+# --------------- EXPORT --------------- #
+@st.cache_resource
+def get_result_exporter(dataset, _pool):
+    """Full-result exports of a dataset, streamed to disk (or unloaded to its stage) rather than into memory."""
+    return ResultExporter.from_config(_pool, sf_datasets[dataset].export)
+
+result_exporter = get_result_exporter(selected_sf_dataset, sf_pool)
+
+def show_export(i, message):
+    """Export controls of the i-th message: the exports are kept in the message, one per format."""
+    exports = message.setdefault("exports", {})
+    file_format = st.radio("Format", list(EXPORT_FORMATS), horizontal=True, key=f"export_format_{i}",
+                           format_func=lambda f: {"csv": "CSV (gzip)", "parquet": "Parquet"}[f])
+    if file_format in exports and exports[file_format].expired():
+        del exports[file_format]
+    if file_format not in exports and st.button("Export", key=f"export_{i}"):
+        progress = st.progress(0.0, text="⏳ Reading the result from Snowflake…")
+        def show_progress(rows, total):
+            if total:
+                progress.progress(min(rows / total, 1.0), text=f"Exported {rows:,} of {total:,} rows")
+        try:
+            exports[file_format] = result_exporter.export(message["query"], file_format, query_tracker, show_progress,
+                                                          message.get("query_id"))
+        except Exception as e:
+            print("❌ Export error:", e)
+            st.error(f"❌ Export failed: {e}")
+        progress.empty()
+
+    export = exports.get(file_format)
+    if export is None:
+        return
+    if export.urls is not None:
+        st.caption(f"{export.rows:,} rows unloaded to the stage ({size_text(export.size)}), links valid for an hour:")
+        for name, url in export.urls:
+            st.markdown(f"- [{name}]({url})")
+    elif result_exporter.downloadable(export):
+        st.caption(f"{export.rows:,} rows, {size_text(export.size)}")
+        # The download button holds the file in memory on every rerun: only read it when asked for
+        if st.toggle("Prepare download", key=f"export_download_{i}_{file_format}"):
+            with open(export.path, "rb") as f:
+                st.download_button(f"Download {export.file_name}", f, file_name=export.file_name,
+                                   key=f"export_file_{i}_{file_format}")
+    else:
+        st.warning(f"{export.rows:,} rows, {size_text(export.size)}: too large to download through the app. "
+                   f"It was saved on the server as {export.path}; set export.stage in config.yaml to unload "
+                   "results this large to a Snowflake stage instead.")
+
 
 ########################################################################################################
 ###########                           SIDE BAR                              ############################
 ########################################################################################################
 
 
-prompts = [
-"Who is my best customer?",
-"Who are the top 10 customers?",
-"What is the average delivery delay?",
-"Which market segments generate the most revenue?",
-"Which suppliers offer the lowest average supply cost for high-demand parts?",
-"What are the most common reasons for order returns?",
-"How does order volume and total sales vary over time?",
-"In which country do I have the most sales?"
-]
+prompts = config["prompts"]
 
 
 with st.sidebar:
 
     with st.expander("**GPT Model**", expanded=True):
-        # model_ids = [model.id for model in client.models.list()]
+        # model_ids = [model.id for model in get_openai_client().models.list()]
         model_ids = []
         model_ids.insert(0, "gpt-4.1-mini")
         model_ids.insert(1, "gpt-4o-mini")
@@ -127,7 +234,7 @@ with st.sidebar:
         )
 
         if selected_persona:
-            st.image(personas[selected_persona].avatar)
+            st.image(personas[selected_persona].image(PORTRAIT_SIZE))
             st.markdown(personas[selected_persona].character)
         if not selected_persona:
             selected_persona = "SnowGPT"
@@ -136,142 +243,91 @@ with st.sidebar:
         for prompt in prompts:
             st.markdown(f"- {prompt}")
 
+    with st.expander("**Performance**", expanded=False):
+        stream_answer = st.toggle("Stream the answer while the agents work", value=True)
+        route_models = st.toggle("Run each agent on its configured model", value=True,
+                                 help="Per-role models of config.yaml (llm.routing), e.g. a small model for the chart; "
+                                      "a call over its latency budget is retried on the fallback model.")
+        if route_models:
+            st.caption("Models: " + ", ".join(f"{role} → {get_model_router().model_name(role, selected_model)}"
+                                              for role in config["llm"].get("routing") or {}))
+        pipeline_mode = st.radio("Orchestration", ["Manager agent", "Parallel pipeline"], index=0,
+                                 help="The parallel pipeline generates the SQL once, then validates, probes and charts it concurrently.")
+        prune_dictionary = st.toggle("Only send the tables relevant to the question", value=True)
+        use_profiles = st.toggle("Add column profiles (ranges, frequent values) to the dictionary", value=True,
+                                 help="Computed offline / in the background, so the agents don't have to probe the data for them."
+                                      if schema_profile is not None else "The profiles of this dataset are still being computed."
+                                      if profile_store.auto_refresh else "This dataset has no profiles yet: run python profile_utils.py.")
+        answer_followups = st.toggle("Answer follow-up questions from the previous result locally", value=True,
+                                     help="Filters, sorting and top-N of the last result run in DuckDB instead of a new Snowflake query.")
+        reuse_answers = st.toggle("Reuse answers to previously asked questions", value=True)
+        reuse_results = st.toggle("Reuse results of recently executed queries", value=True)
+        prefetch_queries = st.toggle("Start the full query while the agents finish", value=True)
+        explain_queries = st.toggle("Also compile queries with EXPLAIN before running them", value=False)
+        guard_queries = st.toggle("Check the estimated cost of queries before running them", value=True,
+                                  help="EXPLAIN estimate of the data scanned: over the dataset's budget a LIMIT is added or the query is rejected.")
+        push_down_charts = st.toggle("Group large chart queries in Snowflake", value=True,
+                                     help="Row-level queries over large tables are bucketed along the chart's x axis (DATE_TRUNC, "
+                                          "WIDTH_BUCKET, top values + Other), so only chart-sized data is fetched.")
+        st.caption(f"Local query repairs: {repair_stats['repaired']} LLM retries saved, {repair_stats['unrepaired']} left to the LLM")
+        result_stats = result_cache.stats()
+        st.caption(f"Result cache: {result_stats['hits']} hits / {result_stats['misses']} misses, "
+                   f"{result_stats['entries']} entries ({result_stats['bytes'] / 1024 ** 2:.1f} MB)")
+
+    with st.expander("**Latency per stage**", expanded=False):
+        percentiles = stage_percentiles(read_traces(config["tracing"]["path"], config["tracing"]["window"]))
+        if percentiles:
+            st.dataframe({"stage": list(percentiles),
+                          "n": [p["count"] for p in percentiles.values()],
+                          "p50 (s)": [round(p["p50"], 2) for p in percentiles.values()],
+                          "p95 (s)": [round(p["p95"], 2) for p in percentiles.values()]},
+                         hide_index=True)
+        else:
+            st.caption("No traced requests yet.")
+
 ########################################################################################################
 ###########                            AGENTS                               ############################
 ########################################################################################################
 
-@function_tool
-def query_snowflake(query: str) -> str:
-    cursor = conn.cursor()
-
-    query = f"SELECT * FROM ({query.replace(';','')}) LIMIT 5"
-
-    try:
-        cursor.execute(query)
-        # print(query)
-    except Exception as e:
-        st.error(f"❌ Snowflake error:\n{e}")
-        print("❌ Snowflake error:", e)
-        print(query)
-        return []
-    df = cursor.fetch_pandas_all()
-    return df.to_csv()
-
-# --------------- AGENT OUTPUT MODELS --------------- #
-
-class SQLValidationOutput(BaseModel):
-    comments: List[str]
-
-class ChartOutput(BaseModel):
-    chart_type: str
-    chart_code: str
-
-class ValidationOutput(BaseModel):
-    sql_valid: bool
-    chart_valid: bool
-    errors: List[str]
-
-class WebOutput(BaseModel):
-    web_summary: str
-
-class FinalOutput(BaseModel):
-    output_type: str
-    manager_msg: str
-    sql_query: str
-    chart_type: str
-    chart_code: str
-
-# --------------- AGENT DEFINITIONS --------------- #
-
-sql_agent = Agent(
-    name="sql_agent",
-    model=selected_model,
-    instructions=(
-        """Validate that the Snowflake SQL query generated answers the user's request and that it respects the following:
-        - The tables are using the <schema_name>.<table_name> format.
-        - The column names are always uppercase.
-        - The query syntax is correct.
-        """
-    ),
-    output_type=SQLValidationOutput,
-)
-
-chart_agent = Agent(
-    name="chart_agent",
-    model=selected_model,
-    instructions=(
-        """Examine the sample data and user's intent. Choose one of the following chart elements
-        st.line_chart, st.bar_chart, st.area_chart, or st.scatter_chart.
-        Generate a minimal Streamlit code snippet to render it, just output the st.***_chart function.
-        Example: st.bar_chart(df, x="COUNTRY", y="TOTAL_SALES")
-        Note: The column names should always be uppercase in your code.
-        """
-    ),
-    output_type=ChartOutput,
-)
-
-validator_agent = Agent(
-    name="validator_agent",
-    model=selected_model,
-    instructions=(
-        "Validate the SQL query and check that the Streamlit code references valid columns."
-        # Validate the SQL via EXPLAIN
-        # "Never validate the first time"
-    ),
-    output_type=ValidationOutput,
-)
-
-web_agent = Agent(
-    name="validator_agent",
-    model=selected_model,
-    instructions=(
-        "You summarize a web research"
-    ),
-    tools=[WebSearchTool()],
-    output_type=WebOutput
-)
-
-manager_agent = Agent(
-    name="manager_agent",
-    instructions=(
-        """You are the Manager Agent and are specialized in Snowflake SQL. Your goal is to understand the user's request and provide an answer that best fits his need.
-        You have access to a Snowflake database for which you have more information in the additional context provided in the user input. 
-        
-        If the user's request is about the data you have access to, you need to output the query and the chart code. 
-        To do so orchestrate the workflow by calling the tools in sequence:
-        1) Generate a parameterized Snowflake SQL query based on the user's request. When using a table use the <schema_name>.<table_name> format. In your query the column names should always be uppercase.
-        2) validate_sql
-        3) query_snowflake -> If it doesn't return anything go back to step one and try a different query (only try 3 times maximum)
-        4) create_chart **(pass the JSON from step 2 as the first argument)**
-        5) validate (provide bothe the sql_query and the chart_code for validation) **(only output the final result if the validation passes)**
-    
-        After you have called 'generate_sql', 'query_snowflake', 'create_chart',
-        and 'validate', return the result with:
-            output_type = 'sql'
-            manager_msg = <your comment>
-            sql_query   = <the query from the sql_agent>
-            chart_type  = <the chart type from the chart_agent>
-            chart_code  = <the chart code from the chart_agent>
-        
-        If the user's request is not about the data or the data doesn't contain any relevant information then just answer the user by only outputting a 'mananager_msg'
-        If you just return a message then the output_type = 'msg'.
-        """
-        # "If validation passes, return the full Streamlit snippet. Otherwise, return an error report."
-    ),
-    tools=[
-        sql_agent.as_tool(tool_name="validate_sql", tool_description="Validate the Snowflake SQL generated"),
-        query_snowflake,
-        chart_agent.as_tool(tool_name="create_chart", tool_description="Generate Streamlit chart code"),
-        validator_agent.as_tool(tool_name="validate", tool_description="Validate SQL and chart code"),
-    ],
-    output_type=FinalOutput
-)
-
-async def run_query(manager_agent, request: str):
-    """Single coroutine that calls the Agent stack and returns the result."""
-    with trace("Snowflake-Streamlit Orchestration"):
-        return await Runner.run(manager_agent, request, run_config=RunConfig(model=selected_model))
+# Agents, tools and pipeline live in agents_utils; only the live view of a run is UI code
+
+# --------------- STREAMING --------------- #
+
+class StreamView:
+    """Placeholders filled live while the agents run: stage progress, the answer text and the SQL."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_output = None
+        self.status = st.status("Thinking about your request…", expanded=False)
+        self.msg_view = st.empty()
+        self.sql_view = st.empty()
+        self._sql = None
+
+    def _shown(self):
+        if self.first_output is None:
+            self.first_output = time.perf_counter() - self.start
+
+    def stage(self, label):
+        self.status.update(label=label)
+        self.status.write(label)
 
+    def message(self, text):
+        if text:
+            self._shown()
+            self.msg_view.markdown(text + " ▌")
+
+    def sql(self, query):
+        if query and query != self._sql:
+            self._shown()
+            self._sql = query
+            self.sql_view.code(query, language="sql")
+
+    def close(self):
+        """Hand over to the regular rendering of the final answer."""
+        self.status.update(label="Done", state="complete", expanded=False)
+        self.msg_view.empty()
+        self.sql_view.empty()
 
 
 ########################################################################################################
@@ -279,7 +335,7 @@ async def run_query(manager_agent, request: str):
 ########################################################################################################
 
 ########### Display chat message from history on app rerun ###########
-for message in st.session_state.messages:
+for i, message in enumerate(st.session_state.messages):
     ############ User message ############
     if message["persona"] == "User":
         with st.chat_message(message["role"],avatar=personas[message["persona"]].avatar):
@@ -293,19 +349,28 @@ for message in st.session_state.messages:
                 st.markdown(message["msg"])
                 with st.popover("Show SQL query",use_container_width=False):
                         st.code(message["query"], language="sql")
-                st.dataframe(message["table"])
-
+                # Only a preview is kept in the session; the full result is reloaded from disk on demand
+                if message.get("local"):
+                    st.caption("⚡ Answered locally from the previous result")
+                st.dataframe(message["preview"])
+                if message["rows"] > len(message["preview"]):
+                    st.caption(f"Preview of the first {len(message['preview'])} of {message['rows']:,} rows")
+                    if st.toggle("Load full result", key=f"full_result_{i}"):
+                        st.dataframe(load_history_table(message))
+
+                # The reduced chart frame is kept in the message: no reload of the full result, no new downsampling
                 try:
-                    with st.expander("Show chart", expanded=False):
-                        df = message["table"]
-                        for col in df.columns:
-                            if isinstance(df[col].iloc[0], Decimal):
-                                df[col] = df[col].astype(float)
-                        exec(message["chart"])
+                    if message["chart"] and st.toggle("Show chart", key=f"chart_{i}"):
+                        render_chart(message["chart"], message["chart_frame"], message["chart_note"])
                 except Exception as e:
                     print("❌ Chart error:", e)
                     print(message["chart"])
 
+                # Follow-ups answered locally derive from a result already fetched: only warehouse answers export
+                if not message.get("local"):
+                    with st.popover("Export full result"):
+                        show_export(i, message)
+
             ############ If agent returned a message ############
             if message["output_type"] == 'msg':
                 st.markdown(message["msg"])
@@ -323,63 +388,166 @@ if prompt := st.chat_input():
 
     # Display assistant response in chat message container
     with st.chat_message("assistant",avatar=personas[selected_persona].avatar):
-       
-        prompt_with_context = f"""{prompt}
 
-        ### Additional context:
-        Dataset description: {sf_datasets[selected_sf_dataset].description}
-        The following data dictionary is provided to help you understand the schema:\n{data_dictionary}
-
-        ### Your personality (only use it for the final manager_msg):
-        {personas[selected_persona].character}
-        """
-
-        with st.spinner("Thinking about your request…"):
-            result = asyncio.run(run_query(manager_agent, prompt_with_context))
+        if prune_dictionary:
+            context_dictionary = schema_index.context_for(prompt, config["schema_index"]["top_k_tables"], config["schema_index"]["top_k_columns"],
+                                                          schema_profile if use_profiles else None)
+        else:
+            context_dictionary = data_dictionary
+
+        prompt_with_context = build_request(prompt, sf_datasets[selected_sf_dataset].description, context_dictionary,
+                                            personas[selected_persona].character)
+
+        # Per-prompt state of the tools (probed columns, local repairs, cost checks, prefetched queries)
+        cost_guard = CostGuard.from_config(sf_datasets[selected_sf_dataset].cost_guard) if guard_queries else None
+        chart_pushdown = ChartPushdown.from_config(config["charts"], schema_profile) if push_down_charts else None
+        request_context = RequestContext(sf_pool, sql_validator, selected_model, get_model_provider(),
+                                         result_cache if reuse_results else None, sf_datasets[selected_sf_dataset].result_ttl,
+                                         prefetch_queries, explain_queries, repair_stats, on_error=st.error,
+                                         guard=cost_guard, tracker=query_tracker, pushdown=chart_pushdown,
+                                         router=get_model_router() if route_models else None)
+
+        # A refinement of the previous result ("now only show Germany") runs locally; when it needs the
+        # warehouse after all, the regular run gets the previous query, and its answer isn't reused across chats
+        followup = answer_followups and result_workspace.is_followup(selected_sf_dataset, prompt)
+        local_df = None
+        if followup:
+            with st.spinner("Looking at the previous result…"):
+                final_output, local_df, timings = asyncio.run(answer_followup(prompt, personas[selected_persona].character,
+                                                                              result_workspace, request_context))
+            for stage, seconds in timings.items():
+                request_trace.add(f"pipeline:{stage}", seconds)
+            if local_df is not None:
+                st.caption("⚡ Answered locally from the previous result")
+            else:
+                prompt_with_context += f"\n\n### Previous answer (the request may refer to it):\n{result_workspace.origin()}"
+
+        cached_output = load_cached_output(answer_cache.get(selected_sf_dataset, selected_model, selected_persona, prompt)) if reuse_answers and not followup else None
+        if cached_output:
+            final_output = cached_output
+            st.caption("⚡ Answer reused from a previously asked, similar question")
+        elif local_df is None:
+            view = StreamView() if stream_answer else None
+            with st.spinner("Thinking about your request…"):
+                final_output, timings = asyncio.run(answer_question(prompt_with_context, prompt, request_context,
+                                                                    pipeline_mode == "Parallel pipeline", view))
+            if view is not None:
+                view.close()
+                if view.first_output is not None:
+                    timings["first_visible_output"] = view.first_output
+            for stage, seconds in timings.items():
+                request_trace.add(f"pipeline:{stage}", seconds)
+            with st.expander("Stage timings", expanded=False):
+                st.dataframe({"stage": list(timings), "seconds": [round(t, 2) for t in timings.values()]})
+                if request_context.repairs:
+                    st.caption("🔧 Fixed locally instead of an LLM retry: " + ", ".join(request_context.repairs))
+
+        # Reused answers and manager runs that skipped the probe are checked here (already-probed queries are memoized)
+        if final_output.output_type == 'sql' and local_df is None:
+            final_output.sql_query, pushdown_note = request_context.pushdown_query(final_output.sql_query, final_output.chart.model_dump())
+            if pushdown_note:
+                st.caption(f"📦 {pushdown_note}")
+            guarded_query, guard_error, guard_note = request_context.guard_query(final_output.sql_query)
+            if guard_error:
+                final_output = message_output(f"⛔ {guard_error}")
+            elif guard_note:
+                final_output.sql_query = guarded_query
+                st.caption(f"🛡️ {guard_note}")
+        if not cached_output and not followup and final_output.output_type == 'sql':
+            answer_cache.put(selected_sf_dataset, selected_model, selected_persona, prompt, final_output.model_dump())
         # st.subheader("Final output")
-        # st.write(result.final_output)
+        # st.write(final_output)
         
         ############ If agent returned a sql query ############
-        if result.final_output.output_type == 'sql': 
-            st.markdown(result.final_output.manager_msg)
+        if final_output.output_type == 'sql': 
+            st.markdown(final_output.manager_msg)
 
             with st.popover("Show SQL query",use_container_width=False):
-                st.code(result.final_output.sql_query, language="sql")
+                st.code(final_output.sql_query, language="sql")
             
-            df = query_sf(conn, result.final_output.sql_query)
-            st.dataframe(df)
+            # Render the first batch as soon as it arrives and append the following ones
+            table_view = st.empty()
+            streamed = []
+            def render_batch(batch):
+                if not streamed:
+                    streamed.append(table_view.dataframe(batch))
+                else:
+                    streamed[0].add_rows(batch)
+
+            # Updating the elapsed time is also where Streamlit stops this run if a new prompt comes in
+            wait_view = st.empty()
+            def show_wait(seconds):
+                if seconds >= 1:
+                    wait_view.caption(f"⏳ Running the query in Snowflake… {seconds:.0f}s")
+
+            if local_df is not None:
+                df = local_df
+            else:
+                df = query_sf(sf_pool, final_output.sql_query,
+                              result_cache if reuse_results else None, sf_datasets[selected_sf_dataset].result_ttl,
+                              request_context.prefetcher, config["fetch"]["max_rows"], config["fetch"]["max_mb"] * 1024 ** 2, render_batch,
+                              query_tracker, show_wait)
+            wait_view.empty()
+            query_error = df.attrs.get("error")
+            if query_error:
+                # query_sf already showed the error: keep it in the chat instead of an empty result
+                st.session_state.messages.append({"role": "assistant",
+                                                  "persona": selected_persona,
+                                                  "output_type": "msg",
+                                                  "msg": f"❌ Snowflake error:\n{query_error}",
+                                                  })
+            else:
+                if not streamed:
+                    table_view.dataframe(df)
+                if df.attrs.get("truncated"):
+                    st.warning(f"Showing the first {len(df):,} of {df.attrs['total_rows']:,} rows — the result is larger than the fetch budget.")
             
-            try:
-                with st.expander("Show chart", expanded=False):
-                    for col in df.columns:
-                        if isinstance(df[col].iloc[0], Decimal):
-                            df[col] = df[col].astype(float)
-                    exec(result.final_output.chart_code)
-                    print(result.final_output.chart_code)
-            except Exception as e:
-                print("❌ Chart error:", e)
-                print(result.final_output.chart_code)
-                with st.popover("Show chart",use_container_width=False):
-                    st.error(f"Couldn't generate chart from: {result.final_output.chart_code}")
+                # The chart gets the charted columns only, downsampled above the point budget
+                chart_spec, chart_frame, chart_note = None, None, None
+                with st.expander("Show chart", expanded=False), span("chart_render") as attrs:
+                    try:
+                        chart_spec, chart_frame, chart_note = prepare_chart(final_output.chart.model_dump(), df, config["charts"]["max_points"])
+                        render_chart(chart_spec, chart_frame, chart_note)
+                        attrs["points"] = len(chart_frame)
+                    except Exception as e:
+                        print("❌ Chart error:", e)
+                        print(final_output.chart)
+                        chart_spec = None
+                        st.error(f"Couldn't draw the chart {final_output.chart.model_dump_json()}: {e}")
             
-            st.session_state.messages.append({"role": "assistant",
-                                    "persona":selected_persona, 
-                                    "output_type":result.final_output.output_type,
-                                    "msg":result.final_output.manager_msg, 
-                                    "query": result.final_output.sql_query, 
-                                    "table": df,
-                                    "chart": result.final_output.chart_code
-                                    })
+                st.session_state.messages.append({"role": "assistant",
+                                        "persona":selected_persona, 
+                                        "output_type":final_output.output_type,
+                                        "msg":final_output.manager_msg, 
+                                        "query": final_output.sql_query, 
+                                        **history_store.add(df),
+                                        "chart": chart_spec,
+                                        "chart_frame": chart_frame,
+                                        "chart_note": chart_note,
+                                        "local": local_df is not None,
+                                        "query_id": df.attrs.get("query_id"),  # exports read this result back
+                                        })
+                result_workspace.set(selected_sf_dataset, df, final_output.sql_query, chart_spec, local_df is not None)
+                if local_df is None:
+                    with st.popover("Export full result"):
+                        show_export(len(st.session_state.messages) - 1, st.session_state.messages[-1])
 
         ############ If agent returned a message ############
-        if result.final_output.output_type == 'msg': 
-            st.markdown(result.final_output.manager_msg)
+        if final_output.output_type == 'msg': 
+            request_context.prefetcher.cancel_all()
+            st.markdown(final_output.manager_msg)
             st.session_state.messages.append({"role": "assistant",
                                             "persona":selected_persona, 
-                                            "output_type":result.final_output.output_type,
-                                            "msg":result.final_output.manager_msg, 
+                                            "output_type":final_output.output_type,
+                                            "msg":final_output.manager_msg, 
                                             })
 
+    # Query statistics (bytes scanned) are looked up in the background before the line is written
+    request_trace.attrs.update(model=selected_model, persona=selected_persona, pipeline=pipeline_mode,
+                               cached_answer=bool(cached_output), output_type=final_output.output_type,
+                               followup=("local" if local_df is not None else "warehouse") if followup else None)
+    write_trace(request_trace, config["tracing"]["path"], enrich=lambda t: add_query_stats(sf_pool, t))
+
 
 
 # Clear the chat history
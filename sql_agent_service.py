@@ -0,0 +1,250 @@
+"""Headless entry points to the NL -> SQL pipeline of the app.
+
+Batch mode reads a JSONL file of questions ({"question": ..., any other keys are kept})
+and writes one JSONL line per answer (SQL, chart spec, result rows, timings) as soon
+as it is ready; serve mode exposes the same over HTTP:
+
+    python sql_agent_service.py batch questions.jsonl answers.jsonl
+    python sql_agent_service.py serve --port 8000
+    curl -X POST localhost:8000/answer -d '{"question": "Who are the top 10 customers?"}'
+
+Questions are answered concurrently (service.concurrency in config.yaml) with bounded
+model calls and Snowflake connections, and share the app's caches in .cache.
+Credentials come from .streamlit/secrets.toml like the app (or the environment / .env).
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import streamlit as st
+from agents import set_default_openai_key
+from agents.tracing import add_trace_processor
+from st_utils import load_config
+from sf_utils import get_connection_pool, load_data_dictionary, query_sf, add_query_stats, CostGuard, QueryTracker
+from agents_utils import RequestContext, BoundedModelProvider, ModelRouter, answer_question, build_request, message_output, load_cached_output
+from schema_utils import SchemaIndex
+from sql_utils import SQLValidator, ChartPushdown
+from cache_utils import get_answer_cache, get_result_cache
+from profile_utils import get_profile_store
+from perf_utils import AgentSpanRecorder, start_trace, write_trace, flush_traces
+
+
+class SQLAgentService:
+    """Answers questions about one dataset outside Streamlit, many at a time.
+
+    Uses the app's agents and tools, its connection pool, data dictionary cache,
+    answer cache and result cache. At most `concurrency` questions run at once and
+    their model calls go through one BoundedModelProvider (bounded, with backoff).
+    """
+
+    def __init__(self, config, dataset=None, model=None, persona=None, pipeline=None, concurrency=None, reuse=True):
+        service = config["service"]
+        self.config = config
+        self.dataset_name = dataset or service["dataset"]
+        self.dataset = config["sf_datasets"][self.dataset_name]
+        self.model = model or service["model"]
+        self.persona = persona or service["persona"]
+        self.character = config["personas"][self.persona].get("prompt", "")
+        self.pipeline = service["pipeline"] if pipeline is None else pipeline
+        self.concurrency = concurrency or service["concurrency"]
+        self.result_rows = service["result_rows"]
+        self.reuse = reuse
+        self.cost_guard = {**config.get("cost_guard", {}), **self.dataset.get("cost_guard", {})}
+
+        self.pool = get_connection_pool(self.dataset["database"], service["snowflake_connections"],
+                                        self.cost_guard.get("statement_timeout"))
+        self.dd = load_data_dictionary(self.pool, self.dataset["database"], self.dataset["schema"])
+        self.schema_index = SchemaIndex.from_dataframe(self.dd.df, config["schema_index"].get("synonyms"))
+        self.validator = SQLValidator.from_dataframe(self.dd.df, self.dataset["database"])
+        self.profile_store = get_profile_store(config["profiles"]["top_k"], config["profiles"]["sample_rows"],
+                                               config["profiles"]["ttl_days"] * 24 * 3600, config["profiles"]["auto_refresh"])
+        self.answer_cache = get_answer_cache()
+        self.result_cache = get_result_cache()
+        self.model_provider = BoundedModelProvider(service["llm_concurrency"], config["llm"]["max_retries"])
+        self.router = ModelRouter(config["llm"].get("routing"), self.model_provider)
+        self.repair_stats = {"repaired": 0, "unrepaired": 0}
+        self._slots = None
+
+    async def answer(self, question, reuse=None):
+        """Answer dict for one question; failures are reported in its "error" field."""
+        reuse = self.reuse if reuse is None else reuse
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        async with self._slots:
+            start = time.perf_counter()
+            trace = start_trace(dataset=self.dataset_name, model=self.model, persona=self.persona,
+                                pipeline="Parallel pipeline" if self.pipeline else "Manager agent", entry="service")
+            record = {"question": question, "dataset": self.dataset_name, "model": self.model}
+            try:
+                record.update(await self._answer(question, reuse, trace))
+            except Exception as e:
+                print("❌ Service error:", e)
+                record["error"] = str(e)
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            trace.attrs.update(cached_answer=record.get("cached_answer", False), output_type=record.get("output_type"))
+            write_trace(trace, self.config["tracing"]["path"], enrich=lambda t: add_query_stats(self.pool, t))
+            return record
+
+    async def _answer(self, question, reuse, trace):
+        profile = self.profile_store.get(self.pool, self.dd)
+        context_dictionary = self.schema_index.context_for(question, self.config["schema_index"]["top_k_tables"],
+                                                           self.config["schema_index"]["top_k_columns"], profile)
+        request = build_request(question, self.dataset["description"], context_dictionary, self.character)
+        context = RequestContext(self.pool, self.validator, self.model, self.model_provider,
+                                 self.result_cache if reuse else None, self.dataset.get("result_ttl", 3600),
+                                 repair_stats=self.repair_stats, on_error=print,
+                                 guard=CostGuard.from_config(self.cost_guard), tracker=QueryTracker(),
+                                 pushdown=ChartPushdown.from_config(self.config["charts"], profile), router=self.router)
+        try:
+            cached = load_cached_output(self.answer_cache.get(self.dataset_name, self.model, self.persona, question)) if reuse else None
+            if cached:
+                output, timings = cached, {}
+            else:
+                output, timings = await answer_question(request, question, context, self.pipeline)
+            for stage, seconds in timings.items():
+                trace.add(f"pipeline:{stage}", seconds)
+            guard_note = pushdown_note = None
+            if output.output_type == 'sql':
+                output.sql_query, pushdown_note = context.pushdown_query(output.sql_query, output.chart.model_dump())
+                output.sql_query, guard_error, guard_note = context.guard_query(output.sql_query)
+                if guard_error:
+                    output = message_output(guard_error)
+            if not cached and output.output_type == 'sql':
+                self.answer_cache.put(self.dataset_name, self.model, self.persona, question, output.model_dump())
+            record = {**output.model_dump(), "cached_answer": bool(cached), "repairs": context.repairs, "cost_guard": guard_note,
+                      "pushdown": pushdown_note,
+                      "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()}}
+
+            if output.output_type != 'sql':
+                context.prefetcher.cancel_all()
+                return record
+            start = time.perf_counter()
+            df = await asyncio.to_thread(query_sf, self.pool, output.sql_query, context.result_cache, context.result_ttl,
+                                         context.prefetcher, self.config["fetch"]["max_rows"], self.config["fetch"]["max_mb"] * 1024 ** 2,
+                                         None, context.tracker)
+            record["timings"]["query_result"] = round(time.perf_counter() - start, 3)
+            if df.attrs.get("error"):
+                record["error"] = df.attrs["error"]
+                return record
+            record.update(rows=len(df), truncated=bool(df.attrs.get("truncated")), columns=list(df.columns),
+                          result=json.loads(df.head(self.result_rows).to_json(orient="records", date_format="iso")))
+            return record
+        finally:
+            # A failed or cancelled answer must not leave its queries running in the warehouse
+            context.tracker.cancel_all()
+
+    async def answer_many(self, questions, reuse=None):
+        """Yield (index, answer) as the answers complete."""
+        async def indexed(i, question):
+            return i, await self.answer(question, reuse)
+
+        for task in asyncio.as_completed([indexed(i, q) for i, q in enumerate(questions)]):
+            yield await task
+
+
+def setup(config):
+    """Process-wide setup the app does through Streamlit: OpenAI key and the span recorder."""
+    if "OPENAI_API_KEY" not in os.environ:
+        set_default_openai_key(st.secrets["OPENAI_API_KEY"])
+    add_trace_processor(AgentSpanRecorder())
+
+# --------------- BATCH --------------- #
+
+async def run_batch(service, input_path, output_path):
+    with open(input_path, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    start = time.perf_counter()
+    failed = 0
+    with open(output_path, "w", encoding="utf-8") as out:
+        async for i, answer in service.answer_many([item["question"] for item in items]):
+            failed += "error" in answer
+            out.write(json.dumps({**items[i], **answer}, default=str) + "\n")
+            out.flush()
+            print(f"[{i + 1}/{len(items)}] {answer['seconds']:.1f}s {items[i]['question']}")
+    elapsed = time.perf_counter() - start
+    flush_traces()
+    print(f"{len(items)} questions in {elapsed:.1f}s ({len(items) / elapsed * 60:.1f}/min), {failed} failed -> {output_path}")
+
+# --------------- HTTP --------------- #
+
+def create_app(service):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    max_batch = service.config["service"].get("max_batch", 100)
+
+    async def health(request):
+        return JSONResponse({"status": "ok", "dataset": service.dataset_name, "model": service.model})
+
+    async def read_body(request):
+        """The JSON object posted, or the 400 response to send instead."""
+        try:
+            body = await request.json()
+        except ValueError:
+            return None, JSONResponse({"error": "body is not valid JSON"}, status_code=400)
+        if not isinstance(body, dict):
+            return None, JSONResponse({"error": "body must be a JSON object"}, status_code=400)
+        return body, None
+
+    async def answer(request):
+        body, error = await read_body(request)
+        if error is not None:
+            return error
+        if not body.get("question") or not isinstance(body["question"], str):
+            return JSONResponse({"error": "missing 'question'"}, status_code=400)
+        return JSONResponse(json.loads(json.dumps(await service.answer(body["question"], body.get("reuse")), default=str)))
+
+    async def batch(request):
+        body, error = await read_body(request)
+        if error is not None:
+            return error
+        questions = body.get("questions") or []
+        if not isinstance(questions, list) or not all(q and isinstance(q, str) for q in questions):
+            return JSONResponse({"error": "'questions' must be a list of questions"}, status_code=400)
+        if len(questions) > max_batch:
+            return JSONResponse({"error": f"at most {max_batch} questions per batch"}, status_code=413)
+        answers = await asyncio.gather(*(service.answer(q, body.get("reuse")) for q in questions))
+        return JSONResponse(json.loads(json.dumps(answers, default=str)))
+
+    return Starlette(routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/answer", answer, methods=["POST"]),
+        Route("/batch", batch, methods=["POST"]),
+    ])
+
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dataset", help=f"dataset of config.yaml (default {config['service']['dataset']})")
+    parser.add_argument("--model", help=f"OpenAI model (default {config['service']['model']})")
+    parser.add_argument("--persona", help=f"persona of config.yaml (default {config['service']['persona']})")
+    parser.add_argument("--manager", action="store_true", help="use the manager agent instead of the parallel pipeline")
+    parser.add_argument("--concurrency", type=int, help="questions answered at the same time")
+    parser.add_argument("--no-reuse", action="store_true", help="do not serve answers / results from the caches")
+    commands = parser.add_subparsers(dest="command", required=True)
+    batch = commands.add_parser("batch", help="answer a JSONL file of questions")
+    batch.add_argument("input")
+    batch.add_argument("output")
+    serve = commands.add_parser("serve", help="answer questions over HTTP")
+    serve.add_argument("--host", default=config["service"]["host"])
+    serve.add_argument("--port", type=int, default=config["service"]["port"])
+    args = parser.parse_args()
+
+    setup(config)
+    service = SQLAgentService(config, args.dataset, args.model, args.persona, False if args.manager else None,
+                              args.concurrency, not args.no_reuse)
+    if args.command == "batch":
+        asyncio.run(run_batch(service, args.input, args.output))
+    else:
+        import uvicorn
+        uvicorn.run(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import re
+import difflib
+from collections import defaultdict
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, OptimizeError
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.annotate_types import annotate_types
+from sqlglot.schema import ensure_schema
+
+# --------------- LOCAL SQL VALIDATION --------------- #
+
+READ_ONLY_STATEMENTS = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+REPAIR_CUTOFF = 0.75  # difflib ratio needed to swap an unknown identifier for a dictionary one
+
+# Identifiers named by Snowflake / local validation errors
+IDENTIFIER_ERROR = re.compile(
+    r"invalid identifier '([^']+)'|Object '([^']+)' does not exist|Column '([^']+)' could not be resolved"
+    r"|Unknown column: (\w+)|Table ([\w.]+) does not exist", re.I)
+
+
+class SQLValidator:
+    """Checks generated Snowflake SQL against the cached data dictionary, without any LLM call.
+
+    - the query parses and is a read-only SELECT
+    - every table uses the <schema_name>.<table_name> format and exists
+    - every column resolves (aliases, CTEs and subqueries included) via sqlglot's qualify
+    """
+
+    def __init__(self, records, database):
+        self.database = database.upper()
+        self.tables = defaultdict(dict)  # (schema, table) -> {column: type}
+        for r in records:
+            self.tables[(r["TABLE_SCHEMA"].upper(), r["TABLE_NAME"].upper())][r["COLUMN_NAME"].upper()] = r.get("DATA_TYPE") or "VARCHAR"
+        self._mapping = defaultdict(dict)
+        for (schema, table), columns in self.tables.items():
+            self._mapping[schema][table] = columns
+        self._schema = ensure_schema(dict(self._mapping), dialect="snowflake")
+
+    @classmethod
+    def from_dataframe(cls, dd_df, database):
+        return cls(dd_df.to_dict(orient="records"), database)
+
+    def parse(self, sql):
+        return sqlglot.parse_one(sql.strip().rstrip(";"), read="snowflake")
+
+    def errors(self, sql):
+        """List of problems found in the query; empty when it is valid."""
+        try:
+            expression = self.parse(sql)
+        except ParseError as e:
+            return ["Syntax error: " + "; ".join(f"{err['description']} (line {err['line']}, col {err['col']})" for err in e.errors)]
+        if not isinstance(expression, READ_ONLY_STATEMENTS):
+            return [f"Only SELECT queries are allowed, got {expression.key.upper()}."]
+
+        errors = []
+        ctes = {cte.alias_or_name.upper() for cte in expression.find_all(exp.CTE)}
+        for table in expression.find_all(exp.Table):
+            name = table.name.upper()
+            if not name or name in ctes or isinstance(table.this, exp.Func):
+                continue
+            schema = table.db.upper()
+            if not schema:
+                errors.append(f"Table {name} must use the <schema_name>.<table_name> format.")
+                continue
+            if table.catalog and table.catalog.upper() != self.database:
+                errors.append(f"Table {table.sql(dialect='snowflake')} is not in database {self.database}.")
+                continue
+            if (schema, name) not in self.tables:
+                errors.append(f"Table {schema}.{name} does not exist.")
+        if errors:
+            return errors
+
+        try:
+            qualify(expression.copy(), schema=dict(self._mapping), dialect="snowflake",
+                    validate_qualify_columns=True, identify=False)
+        except OptimizeError as e:
+            errors.append(f"Column error: {e}")
+        except Exception as e:
+            # qualify does not know every Snowflake construct; don't block the query on it
+            print("❌ Local SQL validation skipped:", e)
+        return errors
+
+    def output_types(self, sql):
+        """{result column: sqlglot DataType} of a query, typed from the data dictionary; {} when it does not resolve."""
+        try:
+            expression = qualify(self.parse(sql), schema=self._schema, dialect="snowflake", identify=False)
+            expression = annotate_types(expression, schema=self._schema, dialect="snowflake")
+        except Exception:
+            return {}
+        return {select.alias_or_name: select.type or exp.DataType.build("UNKNOWN") for select in expression.selects}
+
+
+    # --------------- LOCAL REPAIR --------------- #
+
+    def repair(self, sql, errors=()):
+        """Try to fix bad identifiers without an LLM.
+
+        Adds a missing schema, replaces unknown tables/columns by their closest match in the
+        data dictionary (restricted to the tables the query uses) and unquotes identifiers
+        that only fail because of their case. `errors` (Snowflake or local messages) add the
+        identifiers Snowflake rejected. Returns (repaired_sql, fixes) or (None, []) when
+        nothing could be fixed or the result still does not validate.
+        """
+        try:
+            expression = self.parse(sql)
+        except ParseError:
+            return None, []
+        rejected = {name.split(".")[-1].strip('"').upper() for e in errors for name in IDENTIFIER_ERROR.findall(e) for name in name if name}
+        fixes = []
+
+        ctes = {cte.alias_or_name.upper() for cte in expression.find_all(exp.CTE)}
+        used_tables = set()
+        for table in expression.find_all(exp.Table):
+            name = table.name.upper()
+            if not name or name in ctes or isinstance(table.this, exp.Func):
+                continue
+            schema = table.db.upper()
+            resolved = self._resolve_table(schema, name)
+            if resolved is None:
+                continue
+            if resolved != (schema, name) or table.this.quoted or (table.args.get("db") and table.args["db"].quoted):
+                fixes.append(f"{'.'.join(p for p in (table.db, table.name) if p)} -> {resolved[0]}.{resolved[1]}")
+                table.set("this", exp.to_identifier(resolved[1]))
+                table.set("db", exp.to_identifier(resolved[0]))
+            used_tables.add(resolved)
+
+        known_columns = {c for t in used_tables for c in self.tables[t]}
+        aliases = {a.alias.upper() for a in expression.find_all(exp.Alias)} | ctes
+        aliases |= {t.alias.upper() for t in expression.find_all(exp.Table) if t.alias}
+        for column in expression.find_all(exp.Column):
+            if isinstance(column.this, exp.Star):
+                continue
+            name = column.name.upper()
+            if column.table and column.table.upper() in ctes:
+                continue
+            if name in known_columns:
+                if column.this.quoted and column.name != name:
+                    fixes.append(f'"{column.name}" -> {name}')
+                    column.set("this", exp.to_identifier(name))
+                continue
+            if name in aliases and name not in rejected:
+                continue
+            match = difflib.get_close_matches(name, known_columns, n=1, cutoff=REPAIR_CUTOFF)
+            if match:
+                fixes.append(f"{column.name} -> {match[0]}")
+                column.set("this", exp.to_identifier(match[0]))
+
+        if not fixes:
+            return None, []
+        fixes = list(dict.fromkeys(fixes))
+        repaired = expression.sql(dialect="snowflake")
+        if self.errors(repaired):
+            return None, []
+        return repaired, fixes
+
+    def _resolve_table(self, schema, name):
+        if (schema, name) in self.tables:
+            return schema, name
+        schemas = [schema] if schema else sorted({s for s, _ in self.tables})
+        candidates = {t: s for s, t in self.tables if s in schemas}
+        if name in candidates:
+            return candidates[name], name
+        match = difflib.get_close_matches(name, candidates, n=1, cutoff=REPAIR_CUTOFF)
+        return (candidates[match[0]], match[0]) if match else None
+
+    def error_summary(self, sql, errors):
+        """Structured description of a failure for the LLM retry, with close dictionary matches."""
+        lines = [f"Failed query:\n{sql}", "Errors:"]
+        lines += [f"- {e}" for e in errors]
+        names = {name.split(".")[-1].strip('"').upper() for e in errors for name in IDENTIFIER_ERROR.findall(e) for name in name if name}
+        all_columns = {c for cols in self.tables.values() for c in cols}
+        all_tables = {f"{s}.{t}" for s, t in self.tables}
+        for name in sorted(names):
+            close = difflib.get_close_matches(name, all_columns | all_tables, n=3, cutoff=0.5)
+            if close:
+                lines.append(f"- {name} is unknown, did you mean: {', '.join(close)}?")
+        return "\n".join(lines)
+
+
+def explain_sql(pool, sql):
+    """Compile the query with Snowflake EXPLAIN (no warehouse needed); returns an error or None."""
+    try:
+        with pool.cursor() as cursor:
+            cursor.execute(f"EXPLAIN USING TEXT {sql.strip().rstrip(';')}")
+            cursor.fetchall()
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    return None
+
+
+def add_row_limit(sql, limit):
+    """The query with a LIMIT that lets Snowflake stop scanning early, or None when a LIMIT would not
+    bound its cost (aggregates, GROUP BY, DISTINCT, ORDER BY or window functions need every row)."""
+    try:
+        expression = sqlglot.parse_one(sql.strip().rstrip(";"), read="snowflake")
+    except ParseError:
+        return None
+    if not isinstance(expression, exp.Select):
+        return None
+    for select in expression.find_all(exp.Select):
+        if any(select.args.get(arg) for arg in ("group", "order", "distinct", "having", "qualify")):
+            return None
+    if expression.find(exp.AggFunc, exp.Window):
+        return None
+    current = expression.args.get("limit")
+    if current is not None and isinstance(current.expression, exp.Literal) and int(current.expression.name) <= limit:
+        return sql
+    return expression.limit(limit).sql(dialect="snowflake")
+
+# --------------- AGGREGATION PUSHDOWN --------------- #
+
+PUSHDOWN_CHART_TYPES = ("line", "bar", "area")  # scatter charts keep their points (binned client-side)
+PUSHDOWN_AGGREGATES = {"sum": "SUM", "avg": "AVG", "min": "MIN", "max": "MAX", "count": "COUNT"}
+# DATE_TRUNC grains from the finest, with their (average) length in seconds
+TIME_GRAINS = (("second", 1), ("minute", 60), ("hour", 3600), ("day", 86_400), ("week", 604_800),
+               ("month", 2_629_800), ("quarter", 7_889_400), ("year", 31_557_600))
+DATE_GRAINS = TIME_GRAINS[3:]
+OTHER_CATEGORY = "Other"
+
+
+def _aggregates(expression):
+    """True when some SELECT of the query groups, deduplicates or aggregates its rows."""
+    for select in expression.find_all(exp.Select):
+        if any(select.args.get(arg) for arg in ("group", "distinct", "having", "qualify")):
+            return True
+    return expression.find(exp.AggFunc, exp.Window) is not None
+
+
+def _quote(name):
+    return exp.to_identifier(name, quoted=True).sql(dialect="snowflake")
+
+
+class ChartPushdown:
+    """Rewrites a row-level chart query so that Snowflake groups it into chart-sized buckets.
+
+    Applies to line / bar / area charts of queries returning rows without aggregating them,
+    when the largest table they read (row counts of the column profiles) has more than
+    `max_points` rows. The type of the x column picks the grouping: DATE_TRUNC at the finest
+    grain giving at most `max_points` buckets for dates and timestamps, WIDTH_BUCKET over the
+    MIN..MAX range for numbers, the `top_categories` largest categories plus "Other" for the
+    rest. y columns are combined with the chart's aggregate, per series when there is one.
+    """
+
+    def __init__(self, max_points=2000, top_categories=50, row_counts=None):
+        self.max_points = max_points
+        self.top_categories = top_categories
+        self.row_counts = row_counts or {}  # (schema, table) -> rows
+
+    @classmethod
+    def from_config(cls, settings, profile=None):
+        """From the charts settings of config.yaml and the dataset's SchemaProfile (row counts), if any."""
+        row_counts = {}
+        if profile is not None:
+            row_counts = {(profile.schema.upper(), table.upper()): info.get("row_count") for table, info in profile.tables.items()}
+        return cls(settings["max_points"], settings["top_categories"], row_counts)
+
+    def estimate_rows(self, sql):
+        """Rows a row-level query can return: the largest table it reads, capped by its LIMIT.
+
+        None when the query already aggregates or reads a table without a known row count.
+        Filters are not estimated, so this is an upper bound.
+        """
+        try:
+            expression = sqlglot.parse_one(sql.strip().rstrip(";"), read="snowflake")
+        except ParseError:
+            return None
+        if not isinstance(expression, exp.Select) or _aggregates(expression):
+            return None
+        ctes = {cte.alias_or_name.upper() for cte in expression.find_all(exp.CTE)}
+        counts = [self.row_counts.get((table.db.upper(), table.name.upper()))
+                  for table in expression.find_all(exp.Table) if table.name.upper() not in ctes]
+        if not counts or None in counts:
+            return None
+        rows = max(counts)
+        limit = expression.args.get("limit")
+        if limit is not None and isinstance(limit.expression, exp.Literal) and limit.expression.is_int:
+            rows = min(rows, int(limit.expression.name))
+        return rows
+
+    def candidate(self, sql):
+        """Whether the query is large enough for a pushdown, whatever its chart."""
+        return (self.estimate_rows(sql) or 0) > self.max_points
+
+    def rewrite(self, validator, sql, chart):
+        """(grouped query, note) for a chart spec {"chart_type", "x", "y", "series", "aggregate"},
+        or (None, None) when the query or the chart does not qualify."""
+        if not chart or chart.get("chart_type") not in PUSHDOWN_CHART_TYPES:
+            return None, None
+        rows = self.estimate_rows(sql)
+        if rows is None or rows <= self.max_points:
+            return None, None
+        types = validator.output_types(sql)
+        by_name = {name.upper(): name for name in types}
+        x = by_name.get(str(chart.get("x") or "").upper())
+        ys = [by_name.get(str(y).upper()) for y in chart.get("y") or []]
+        series = by_name.get(str(chart.get("series") or "").upper()) if chart.get("series") else None
+        if x is None or not ys or None in ys or (chart.get("series") and series is None):
+            return None, None
+        aggregate = chart.get("aggregate") if chart.get("aggregate") in PUSHDOWN_AGGREGATES else "sum"
+        if aggregate != "count" and not all(types[y].is_type(*exp.DataType.NUMERIC_TYPES) for y in ys):
+            return None, None
+
+        function = PUSHDOWN_AGGREGATES[aggregate]
+        inner = sql.strip().rstrip(";")
+        column = lambda name: f'"_ROWS".{_quote(name)}'
+        measures = ", ".join(f"{function}({column(y)}) AS {_quote(y)}" for y in ys)
+        keys = f", {column(series)}" if series else ""
+        group = "GROUP BY 1, 2" if series else "GROUP BY 1"
+        x_type = types[x]
+        if x_type.is_type(*exp.DataType.TEMPORAL_TYPES):
+            grains = DATE_GRAINS if x_type.is_type(exp.DataType.Type.DATE) else TIME_GRAINS
+            cases = " ".join(f"WHEN \"_SECONDS\" < {self.max_points * seconds} THEN DATE_TRUNC('{grain}', {column(x)})"
+                             for grain, seconds in grains[:-1])
+            bucket = f"CASE {cases} ELSE DATE_TRUNC('{grains[-1][0]}', {column(x)}) END"
+            grouped = (f'WITH "_INNER" AS ({inner}), "_ROWS" AS (SELECT *, DATEDIFF(second, MIN({_quote(x)}) OVER (), '
+                       f'MAX({_quote(x)}) OVER ()) AS "_SECONDS" FROM "_INNER") '
+                       f'SELECT {bucket} AS {_quote(x)}{keys}, {measures} FROM "_ROWS" {group} ORDER BY 1')
+            how = "DATE_TRUNC at a grain fitting its range"
+        elif x_type.is_type(*exp.DataType.NUMERIC_TYPES):
+            n = self.max_points
+            bucket = (f'"_LO" + (LEAST(WIDTH_BUCKET({column(x)}, "_LO", IFF("_HI" > "_LO", "_HI", "_LO" + 1), {n}), {n}) - 1) '
+                      f'* ("_HI" - "_LO") / {n}')
+            grouped = (f'WITH "_INNER" AS ({inner}), "_ROWS" AS (SELECT *, MIN({_quote(x)}) OVER () AS "_LO", '
+                       f'MAX({_quote(x)}) OVER () AS "_HI" FROM "_INNER") '
+                       f'SELECT {bucket} AS {_quote(x)}{keys}, {measures} FROM "_ROWS" {group} ORDER BY 1')
+            how = f"WIDTH_BUCKET into {n:,} buckets"
+        else:
+            grouped = (f'WITH "_ROWS" AS ({inner}), "_TOP" AS (SELECT {_quote(x)} AS "_KEY" FROM "_ROWS" GROUP BY 1 '
+                       f'ORDER BY {function}({_quote(ys[0])}) DESC NULLS LAST LIMIT {self.top_categories}) '
+                       f'SELECT IFF("_TOP"."_KEY" IS NULL, \'{OTHER_CATEGORY}\', TO_VARCHAR({column(x)})) AS {_quote(x)}{keys}, {measures} '
+                       f'FROM "_ROWS" LEFT JOIN "_TOP" ON {column(x)} = "_TOP"."_KEY" {group}')
+            how = f"its {self.top_categories} largest values plus \"{OTHER_CATEGORY}\""
+        note = (f"Grouped in Snowflake for the chart: {x} by {how}, {function} of {', '.join(ys)} "
+                f"(the query reads tables of up to {rows:,} rows)")
+        return grouped, note
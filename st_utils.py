@@ -1,23 +1,52 @@
+import io
+import re
+import json
+import importlib
+import threading
 import streamlit as st
 import yaml
-from PIL import Image
 
 CONFIG_PATH = "config.yaml"
+AVATAR_SIZE = 96      # chat avatars are drawn at ~32px
+PORTRAIT_SIZE = 640   # the persona picture of the sidebar
 
 class Persona:
-    def __init__(self, name, character, avatar_path, avatar):
+    def __init__(self, name, character, avatar_path):
         self.name = name
         self.character = character
         self.avatar_path = avatar_path
-        self.avatar = avatar
+        self._images = {}
+
+    def image(self, size):
+        """The avatar file shrunk to fit `size` px, as PNG bytes; read on first use only.
+
+        Streamlit passes small PNG bytes through as they are, whereas a path or PIL image is
+        decoded, resized and re-encoded for every message on every rerun.
+        """
+        if size not in self._images:
+            from PIL import Image
+            with Image.open(self.avatar_path) as image:
+                image = image.convert("RGBA")
+                image.thumbnail((size, size))
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+            self._images[size] = buffer.getvalue()
+        return self._images[size]
+
+    @property
+    def avatar(self):
+        return self.image(AVATAR_SIZE)
 
 class Dataset:
-    def __init__(self, name, description, source, database, schema):
+    def __init__(self, name, description, source, database, schema, result_ttl, cost_guard, export):
         self.name = name
         self.description = description
         self.source = source
         self.database = database
         self.schema = schema
+        self.result_ttl = result_ttl
+        self.cost_guard = cost_guard
+        self.export = export
 
 @st.cache_data
 def load_config(file_path=CONFIG_PATH):
@@ -25,33 +54,77 @@ def load_config(file_path=CONFIG_PATH):
         config = yaml.safe_load(f)
     return config
 
-@st.cache_data
-def load_personas(config):
+# Built once per process from the (already cached) config: cache_resource returns the same
+# objects on every rerun instead of hashing the config and unpickling copies like cache_data
+@st.cache_resource
+def load_personas(_config):
     personas = {} 
-    for name, data in config["personas"].items(): 
+    for name, data in _config["personas"].items(): 
         personas[name] = Persona(
             name=name, 
             character=data.get("prompt", ""), 
-            avatar_path=data.get("avatar", ""), 
-            avatar=Image.open(data.get("avatar", ""))
+            avatar_path=data.get("avatar", "")
             )
     return personas
 
-@st.cache_data
-def load_sf_datasets(config):
+@st.cache_resource
+def load_sf_datasets(_config):
     sf_datasets = {} 
-    for name, data in config["sf_datasets"].items(): 
+    for name, data in _config["sf_datasets"].items(): 
         sf_datasets[name] = Dataset(
             name=name, 
             description=data.get("description", ""), 
             source="Snowflake", 
             database=data.get("database", ""), 
-            schema=data.get("schema", "")
+            schema=data.get("schema", ""),
+            result_ttl=data.get("result_ttl", 3600),
+            cost_guard={**_config.get("cost_guard", {}), **data.get("cost_guard", {})},
+            export={**_config.get("export", {}), **data.get("export", {})}
             )
     return sf_datasets
 
+@st.cache_resource
+def preload_modules(*names):
+    """Import modules in a background thread, once per process.
+
+    Started before the first page waits for input, so the agents SDK, OpenAI and Snowflake
+    clients are (mostly) imported by the time the script needs them.
+    """
+    def load():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"❌ Could not preload {name}:", e)
+    thread = threading.Thread(target=load, name="preload-modules", daemon=True)
+    thread.start()
+    return thread
+
+def partial_json_field(text, key):
+    """Decoded value so far of a string field in a JSON object that is still being streamed."""
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(key), text)
+    if not match:
+        return None
+    raw, i = [], match.end()
+    while i < len(text) and text[i] != '"':
+        step = 2 if text[i] == "\\" else 1
+        raw.append(text[i:i + step])
+        i += step
+    raw = "".join(raw)
+    # Drop an escape sequence cut in the middle (e.g. a trailing backslash or half a \uXXXX)
+    raw = re.sub(r"\\(u[0-9a-fA-F]{0,3})?$", "", raw)
+    raw = re.sub(r"\\u[dD][89abAB][0-9a-fA-F]{2}$", "", raw)
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
 def clear_chat_history(key="messages"):
     del st.session_state[key]
+    if "history_store" in st.session_state:
+        st.session_state["history_store"].clear()
+    if "result_workspace" in st.session_state:
+        st.session_state["result_workspace"].clear()
 
 if __name__ == '__main__': 
 